@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, send_from_directory, Response, current_app
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, send_from_directory, send_file, Response, current_app, g
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_mail import Mail, Message
 try:
@@ -6,28 +6,63 @@ try:
     COMPRESS_AVAILABLE = True
 except ImportError:
     COMPRESS_AVAILABLE = False
+from flask.cli import AppGroup
+import click
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import ClosingIterator
+from werkzeug.security import safe_join
 from sqlalchemy import inspect, text, func
 import os
+import json
 import uuid
 import re
 import traceback
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 try:
-    from utils.image_optimizer import convert_to_webp, optimize_image, WEBP_QUALITY
+    from utils.image_pipeline import enqueue_image_job, get_image_variants, srcset_candidates
+    from utils.variant_index import variant_index
     IMAGE_OPTIMIZATION_AVAILABLE = True
 except ImportError:
     IMAGE_OPTIMIZATION_AVAILABLE = False
+try:
+    from utils.pdf_pipeline import enqueue_pdf_job, get_pdf_assets, PIKEPDF_AVAILABLE, PDFIUM_AVAILABLE
+    PDF_PROCESSING_AVAILABLE = PIKEPDF_AVAILABLE or PDFIUM_AVAILABLE
+except ImportError:
+    PDF_PROCESSING_AVAILABLE = False
+try:
+    from utils.docx_renderer import enqueue_docx_job, get_docx_pages, pages_dir_for, render_failed as docx_render_failed, MAMMOTH_AVAILABLE
+    DOCX_RENDER_AVAILABLE = MAMMOTH_AVAILABLE
+except ImportError:
+    DOCX_RENDER_AVAILABLE = False
 try:
     from utils.db_backup import (
         backup_database, restore_database, list_backups, 
-        delete_backup, get_database_info, get_database_statistics
+        delete_backup, get_database_info, get_database_statistics,
+        start_backup_job, get_backup_job, backup_extension,
+        create_incremental_backup, restore_snapshot, list_snapshots, get_snapshot_usage, prune_snapshots,
+        start_statistics_recount
     )
     DB_BACKUP_AVAILABLE = True
 except ImportError:
     DB_BACKUP_AVAILABLE = False
+from utils.content_store import store_upload, release_blob, unlink_after_commit, is_blob_path, migrate_uploads, BLOBS_SUBDIR
+from utils.stream_slots import stream_slots, throttle
+from utils.asset_pipeline import (
+    build_assets, find_precompressed, guess_mimetype, is_hashed_asset, asset_manifest, read_precache_manifest,
+    COMPRESSIBLE_EXTENSIONS, SERVICE_WORKER_SOURCE
+)
+from utils.index_advisor import advise
+from utils.db_engine import init_engine, is_sqlite, wal_checkpointer
+from utils.db_restore import restore_coordinator, writes_database
+from utils.db_routing import db_router, read_only_route
+from utils.engagement import record_engagement, reconcile_counters, catalog_order, SORT_OPTIONS
+from utils.keyset import keyset_paginate
+from utils.eager_loading import eager, init_lazy_load_detection
+from utils.request_metrics import request_metrics
+from utils.slow_query_log import slow_query_log, slow_query_report, query_source
+from utils.retention import archive_tracking_data, read_archive, archived_totals, archived_visit_days, POLICY_BY_TABLE, ARCHIVE_FORMATS
 from models import db, User, Category, Material, AdminLog, MobilePaymentMethod, DownloadRecord, VisitorRecord, PageView, News, Subscription, SubscriptionPlan, PasswordResetToken, LimitedAccessDownload, TermsOfService, HelpRequest, TopUser, UserVisit, MpesaTransaction, MaterialView
 from forms import *
 from config import config
@@ -44,7 +79,8 @@ try:
     load_dotenv()
 except ImportError:
     pass
-app = Flask(__name__, static_url_path='/static', static_folder='static')
+app = Flask(__name__, static_url_path='/static', static_folder='static',
+            instance_path=os.environ.get('INSTANCE_PATH') or None)  # Absolute path, <repo>/instance by default
 env = os.environ.get('FLASK_ENV', 'development').lower()
 config_name = 'production' if env == 'production' else 'development'
 app.config.from_object(config[config_name])
@@ -108,6 +144,18 @@ def inject_total_users():
         except:
             _total_users_cache['count'] = 0
     return dict(total_users=_total_users_cache['count'])
+@app.template_global()
+def asset_url(path):
+    """URL of a CSS/JS asset through the build manifest (content-hashed, cached forever)"""
+    hashed_path = asset_manifest.resolve(path)
+    if hashed_path:
+        return url_for('static', filename=hashed_path)
+    # Not built yet (development): cache-bust the source with its mtime
+    try:
+        version = int(os.path.getmtime(os.path.join(app.static_folder, path)))
+    except OSError:
+        version = None
+    return url_for('static', filename=path, v=version)
 
 @app.template_filter('webp_image')
 def webp_image_filter(image_path):
@@ -119,6 +167,11 @@ def webp_image_filter(image_path):
     if image_path.lower().endswith('.webp'):
         return image_path
     
+    # Look the WebP sibling up in the in-memory variant index
+    if IMAGE_OPTIMIZATION_AVAILABLE:
+        entry = get_image_variants(image_path)
+        return entry['webp'] if entry and entry.get('webp') else image_path
+    
     # Generate WebP path
     base_path = os.path.splitext(image_path)[0]
     webp_path = f"{base_path}.webp"
@@ -130,6 +183,17 @@ def webp_image_filter(image_path):
     
     # Return original if WebP doesn't exist
     return image_path
+
+@app.template_filter('responsive_srcset')
+def responsive_srcset_filter(image_path, fmt='webp'):
+    """Build a srcset attribute value from the image variants manifest"""
+    if not image_path or not IMAGE_OPTIMIZATION_AVAILABLE:
+        return ''
+    entry = get_image_variants(image_path)
+    return ', '.join(
+        f"{url_for('static', filename=path)} {width}w"
+        for path, width in srcset_candidates(entry, fmt)
+    )
 @app.after_request
 def add_security_headers(response):
     """Add security headers and cache headers for all responses"""
@@ -177,7 +241,14 @@ def add_security_headers(response):
         response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains; preload'
     
     # Cache Headers
-    if request.endpoint == 'static':
+    static_filename = (request.view_args or {}).get('filename', '') if request.endpoint == 'static' else ''
+    if static_filename.startswith(f"{BLOBS_SUBDIR}/") or is_hashed_asset(static_filename):
+        # Blob and built asset URLs are named by content hash, so they never change
+        response.cache_control.max_age = 31536000
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    elif request.endpoint == 'static':
         response.cache_control.max_age = 31536000
         response.cache_control.public = True
         response.cache_control.must_revalidate = True
@@ -191,12 +262,38 @@ def add_security_headers(response):
     response.headers.add('Vary', 'Accept-Encoding')
     return response
 app.config['MAX_FORM_MEMORY_SIZE'] = 512 * 1024 * 1024
-db.init_app(app)
+if IMAGE_OPTIMIZATION_AVAILABLE:
+    try:
+        variant_index.build(app.static_folder)
+    except Exception as e:
+        print(f"Warning: could not build image variant index: {e}")
+stream_slots.init_app(app.config.get('STREAM_SLOT_DIR') or os.path.join(app.instance_path, 'stream_slots'))
+init_engine(app, db)
+db_router.init_app(app, db)
+init_lazy_load_detection(app)
+request_metrics.init_app(app)
+slow_query_log.init_app(app)
 mail = Mail(app)
 if COMPRESS_AVAILABLE:
     compress = Compress(app)
 else:
     print("Warning: flask_compress not installed. Compression disabled.")
+def send_static_asset(filename):
+    """Static view that serves `flask assets build` .br/.gz variants instead of compressing per request"""
+    full_path = safe_join(app.static_folder, filename)
+    if full_path and os.path.splitext(filename)[1] in COMPRESSIBLE_EXTENSIONS and 'Range' not in request.headers:
+        variant = find_precompressed(full_path, request.headers.get('Accept-Encoding'))
+        if variant:
+            variant_path, encoding = variant
+            resp = send_file(variant_path, mimetype=guess_mimetype(filename), conditional=True,
+                             max_age=app.get_send_file_max_age(filename))
+            # Content-Encoding also makes Flask-Compress leave the body alone
+            resp.headers['Content-Encoding'] = encoding
+            resp.vary.add('Accept-Encoding')
+            return resp
+    return app.send_static_file(filename)
+app.view_functions['static'] = send_static_asset
+asset_manifest.init_app(app.static_folder)
 from werkzeug.middleware.proxy_fix import ProxyFix
 env = os.environ.get('FLASK_ENV', 'development').lower()
 if env == 'production':
@@ -215,11 +312,34 @@ def load_user(user_id):
         traceback.print_exc()
         return None
 @app.before_request
+def database_maintenance_gate():
+    """Hold writes while a database restore runs in any worker"""
+    if not restore_coordinator.sync():
+        return None
+    g.database_paused = True
+    view = app.view_functions.get(request.endpoint)
+    if request.method in ('GET', 'HEAD', 'OPTIONS') and not getattr(view, 'writes_database', False):
+        return None
+    if restore_coordinator.wait_until_writable(app.config.get('RESTORE_GATE_WAIT', 15)):
+        g.database_paused = False
+        return None
+    message = 'The database is being restored, please try again in a moment.'
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'success': False, 'message': message})
+    else:
+        response = Response(message, mimetype='text/plain')
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+@app.before_request
+@query_source('track_visitor')
 def track_visitor():
     """Track website visitors and page views"""
-    if request.path in ['/sitemap.xml', '/sitemap', '/sitemap/', '/robots.txt']:
+    if g.get('database_paused'):
+        return None
+    if request.path in ['/sitemap.xml', '/sitemap', '/sitemap/', '/robots.txt', '/sw.js']:
         return None
-    if not request.endpoint or request.endpoint.startswith('static') or 'admin' in request.endpoint or request.endpoint.startswith('video') or request.endpoint.startswith('track_') or request.endpoint in ['sitemap', 'sitemap_xml', 'sitemap_slash', 'robots_txt']:
+    if not request.endpoint or request.endpoint.startswith('static') or 'admin' in request.endpoint or request.endpoint.startswith('video') or request.endpoint.startswith('track_') or request.endpoint in ['sitemap', 'sitemap_xml', 'sitemap_slash', 'robots_txt', 'service_worker']:
         return
     if request.is_json or request.headers.get('Content-Type', '').startswith('application/json'):
         return
@@ -462,38 +582,88 @@ def save_file(file, folder):
             os.makedirs(target_dir, exist_ok=True)
             file_path = os.path.join(target_dir, filename)
             file.save(file_path)
+            if IMAGE_OPTIMIZATION_AVAILABLE:
+                variant_index.add_file(f"uploads/{folder}/{filename}")
             
-            # Optimize image to WebP if it's an image file and optimization is available
+            # WebP conversion and responsive variants are generated in the
+            # background so large photos don't block the admin form submit
             if is_image and IMAGE_OPTIMIZATION_AVAILABLE:
-                try:
-                    webp_filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.webp"
-                    webp_path = os.path.join(target_dir, webp_filename)
-                    
-                    # Convert to WebP with HD quality for clean, crisp images
-                    convert_to_webp(
-                        file_path,
-                        webp_path,
-                        quality=WEBP_QUALITY,  # HD quality (92) for clean images
-                        preserve_original=True,  # Keep original as fallback
-                        sharpen=True,  # Apply sharpening for crisp HD images
-                        maintain_hd=True  # Ensure HD quality standards
-                    )
-                    
-                    # Return WebP filename but keep original as fallback
-                    return webp_filename
-                except Exception as e:
-                    try:
-                        app.logger.error(f"Error optimizing image to WebP: {e}")
-                    except:
-                        print(f"Error optimizing image to WebP: {e}")
-                    # Return original filename if optimization fails
-                    return filename
+                queue_image_variants(file_path)
             
             return filename
         except Exception as e:
             current_app.logger.error(f"Upload save error: {e}")
             return None
     return None
+def save_material_file(file):
+    """Store a material file in the content-addressed store, returns the StoredBlob or None"""
+    if not (file and allowed_file(file.filename)):
+        return None
+    try:
+        blob, deduplicated = store_upload(file, app.static_folder)
+        if deduplicated:
+            app.logger.info(f"Upload matched existing blob {blob.sha256[:12]}, {blob.size} bytes saved")
+        return blob
+    except Exception as e:
+        current_app.logger.error(f"Upload save error: {e}")
+        db.session.rollback()
+        return None
+def remove_material_file(file_path):
+    """Release a material file: blobs are reference counted, legacy uploads are deleted"""
+    if is_blob_path(file_path):
+        release_blob(file_path, app.static_folder)
+        return True
+    full_path = os.path.join(app.static_folder, file_path)
+    if os.path.exists(full_path):
+        unlink_after_commit(full_path)
+        return True
+    return False
+def queue_pdf_processing(file_path):
+    """Enqueue linearization, previews and page counting for a static-relative PDF path"""
+    if not PDF_PROCESSING_AVAILABLE:
+        return
+    def _record_page_count(result):
+        if not result.get('pages'):
+            return
+        with app.app_context():
+            Material.query.filter_by(file_path=file_path).update({'pages': result['pages']})
+            db.session.commit()
+    try:
+        enqueue_pdf_job(
+            os.path.join(app.static_folder, file_path),
+            on_done=_record_page_count,
+            max_workers=app.config.get('IMAGE_PROCESSING_WORKERS', 2),
+            preview_pages=app.config.get('PDF_PREVIEW_PAGES', 3),
+            preview_width=app.config.get('PDF_PREVIEW_WIDTH', 480)
+        )
+    except Exception as e:
+        app.logger.error(f"Error queueing PDF processing for {file_path}: {e}")
+def queue_docx_render(file_path, max_workers=None):
+    """Enqueue sanitized HTML pre-rendering for a static-relative DOCX path"""
+    if not DOCX_RENDER_AVAILABLE:
+        return
+    if max_workers is None:
+        max_workers = app.config.get('IMAGE_PROCESSING_WORKERS', 2)
+    try:
+        enqueue_docx_job(
+            os.path.join(app.static_folder, file_path),
+            f"{app.static_url_path}/{pages_dir_for(file_path)}",
+            max_workers=max_workers
+        )
+    except Exception as e:
+        app.logger.error(f"Error queueing DOCX render for {file_path}: {e}")
+def queue_image_variants(file_path):
+    """Enqueue WebP/AVIF variant generation for a saved image"""
+    formats = ('webp', 'avif') if app.config.get('IMAGE_AVIF_ENABLED') else ('webp',)
+    try:
+        enqueue_image_job(
+            file_path,
+            app.static_folder,
+            formats=formats,
+            max_workers=app.config.get('IMAGE_PROCESSING_WORKERS', 2)
+        )
+    except Exception as e:
+        app.logger.error(f"Error queueing image variants for {file_path}: {e}")
 def get_file_format(filename):
     """Extract file format from filename"""
     if '.' in filename:
@@ -518,6 +688,7 @@ def log_admin_action(action, table_name=None, record_id=None, details=None):
 @app.route('/sitemap.xml', strict_slashes=False, endpoint='sitemap_xml', methods=['GET'])
 @app.route('/sitemap', strict_slashes=False, endpoint='sitemap', methods=['GET'])
 @app.route('/sitemap/', strict_slashes=False, endpoint='sitemap_slash', methods=['GET'])
+@read_only_route
 def sitemap():
     """Generate dynamic sitemap.xml for SEO"""
     try:
@@ -585,18 +756,18 @@ def sitemap():
         response.headers['X-Content-Type-Options'] = 'nosniff'
         return response
 @app.route('/')
+@read_only_route
 def index():
-    page = request.args.get('page', 1, type=int)
-    materials_query = Material.query.options(
-        db.joinedload(Material.category)
-    ).filter_by(is_active=True).order_by(Material.created_at.desc())
-    materials = materials_query.paginate(
-        page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False
-    )
+    sort = request.args.get('sort', 'newest')
+    materials_query = Material.query.options(*eager(Material)).filter_by(is_active=True)
+    materials = keyset_paginate(materials_query, catalog_order(sort), request.args.get('cursor'),
+                                per_page=app.config['ITEMS_PER_PAGE'])
     categories = Category.query.filter_by(is_active=True).order_by(Category.name).all()
     return render_template('index.html',
                          materials=materials,
-                         categories=categories)
+                         categories=categories,
+                         sort=sort,
+                         sort_options=SORT_OPTIONS)
 @app.route('/material/<int:material_id>')
 def material_detail(material_id):
     material = Material.query.options(
@@ -1054,6 +1225,8 @@ def mpesa_callback():
             return jsonify({'status': 'error', 'message': 'Transaction not found'}), 404
         transaction.response_payload = callback_data
         if response_code == "INS-0" or response_code == "0" or (isinstance(response_code, str) and "success" in response_desc.lower()):
+            # M-Pesa retries callbacks; only the first one counts the purchase
+            newly_completed = transaction.status != 'completed'
             transaction.status = 'completed'
             transaction.error_message = None
             subscription_id = request.args.get('subscription_id') or None
@@ -1093,6 +1266,9 @@ def mpesa_callback():
                             download_type='purchase'
                         )
                         db.session.add(download_record)
+                        record_engagement(material.id, download_count=1)
+                    if newly_completed:
+                        record_engagement(material.id, purchase_count=1)
                     log_admin_action(
                         'mpesa_payment_completed',
                         'mpesa_transactions',
@@ -1118,6 +1294,7 @@ def mpesa_callback():
         db.session.rollback()
         return jsonify({'status': 'error', 'message': str(e)}), 200
 @app.route('/stream/<int:material_id>')
+@writes_database
 @login_required
 def stream_video(material_id):
     """Stream video content"""
@@ -1148,8 +1325,49 @@ def stream_video(material_id):
                 view_count=1
             )
             db.session.add(material_view)
+            record_engagement(material_id, view_count=1)
             db.session.commit()
-    return render_template('video_player.html', material=material)
+    # Offline copies are a subscriber feature; free views are one-shot by design
+    can_save_offline = current_user.is_admin or current_user.has_active_access()
+    return render_template('video_player.html', material=material, can_save_offline=can_save_offline)
+def acquire_stream_slot(material_id):
+    """Reserve a concurrent media stream slot for the current user and IP, or None when full"""
+    limits = {
+        'global': app.config.get('STREAM_SLOTS_GLOBAL', 0),
+        f"user:{current_user.id}": app.config.get('STREAM_SLOTS_PER_USER', 0),
+        f"ip:{request.remote_addr}": app.config.get('STREAM_SLOTS_PER_IP', 0)
+    }
+    info = {
+        'user_id': current_user.id,
+        'ip': request.remote_addr,
+        'material_id': material_id,
+        'endpoint': request.endpoint,
+        'range': request.headers.get('Range')
+    }
+    try:
+        return stream_slots.acquire(limits, info)
+    except OSError as e:
+        # Slot bookkeeping must never take media serving down with it
+        app.logger.error(f"Stream slot error: {e}")
+        return stream_slots.acquire({})
+def streams_full_response():
+    """429 response for a client that has used up its stream slots"""
+    retry_after = app.config.get('STREAM_RETRY_AFTER', 10)
+    resp = jsonify({'success': False, 'message': 'Too many concurrent streams. Please close other videos or downloads and try again.'})
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(retry_after)
+    return resp
+def finish_stream_response(resp, slot):
+    """Hold the slot until the body is fully sent, shaping throughput when configured"""
+    rate_kbps = app.config.get('STREAM_RATE_LIMIT_KBPS', 0)
+    body = resp.response
+    if rate_kbps and resp.is_streamed:
+        body = throttle(body, rate_kbps * 1024)
+    # direct_passthrough bodies go straight to the server, bypassing
+    # call_on_close, so the body itself has to release the slot
+    resp.response = ClosingIterator(body, slot.release)
+    resp.call_on_close(slot.release)
+    return resp
 def _guess_video_mime(ext):
     mapping = {
         'mp4': 'video/mp4',
@@ -1186,6 +1404,9 @@ def video_content(material_id):
     range_header = request.headers.get('Range', None)
     ext = get_file_format(os.path.basename(full_path))
     mime = _guess_video_mime(ext)
+    slot = acquire_stream_slot(material_id)
+    if slot is None:
+        return streams_full_response()
     def generate(start_byte: int, end_byte: int, chunk_size: int = 1024 * 1024):
         with open(full_path, 'rb') as f:
             f.seek(start_byte)
@@ -1218,7 +1439,7 @@ def video_content(material_id):
             resp.headers.add('Content-Range', f'bytes {start}-{end}/{file_size}')
             resp.headers.add('Accept-Ranges', 'bytes')
             resp.headers.add('Content-Length', str(end - start + 1))
-            return resp
+            return finish_stream_response(resp, slot)
         except Exception:
             pass
     resp = Response(
@@ -1228,7 +1449,7 @@ def video_content(material_id):
     )
     resp.headers.add('Content-Length', str(file_size))
     resp.headers.add('Accept-Ranges', 'bytes')
-    return resp
+    return finish_stream_response(resp, slot)
 @app.route('/track_video_progress', methods=['POST'])
 @login_required
 def track_video_progress():
@@ -1253,6 +1474,7 @@ def track_video_completion():
     except Exception:
         return jsonify({'success': False}), 400
 @app.route('/read/<int:material_id>')
+@writes_database
 @login_required
 def read_material(material_id):
     """Online reading/viewing of materials"""
@@ -1284,6 +1506,7 @@ def read_material(material_id):
                 view_count=1
             )
             db.session.add(material_view)
+            record_engagement(material_id, view_count=1)
             db.session.commit()
         access_status = "limited"
     if not material.file_path:
@@ -1310,12 +1533,39 @@ def read_material(material_id):
         access_type = "subscription" if current_user.has_active_access() else "limited"
         log_admin_action(f'{access_type}_material_view', 'materials', material_id, f'{access_type.title()} material view: {material.title}')
     file_url = url_for('static', filename=material.file_path)
+    preview_urls = []
+    if actual_extension == 'pdf' and PDF_PROCESSING_AVAILABLE:
+        # Linearized copy lets the browser viewer fetch pages with byte ranges
+        pdf_assets = get_pdf_assets(app.static_folder, material.file_path)
+        file_url = url_for('static', filename=pdf_assets['file_path'])
+        preview_urls = [url_for('static', filename=path) for path in pdf_assets['previews']]
+    docx_first_page = None
+    docx_page_urls = []
+    if actual_extension == 'docx' and DOCX_RENDER_AVAILABLE:
+        docx_pages = get_docx_pages(app.static_folder, material.file_path)
+        if docx_pages:
+            try:
+                with open(os.path.join(app.static_folder, docx_pages[0]), encoding='utf-8') as f:
+                    docx_first_page = f.read()
+                docx_page_urls = [url_for('static', filename=path) for path in docx_pages[1:]]
+            except OSError as e:
+                app.logger.error(f"Error reading rendered DOCX page for material {material_id}: {e}")
+        elif not docx_render_failed(app.static_folder, material.file_path):
+            # Not rendered yet (uploaded before the renderer existed), render for next time;
+            # a DOCX whose render failed is not resubmitted until the file changes
+            queue_docx_render(material.file_path)
+    can_save_offline = actual_extension == 'pdf' and (current_user.is_admin or current_user.has_active_access())
     return render_template('read_material.html',
                          material=material,
                          file_url=file_url,
                          file_format=actual_extension,
-                         can_view_online=can_view_online)
+                         can_view_online=can_view_online,
+                         can_save_offline=can_save_offline,
+                         preview_urls=preview_urls,
+                         docx_first_page=docx_first_page,
+                         docx_page_urls=docx_page_urls)
 @app.route('/download/<int:material_id>')
+@writes_database
 @login_required
 def download_material(material_id):
     """Download material based on trial/subscription access, optionally in different format"""
@@ -1335,6 +1585,7 @@ def download_material(material_id):
                 view_count=1
             )
             db.session.add(material_view)
+            record_engagement(material_id, view_count=1)
             db.session.commit()
         access_status = "limited"
     if access_status == "limited":
@@ -1361,6 +1612,23 @@ def download_material(material_id):
     actual_extension = get_file_format(os.path.basename(full_file_path))
     file_to_download = full_file_path
     download_name = f"{material.title}.{actual_extension}"
+    # Reserve the slot before any download is counted against the user
+    slot = acquire_stream_slot(material_id)
+    if slot is None:
+        return streams_full_response()
+    try:
+        resp = _send_material_download(material, access_status, file_to_download, download_name, actual_extension)
+    except Exception:
+        slot.release()
+        raise
+    if resp.status_code >= 300:
+        # Redirects (subscription limit reached) and 304s carry no body
+        slot.release()
+        return resp
+    return finish_stream_response(resp, slot)
+def _send_material_download(material, access_status, file_to_download, download_name, actual_extension):
+    """Record the download against the user's access and send the file"""
+    material_id = material.id
     if access_status == "limited":
         download_type = "video" if material.is_video else "document"
         limited_download = LimitedAccessDownload(
@@ -1369,6 +1637,7 @@ def download_material(material_id):
             download_type=download_type
         )
         db.session.add(limited_download)
+        record_engagement(material_id, download_count=1)
         db.session.commit()
         log_admin_action('limited_download', 'materials', material_id, f'Limited access download: {material.title}')
     else:
@@ -1396,15 +1665,15 @@ def download_material(material_id):
         download_name=download_name
     )
 @app.route('/search')
+@read_only_route
+@query_source('search')
 def search():
     query = request.args.get('q', '')
     category_id = request.args.get('category', type=int)
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
-    page = request.args.get('page', 1, type=int)
-    materials_query = Material.query.options(
-        db.joinedload(Material.category)
-    ).filter_by(is_active=True)
+    sort = request.args.get('sort', 'newest')
+    materials_query = Material.query.options(*eager(Material)).filter_by(is_active=True)
     if query:
         materials_query = materials_query.filter(
             Material.title.contains(query) |
@@ -1412,9 +1681,8 @@ def search():
         )
     if category_id:
         materials_query = materials_query.filter_by(category_id=category_id)
-    materials = materials_query.order_by(Material.created_at.desc()).paginate(
-        page=page, per_page=app.config['ITEMS_PER_PAGE'], error_out=False
-    )
+    materials = keyset_paginate(materials_query, catalog_order(sort), request.args.get('cursor'),
+                                per_page=app.config['ITEMS_PER_PAGE'], with_total=True)
     categories = Category.query.filter_by(is_active=True).order_by(Category.name).all()
     return render_template('search_results.html',
                          materials=materials,
@@ -1422,7 +1690,9 @@ def search():
                          categories=categories,
                          selected_category=category_id,
                          min_price=min_price,
-                         max_price=max_price)
+                         max_price=max_price,
+                         sort=sort,
+                         sort_options=SORT_OPTIONS)
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -1666,23 +1936,27 @@ def admin_dashboard():
         except Exception as e:
             print(f"Error getting total_page_views: {e}")
             total_page_views = 0
+        try:
+            # Rows archived by `flask db archive-tracking` still count. Unique
+            # visitors stays live-only: archived rows are not distinct IPs.
+            archived = archived_totals()
+            total_visitors += archived.get('visitors', {}).get('rows', 0)
+            total_page_views += archived.get('page_views', {}).get('rows', 0)
+        except Exception as e:
+            print(f"Error getting archived tracking totals: {e}")
         try:
             recent_users = User.query.order_by(User.created_at.desc()).limit(5).all()
         except Exception as e:
             print(f"Error getting recent_users: {e}")
             recent_users = []
         try:
-            recent_materials = Material.query.options(
-                db.joinedload(Material.category)
-            ).order_by(Material.created_at.desc()).limit(5).all()
+            recent_materials = Material.query.options(*eager(Material)).order_by(Material.created_at.desc()).limit(5).all()
         except Exception as e:
             print(f"Error getting recent_materials: {e}")
             traceback.print_exc()
             recent_materials = []
         try:
-            recent_subscriptions = Subscription.query.options(
-                db.joinedload(Subscription.user)
-            ).order_by(Subscription.created_at.desc()).limit(5).all()
+            recent_subscriptions = Subscription.query.options(*eager(Subscription)).order_by(Subscription.created_at.desc()).limit(5).all()
         except Exception as e:
             print(f"Error getting recent_subscriptions: {e}")
             recent_subscriptions = []
@@ -1696,6 +1970,7 @@ def admin_dashboard():
                              total_plans=total_plans,
                              total_visitors=total_visitors,
                              unique_visitors=unique_visitors,
+                             retention_days=app.config.get('TRACKING_RETENTION_DAYS'),
                              total_page_views=total_page_views,
                              recent_users=recent_users,
                              recent_materials=recent_materials,
@@ -1716,10 +1991,8 @@ def admin_users():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('index'))
-    page = request.args.get('page', 1, type=int)
-    users = User.query.paginate(
-        page=page, per_page=app.config['ADMIN_ITEMS_PER_PAGE'], error_out=False
-    )
+    users = keyset_paginate(User.query, [User.created_at.desc()], request.args.get('cursor'),
+                            per_page=app.config['ADMIN_ITEMS_PER_PAGE'], with_total=True)
     return render_template('admin/users.html', users=users)
 @app.route('/admin/users/<int:user_id>/details')
 @login_required
@@ -1829,10 +2102,8 @@ def admin_materials():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('index'))
-    page = request.args.get('page', 1, type=int)
-    materials = Material.query.options(db.joinedload(Material.category)).paginate(
-        page=page, per_page=app.config['ADMIN_ITEMS_PER_PAGE'], error_out=False
-    )
+    materials = keyset_paginate(Material.query.options(*eager(Material)), [Material.created_at.desc()],
+                                request.args.get('cursor'), per_page=app.config['ADMIN_ITEMS_PER_PAGE'], with_total=True)
     return render_template('admin/materials.html', materials=materials)
 @app.route('/admin/materials/add', methods=['GET', 'POST'])
 @login_required
@@ -1861,13 +2132,13 @@ def admin_add_material():
             video_quality=form.video_quality.data
         )
         if form.file.data:
-            filename = save_file(form.file.data, 'materials')
-            if filename:
-                material.file_path = f"uploads/materials/{filename}"
-                material.file_format = get_file_format(filename)
-                if is_video_file(filename):
+            blob = save_material_file(form.file.data)
+            if blob:
+                material.file_path = blob.file_path
+                material.file_format = get_file_format(blob.file_path)
+                if is_video_file(blob.file_path):
                     material.is_video = True
-                    file_size = os.path.getsize(os.path.join(app.config['UPLOAD_FOLDER'], 'materials', filename))
+                    file_size = blob.size
                     if file_size > 100 * 1024 * 1024:
                         material.video_quality = 'HD'
                     elif file_size > 50 * 1024 * 1024:
@@ -1891,6 +2162,10 @@ def admin_add_material():
                 material.video_thumbnail = f"uploads/images/{filename}"
         db.session.add(material)
         db.session.commit()
+        if form.file.data and material.file_format == 'pdf':
+            queue_pdf_processing(material.file_path)
+        elif form.file.data and material.file_format == 'docx':
+            queue_docx_render(material.file_path)
         log_admin_action('Added material', 'materials', material.id, f"Title: {material.title}")
         flash('Material added successfully!', 'success')
         return redirect(url_for('admin_materials'))
@@ -1901,11 +2176,9 @@ def admin_subscriptions():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('index'))
-    page = request.args.get('page', 1, type=int)
-    subscriptions = Subscription.query.options(
-        db.joinedload(Subscription.user)
-    ).paginate(
-        page=page, per_page=app.config['ADMIN_ITEMS_PER_PAGE'], error_out=False
+    subscriptions = keyset_paginate(
+        Subscription.query.options(*eager(Subscription)), [Subscription.created_at.desc()],
+        request.args.get('cursor'), per_page=app.config['ADMIN_ITEMS_PER_PAGE'], with_total=True
     )
     return render_template('admin/subscriptions.html', subscriptions=subscriptions)
 @app.route('/admin/subscriptions/add', methods=['GET', 'POST'])
@@ -1948,6 +2221,7 @@ def admin_edit_subscription(subscription_id):
         return redirect(url_for('admin_subscriptions'))
     return render_template('admin/subscription_form.html', form=form, title='Edit Subscription', action='edit')
 @app.route('/admin/subscriptions/delete/<int:subscription_id>')
+@writes_database
 @login_required
 def admin_delete_subscription(subscription_id):
     if not current_user.is_admin:
@@ -2060,6 +2334,7 @@ def subscriptions():
     plans = SubscriptionPlan.query.filter_by(is_active=True).order_by(SubscriptionPlan.sort_order, SubscriptionPlan.name).all()
     return render_template('subscriptions.html', plans=plans, material=material, material_id=material_id)
 @app.route('/subscription/purchase/<int:plan_id>', methods=['GET', 'POST'])
+@writes_database
 @login_required
 def purchase_subscription(plan_id):
     """Purchase a subscription plan with payment validation and duplicate prevention"""
@@ -2308,15 +2583,56 @@ def admin_visitor_stats():
         return redirect(url_for('index'))
     visitors = VisitorRecord.query.order_by(VisitorRecord.last_visit.desc()).limit(100).all()
     page_views = PageView.query.order_by(PageView.last_viewed.desc()).limit(100).all()
-    total_visitors = VisitorRecord.query.count()
+    archived = archived_totals()
+    total_visitors = VisitorRecord.query.count() + archived.get('visitors', {}).get('rows', 0)
+    # Distinct IPs of the live table only; archived visitor rows are not mergeable into it
     unique_visitors = db.session.query(func.count(func.distinct(VisitorRecord.ip_address))).scalar() or 0
-    total_page_views = PageView.query.count()
+    live_page_views = PageView.query.count()
+    total_page_views = live_page_views + archived.get('page_views', {}).get('rows', 0)
     return render_template('admin/visitor_stats.html',
                          visitors=visitors,
                          page_views=page_views,
                          total_visitors=total_visitors,
                          unique_visitors=unique_visitors,
+                         live_page_views=live_page_views,
+                         retention_days=app.config.get('TRACKING_RETENTION_DAYS'),
                          total_page_views=total_page_views)
+@app.route('/admin/streams')
+@login_required
+def admin_streams():
+    """Live occupancy of the concurrent media stream slots"""
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    scopes = stream_slots.snapshot()
+    user_ids = {stream.get('user_id') for scope in scopes for stream in scope['streams'] if stream.get('user_id')}
+    users = {user.id: user for user in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
+    now = datetime.now(timezone.utc).timestamp()
+    for scope in scopes:
+        started = [stream['started_at'] for stream in scope['streams'] if stream.get('started_at')]
+        scope['longest_seconds'] = int(now - min(started)) if started else 0
+        scope['material_ids'] = sorted({stream['material_id'] for stream in scope['streams'] if stream.get('material_id')})
+    return render_template('admin/streams.html',
+                         scopes=scopes,
+                         users=users,
+                         limits={
+                             'global': app.config.get('STREAM_SLOTS_GLOBAL', 0),
+                             'user': app.config.get('STREAM_SLOTS_PER_USER', 0),
+                             'ip': app.config.get('STREAM_SLOTS_PER_IP', 0),
+                             'rate_kbps': app.config.get('STREAM_RATE_LIMIT_KBPS', 0)
+                         })
+@app.route('/admin/performance')
+@login_required
+def admin_performance():
+    """Request latency, query counts and the slowest statements seen by this worker"""
+    if not current_user.is_admin:
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('index'))
+    return render_template('admin/performance.html',
+                         metrics=request_metrics.snapshot(),
+                         sample_size=app.config.get('PERF_SAMPLE_SIZE'),
+                         server_timing=app.config.get('SERVER_TIMING_HEADER'),
+                         worker_pid=os.getpid())
 @app.route('/admin/database')
 @login_required
 def admin_database():
@@ -2333,6 +2649,7 @@ def admin_database():
         db_info = get_database_info()
         db_stats = get_database_statistics()
         backups = list_backups()
+        snapshots = list_snapshots()
         
         # Calculate total backup size
         total_backup_size = sum(b['size'] for b in backups)
@@ -2342,7 +2659,9 @@ def admin_database():
                              db_stats=db_stats,
                              backups=backups,
                              total_backup_size=total_backup_size,
-                             backup_count=len(backups))
+                             backup_count=len(backups),
+                             snapshots=snapshots,
+                             snapshot_usage=get_snapshot_usage())
     except Exception as e:
         current_app.logger.error(f"Error loading database page: {e}")
         flash(f'Error loading database information: {str(e)}', 'error')
@@ -2357,18 +2676,55 @@ def admin_backup_database():
     if not DB_BACKUP_AVAILABLE:
         return jsonify({'success': False, 'message': 'Backup functionality not available'}), 500
     
+    payload = request.get_json(silent=True) or request.form
+    incremental = payload.get('kind') == 'incremental'
     try:
-        backup_result = backup_database()
-        log_admin_action('Created database backup', 'database', None, 
-                        f"Backup: {backup_result['backup_filename']}")
+        job = start_backup_job(incremental=incremental)
+        label = 'incremental snapshot' if job['kind'] == 'incremental' else job['backup_filename']
+        log_admin_action('Started database backup', 'database', None, 
+                        f"Backup: {label}")
         return jsonify({
             'success': True,
-            'message': f"Backup created successfully: {backup_result['backup_filename']}",
-            'backup': backup_result
-        })
+            'message': f"Backup started: {label}",
+            'job': job,
+            'status_url': url_for('admin_backup_status', job_id=job['id'])
+        }), 202
     except Exception as e:
         current_app.logger.error(f"Error creating backup: {e}")
         return jsonify({'success': False, 'message': f'Failed to create backup: {str(e)}'}), 500
+@app.route('/admin/database/backup/status/<job_id>')
+@login_required
+def admin_backup_status(job_id):
+    """Progress of a background database backup"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    if not DB_BACKUP_AVAILABLE:
+        return jsonify({'success': False, 'message': 'Backup functionality not available'}), 500
+    
+    job = get_backup_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Backup job not found'}), 404
+    return jsonify({'success': job['status'] != 'failed', 'job': job})
+@app.route('/admin/database/stats/recount', methods=['POST'])
+@login_required
+def admin_recount_database_stats():
+    """Start an exact background row count for the database statistics"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    if not DB_BACKUP_AVAILABLE:
+        return jsonify({'success': False, 'message': 'Statistics not available'}), 500
+    
+    try:
+        started = start_statistics_recount()
+        return jsonify({
+            'success': True,
+            'message': 'Exact row count started' if started else 'An exact row count is already running'
+        }), 202
+    except Exception as e:
+        current_app.logger.error(f"Error starting row count: {e}")
+        return jsonify({'success': False, 'message': f'Failed to start row count: {str(e)}'}), 500
 @app.route('/admin/database/restore', methods=['POST'])
 @login_required
 def admin_restore_database():
@@ -2389,12 +2745,38 @@ def admin_restore_database():
                         f"Restored from: {backup_filename}")
         return jsonify({
             'success': True,
-            'message': f"Database restored successfully from {backup_filename}. Please reload the application.",
+            'message': f"Database restored successfully from {backup_filename}.",
             'restore': restore_result
         })
     except Exception as e:
         current_app.logger.error(f"Error restoring database: {e}")
         return jsonify({'success': False, 'message': f'Failed to restore database: {str(e)}'}), 500
+@app.route('/admin/database/snapshot/restore', methods=['POST'])
+@login_required
+def admin_restore_snapshot():
+    """Restore database from an incremental snapshot"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    if not DB_BACKUP_AVAILABLE:
+        return jsonify({'success': False, 'message': 'Restore functionality not available'}), 500
+    
+    snapshot_id = request.form.get('snapshot_id')
+    if not snapshot_id:
+        return jsonify({'success': False, 'message': 'Snapshot id required'}), 400
+    
+    try:
+        restore_result = restore_snapshot(snapshot_id, create_backup=True)
+        log_admin_action('Restored database from snapshot', 'database', None,
+                        f"Restored from: {snapshot_id}")
+        return jsonify({
+            'success': True,
+            'message': f"Database restored successfully from {snapshot_id}.",
+            'restore': restore_result
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error restoring snapshot: {e}")
+        return jsonify({'success': False, 'message': f'Failed to restore snapshot: {str(e)}'}), 500
 @app.route('/admin/database/backup/<filename>/delete', methods=['POST'])
 @login_required
 def admin_delete_backup(filename):
@@ -2432,7 +2814,7 @@ def admin_download_backup(filename):
         backup_dir = Path(app.instance_path) / 'backups'
         backup_path = backup_dir / filename
         
-        if not backup_path.exists() or not filename.startswith('pcm_store_backup_'):
+        if not backup_extension(filename) or not backup_path.exists():
             flash('Backup file not found or invalid.', 'error')
             return redirect(url_for('admin_database'))
         
@@ -2452,10 +2834,8 @@ def admin_news():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('index'))
-    page = request.args.get('page', 1, type=int)
-    news_articles = News.query.order_by(News.created_at.desc()).paginate(
-        page=page, per_page=app.config['ADMIN_ITEMS_PER_PAGE'], error_out=False
-    )
+    news_articles = keyset_paginate(News.query.options(*eager(News)), [News.created_at.desc()], request.args.get('cursor'),
+                                    per_page=app.config['ADMIN_ITEMS_PER_PAGE'], with_total=True)
     return render_template('admin/news.html', news_articles=news_articles)
 @app.route('/admin/news/add', methods=['GET', 'POST'])
 @login_required
@@ -2574,7 +2954,7 @@ def admin_help_requests():
     if not current_user.is_admin:
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('index'))
-    help_requests = HelpRequest.query.order_by(HelpRequest.created_at.desc()).all()
+    help_requests = HelpRequest.query.options(*eager(HelpRequest)).order_by(HelpRequest.created_at.desc()).all()
     pending_count = HelpRequest.query.filter_by(status='pending').count()
     responded_count = HelpRequest.query.filter_by(status='responded').count()
     resolved_count = HelpRequest.query.filter_by(status='resolved').count()
@@ -2607,6 +2987,7 @@ def admin_respond_help(request_id):
         form.admin_response.data = help_request.admin_response
         form.status.data = help_request.status
     return render_template('admin/respond_help.html', form=form, help_request=help_request)
+@query_source('calculate_top_users')
 def calculate_top_users():
     """Automatically calculate top 10 users based on:
     1. Unique visit days (number of days user visited the website)
@@ -2616,11 +2997,17 @@ def calculate_top_users():
     now = datetime.now(timezone.utc)
     users_with_scores = []
     users = User.query.filter_by(is_active=True, is_admin=False).all()
+    archived_days = archived_visit_days()
+    # One grouped query per table instead of three queries per user
+    visit_days = dict(db.session.query(UserVisit.user_id, func.count(func.distinct(UserVisit.visit_date)))
+                      .group_by(UserVisit.user_id).all())
+    download_counts = dict(db.session.query(DownloadRecord.user_id, func.count(DownloadRecord.id))
+                           .group_by(DownloadRecord.user_id).all())
+    limited_download_counts = dict(db.session.query(LimitedAccessDownload.user_id, func.count(LimitedAccessDownload.id))
+                                   .group_by(LimitedAccessDownload.user_id).all())
     for user in users:
-        unique_visit_days = db.session.query(func.count(func.distinct(UserVisit.visit_date))).filter(UserVisit.user_id == user.id).scalar() or 0
-        download_count = DownloadRecord.query.filter_by(user_id=user.id).count()
-        limited_download_count = LimitedAccessDownload.query.filter_by(user_id=user.id).count()
-        total_downloads = download_count + limited_download_count
+        unique_visit_days = (visit_days.get(user.id) or 0) + archived_days.get(user.id, 0)
+        total_downloads = (download_counts.get(user.id) or 0) + (limited_download_counts.get(user.id) or 0)
         visit_score = 0
         if user.last_login:
             last_login = user._normalize_datetime(user.last_login) if hasattr(user, '_normalize_datetime') else user.last_login
@@ -2656,6 +3043,7 @@ def calculate_top_users():
     return top_10
 @app.route('/top-10-users')
 @login_required
+@read_only_route
 def top_users():
     """Top 10 users leaderboard - only visible to registered users - automatically calculated"""
     calculated_top_users = calculate_top_users()
@@ -2738,6 +3126,7 @@ def admin_add_top_user():
         return redirect(url_for('admin_top_users'))
     return render_template('admin/add_top_user.html', form=form)
 @app.route('/admin/top-users/<int:user_id>/edit', methods=['GET', 'POST'])
+@writes_database
 @login_required
 def admin_edit_top_user(user_id):
     """Admin edit top user - set admin gift and status (ranking is automatic)"""
@@ -2757,6 +3146,7 @@ def admin_edit_top_user(user_id):
         db.session.add(top_user)
         db.session.commit()
     unique_visit_days = db.session.query(func.count(func.distinct(UserVisit.visit_date))).filter(UserVisit.user_id == user.id).scalar() or 0
+    unique_visit_days += archived_visit_days(user.id).get(user.id, 0)
     download_count = DownloadRecord.query.filter_by(user_id=user.id).count()
     limited_download_count = LimitedAccessDownload.query.filter_by(user_id=user.id).count()
     total_downloads = download_count + limited_download_count
@@ -2821,13 +3211,18 @@ def admin_edit_material(material_id):
         material.video_duration = form.video_duration.data
         material.video_quality = form.video_quality.data
         if form.file.data:
-            filename = save_file(form.file.data, 'materials')
-            if filename:
-                material.file_path = f"uploads/materials/{filename}"
-                material.file_format = get_file_format(filename)
-                if is_video_file(filename):
+            blob = save_material_file(form.file.data)
+            if blob:
+                if material.file_path and material.file_path != blob.file_path:
+                    remove_material_file(material.file_path)
+                elif material.file_path == blob.file_path:
+                    # Same content re-uploaded, keep the single reference it already had
+                    release_blob(blob.file_path, app.static_folder)
+                material.file_path = blob.file_path
+                material.file_format = get_file_format(blob.file_path)
+                if is_video_file(blob.file_path):
                     material.is_video = True
-                    file_size = os.path.getsize(os.path.join(app.config['UPLOAD_FOLDER'], 'materials', filename))
+                    file_size = blob.size
                     if file_size > 100 * 1024 * 1024:
                         material.video_quality = 'HD'
                     elif file_size > 50 * 1024 * 1024:
@@ -2850,6 +3245,10 @@ def admin_edit_material(material_id):
             if filename:
                 material.video_thumbnail = f"uploads/images/{filename}"
         db.session.commit()
+        if form.file.data and material.file_format == 'pdf':
+            queue_pdf_processing(material.file_path)
+        elif form.file.data and material.file_format == 'docx':
+            queue_docx_render(material.file_path)
         log_admin_action('Updated material', 'materials', material.id, f"Title: {material.title}")
         flash('Material updated successfully!', 'success')
         return redirect(url_for('admin_materials'))
@@ -2872,8 +3271,7 @@ def admin_delete_material_file(material_id):
         if file_type == 'file':
             if material.file_path:
                 file_path_to_delete = os.path.join(app.static_folder, material.file_path)
-                if os.path.exists(file_path_to_delete):
-                    os.remove(file_path_to_delete)
+                if remove_material_file(material.file_path):
                     file_deleted = True
                 material.file_path = None
                 material.file_size = None
@@ -2884,8 +3282,7 @@ def admin_delete_material_file(material_id):
         elif file_type == 'video':
             if material.file_path and material.is_video:
                 file_path_to_delete = os.path.join(app.static_folder, material.file_path)
-                if os.path.exists(file_path_to_delete):
-                    os.remove(file_path_to_delete)
+                if remove_material_file(material.file_path):
                     file_deleted = True
                 material.file_path = None
                 material.file_size = None
@@ -2930,6 +3327,8 @@ def admin_delete_material(material_id):
         return redirect(url_for('index'))
     material = Material.query.get_or_404(material_id)
     title = material.title
+    if is_blob_path(material.file_path):
+        release_blob(material.file_path, app.static_folder)
     db.session.delete(material)
     db.session.commit()
     log_admin_action('Deleted material', 'materials', material_id, f"Title: {title}")
@@ -2943,7 +3342,7 @@ def dashboard():
         # Get downloads with error handling
         downloads = []
         try:
-            downloads = DownloadRecord.query.filter_by(user_id=current_user.id).order_by(DownloadRecord.last_downloaded.desc()).all()
+            downloads = DownloadRecord.query.options(*eager(DownloadRecord)).filter_by(user_id=current_user.id).order_by(DownloadRecord.last_downloaded.desc()).all()
         except Exception as e:
             app.logger.error(f"Error querying downloads: {e}")
             downloads = []
@@ -2980,11 +3379,10 @@ def dashboard():
         flash('An error occurred loading your dashboard. Please try again.', 'error')
         return redirect(url_for('index'))
 @app.route('/news')
+@read_only_route
 def news():
-    page = request.args.get('page', 1, type=int)
-    news_articles = News.query.filter_by(is_published=True).order_by(News.created_at.desc()).paginate(
-        page=page, per_page=10, error_out=False
-    )
+    news_articles = keyset_paginate(News.query.options(*eager(News)).filter_by(is_published=True), [News.created_at.desc()],
+                                    request.args.get('cursor'), per_page=10)
     return render_template('news.html', news_articles=news_articles)
 @app.route('/robots.txt', endpoint='robots_txt', methods=['GET'])
 def robots():
@@ -3009,7 +3407,32 @@ Sitemap: {base_url}/sitemap.xml
     response.headers['Content-Type'] = 'text/plain; charset=utf-8'
     response.headers['X-Content-Type-Options'] = 'nosniff'
     return response
+@app.route('/sw.js', endpoint='service_worker', methods=['GET'])
+def service_worker():
+    """Service worker served from the site root (so its scope covers every page) with the precache list inlined"""
+    sw_path = os.path.join(app.static_folder, SERVICE_WORKER_SOURCE)
+    try:
+        with open(sw_path, encoding='utf-8') as f:
+            source = f.read()
+    except OSError:
+        return Response('', status=404)
+    precache = read_precache_manifest(app.static_folder)
+    if precache:
+        version = precache['version']
+        urls = [url_for('static', filename=path) for path in precache.get('assets', [])]
+    else:
+        # No `flask assets build` yet (development): roll caches whenever sw.js changes
+        version = f"dev-{int(os.path.getmtime(sw_path))}"
+        urls = []
+    manifest = json.dumps({'version': version, 'urls': urls})
+    response = Response(f"self.PRECACHE_MANIFEST = {manifest};\n{source}",
+                        mimetype='application/javascript')
+    # Browsers compare the script byte-for-byte on every navigation to pick up deploys
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Service-Worker-Allowed'] = '/'
+    return response
 @app.route('/news/<int:news_id>')
+@read_only_route
 def news_detail(news_id):
     article = News.query.get_or_404(news_id)
     related_news = News.query.filter(News.id != news_id, News.is_published == True).order_by(News.created_at.desc()).limit(3).all()
@@ -3037,9 +3460,289 @@ def internal_error(error):
     traceback.print_exc()
     print("=" * 80)
     return render_template('errors/500.html'), 500
+images_cli = AppGroup('images', help='Uploaded image maintenance commands.')
+@images_cli.command('build-variants')
+@click.option('--force', is_flag=True, help='Regenerate variants that already exist in the manifest.')
+def build_image_variants_command(force):
+    """Generate responsive variants for images uploaded before the pipeline existed"""
+    images_dir = os.path.join(app.static_folder, 'uploads', 'images')
+    if not os.path.isdir(images_dir):
+        click.echo('No uploaded images found.')
+        return
+    formats = ('webp', 'avif') if app.config.get('IMAGE_AVIF_ENABLED') else ('webp',)
+    processed = 0
+    for entry in sorted(os.scandir(images_dir), key=lambda e: e.name):
+        if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in {'.png', '.jpg', '.jpeg', '.gif'}:
+            continue
+        image_path = f"uploads/images/{entry.name}"
+        if not force and (get_image_variants(image_path) or {}).get('formats'):
+            continue
+        try:
+            enqueue_image_job(entry.path, app.static_folder, formats=formats, max_workers=0)
+            processed += 1
+            click.echo(f"✓ {image_path}")
+        except Exception as e:
+            click.echo(f"✗ {image_path}: {e}")
+    click.echo(f"Generated variants for {processed} image(s).")
+app.cli.add_command(images_cli)
+uploads_cli = AppGroup('uploads', help='Uploaded material file maintenance commands.')
+@uploads_cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help='Report what would change without moving any files.')
+def migrate_uploads_command(dry_run):
+    """Move uploads/materials files into the content-addressed blob store"""
+    stats = migrate_uploads(app.static_folder, dry_run=dry_run)
+    prefix = 'Would migrate' if dry_run else 'Migrated'
+    click.echo(f"{prefix} {stats['migrated']} material file(s), {stats['deduplicated']} duplicate(s).")
+    click.echo(f"Space reclaimed: {stats['bytes_reclaimed'] / (1024 * 1024):.2f} MB")
+    if stats['missing']:
+        click.echo(f"⚠ {stats['missing']} material file(s) missing on disk were skipped.")
+    if stats['unreferenced']:
+        click.echo(f"⚠ {stats['unreferenced']} file(s) in uploads/materials are not referenced by any material.")
+@uploads_cli.command('process-pdfs')
+@click.option('--force', is_flag=True, help='Reprocess PDFs that already have previews.')
+def process_pdfs_command(force):
+    """Linearize PDFs, render previews and fill in page counts for existing materials"""
+    if not PDF_PROCESSING_AVAILABLE:
+        click.echo('⚠ PDF processing is not available.')
+        return
+    paths = sorted({m.file_path for m in Material.query.filter(Material.file_format == 'pdf').all() if m.file_path})
+    processed = 0
+    for file_path in paths:
+        if not os.path.exists(os.path.join(app.static_folder, file_path)):
+            click.echo(f"✗ {file_path}: file not found")
+            continue
+        if not force and get_pdf_assets(app.static_folder, file_path)['previews']:
+            continue
+        def _record(result, file_path=file_path):
+            if result.get('pages'):
+                Material.query.filter_by(file_path=file_path).update({'pages': result['pages']})
+                db.session.commit()
+        try:
+            enqueue_pdf_job(
+                os.path.join(app.static_folder, file_path),
+                on_done=_record,
+                max_workers=0,
+                preview_pages=app.config.get('PDF_PREVIEW_PAGES', 3),
+                preview_width=app.config.get('PDF_PREVIEW_WIDTH', 480)
+            )
+            processed += 1
+            click.echo(f"✓ {file_path}")
+        except Exception as e:
+            click.echo(f"✗ {file_path}: {e}")
+    click.echo(f"Processed {processed} PDF(s).")
+@uploads_cli.command('render-docx')
+@click.option('--force', is_flag=True, help='Re-render documents that already have HTML pages.')
+def render_docx_command(force):
+    """Pre-render DOCX materials to sanitized HTML pages"""
+    if not DOCX_RENDER_AVAILABLE:
+        click.echo('⚠ DOCX rendering is not available (install mammoth).')
+        return
+    paths = sorted({m.file_path for m in Material.query.filter(Material.file_format == 'docx').all() if m.file_path})
+    rendered = 0
+    for file_path in paths:
+        if not os.path.exists(os.path.join(app.static_folder, file_path)):
+            click.echo(f"✗ {file_path}: file not found")
+            continue
+        if not force and get_docx_pages(app.static_folder, file_path):
+            continue
+        try:
+            enqueue_docx_job(
+                os.path.join(app.static_folder, file_path),
+                f"{app.static_url_path}/{pages_dir_for(file_path)}",
+                max_workers=0
+            )
+            rendered += 1
+            click.echo(f"✓ {file_path}")
+        except Exception as e:
+            click.echo(f"✗ {file_path}: {e}")
+    click.echo(f"Rendered {rendered} document(s).")
+app.cli.add_command(uploads_cli)
+assets_cli = AppGroup('assets', help='Static asset build commands.')
+@assets_cli.command('build')
+def build_assets_command():
+    """Minify CSS/JS sources and write gzip/brotli variants of static text assets"""
+    report = build_assets(app.static_folder)
+    for entry in report['minified']:
+        click.echo(f"✓ {entry['path']}: {entry['source_size']:,} -> {entry['size']:,} bytes")
+    original = sum(entry['size'] for entry in report['compressed'])
+    brotli_total = sum(entry['br'] or entry['gzip'] or entry['size'] for entry in report['compressed'])
+    gzip_total = sum(entry['gzip'] or entry['size'] for entry in report['compressed'])
+    click.echo(f"Precompressed {len(report['compressed'])} file(s): {original:,} bytes, "
+               f"{gzip_total:,} gzip, {brotli_total:,} brotli")
+    click.echo(f"Asset manifest version {report['manifest']['version']} "
+               f"({len(report['manifest']['assets'])} hashed file(s))")
+    click.echo(f"Service worker precache version {report['precache']['version']} "
+               f"({len(report['precache']['assets'])} file(s))")
+app.cli.add_command(assets_cli)
+db_cli = AppGroup('db', help='Database maintenance commands.')
+@db_cli.command('advise-indexes')
+@click.option('--apply', 'apply_migrations', is_flag=True, help='Create the missing indexes, then explain again.')
+@click.option('--verbose', is_flag=True, help='Print every query plan, not just the flagged ones.')
+def advise_indexes_command(apply_migrations, verbose):
+    """Explain the hot queries and flag full table scans and unindexed sorts"""
+    from utils.db_migrations import migrate_indexes
+    if apply_migrations:
+        for migration in migrate_indexes():
+            click.echo(f"✓ {migration}")
+    flagged = 0
+    for entry in advise():
+        if entry['error']:
+            click.echo(f"⚠ {entry['label']}: could not explain ({entry['error']})")
+            continue
+        problems = [f"full scan of {table}" for table in entry['full_scans']]
+        if entry['temp_sort']:
+            problems.append('sort without index')
+        if problems:
+            flagged += 1
+            click.echo(f"⚠ {entry['label']} [{entry['source']}]: {', '.join(problems)}")
+        else:
+            click.echo(f"✓ {entry['label']}")
+        if problems or verbose:
+            click.echo(f"    {entry['sql']}")
+            for line in entry['plan']:
+                click.echo(f"      {line}")
+    if flagged and not apply_migrations:
+        click.echo(f"{flagged} query(ies) flagged; run with --apply to create the indexes from utils/db_migrations.py")
+@db_cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations and record them in the ledger"""
+    from utils.db_migrations import current_schema_version, run_migrations, LATEST_SCHEMA_VERSION
+    version = current_schema_version()
+    if version >= LATEST_SCHEMA_VERSION:
+        click.echo(f"✓ Schema is current (version {version})")
+        return
+    for migration in run_migrations(version):
+        click.echo(f"✓ {migration}")
+    click.echo(f"✓ Schema migrated from version {version} to {LATEST_SCHEMA_VERSION}")
+@db_cli.command('migrations')
+def migrations_command():
+    """List schema migrations and verify the recorded checksums"""
+    from utils.db_migrations import migration_status
+    for entry in migration_status():
+        if entry['status'] == 'applied':
+            click.echo(f"✓ {entry['version']:3} {entry['name']} (applied {entry['applied_at']})")
+        elif entry['status'] == 'changed':
+            click.echo(f"⚠ {entry['version']:3} {entry['name']}: source changed since it was applied, "
+                       f"add a new migration instead of editing this one")
+        else:
+            click.echo(f"  {entry['version']:3} {entry['name']} (pending)")
+@db_cli.command('checkpoint')
+@click.option('--mode', type=click.Choice(['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'], case_sensitive=False),
+              default=None, help='Checkpoint mode (default: TRUNCATE when the WAL is large, else PASSIVE).')
+def checkpoint_command(mode):
+    """Checkpoint the SQLite write-ahead log into the main database file"""
+    if not is_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+        click.echo("⚠ Not an SQLite database, nothing to checkpoint")
+        return
+    size_before = wal_checkpointer.wal_size()
+    result = wal_checkpointer.checkpoint(mode.upper() if mode else None)
+    status = '⚠ Readers busy, partial' if result['busy'] else '✓ Complete'
+    click.echo(f"{status} {result['mode']} checkpoint: {result['checkpointed']}/{result['log_frames']} frames, "
+               f"WAL {size_before:,} -> {wal_checkpointer.wal_size():,} bytes")
+@db_cli.command('backup')
+@click.option('--incremental', is_flag=True, help='Store only changed pages as a snapshot, then apply retention.')
+def backup_command(incremental):
+    """Take an online, integrity-checked SQLite backup (run hourly from cron for snapshots)"""
+    if not DB_BACKUP_AVAILABLE or not is_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+        click.echo("⚠ Backups are only available for SQLite databases")
+        return
+    try:
+        result = create_incremental_backup() if incremental else backup_database()
+    except Exception as e:
+        click.echo(f"⚠ {e}")
+        return
+    if incremental:
+        click.echo(f"✓ {result['snapshot_id']}: {result['new_chunks']}/{result['chunks']} new chunk(s), "
+                   f"{result['size_formatted']} stored for a {result['database_size']:,} byte database")
+        if result['pruned_snapshots']:
+            click.echo(f"✓ Pruned {len(result['pruned_snapshots'])} snapshot(s), freed {result['freed_bytes']:,} bytes")
+        return
+    click.echo(f"✓ {result['backup_filename']}: {result['size_formatted']} "
+               f"({result['compression']}, database {result['database_size']:,} bytes)")
+@db_cli.command('prune-snapshots')
+def prune_snapshots_command():
+    """Apply the hourly/daily/weekly retention policy to incremental snapshots"""
+    result = prune_snapshots()
+    click.echo(f"✓ Removed {len(result['deleted_snapshots'])} snapshot(s) and {result['deleted_chunks']} "
+               f"unreferenced chunk(s), freed {result['freed_bytes']:,} bytes")
+@db_cli.command('reconcile-counters')
+@click.option('--dry-run', is_flag=True, help='Report drifted counters without correcting them.')
+def reconcile_counters_command(dry_run):
+    """Recompute material download/view/purchase counters from the event tables (run nightly from cron)"""
+    result = reconcile_counters(dry_run=dry_run)
+    for material_id, counter, stored, expected in result['drift'][:20]:
+        click.echo(f"  material {material_id} {counter}: {stored} -> {expected}")
+    if len(result['drift']) > 20:
+        click.echo(f"  ... and {len(result['drift']) - 20} more")
+    if dry_run:
+        click.echo(f"✓ Checked {result['checked']} material(s), {len(result['drift'])} counter(s) drifted")
+        return
+    click.echo(f"✓ Checked {result['checked']} material(s), corrected {result['corrected']} counter(s)")
+    if result['skipped']:
+        click.echo(f"⚠ {result['skipped']} counter(s) changed during the run, left for the next one")
+@db_cli.command('archive-tracking')
+@click.option('--days', type=int, default=None, help='Retention window for tracking tables (default: TRACKING_RETENTION_DAYS).')
+@click.option('--format', 'archive_format', type=click.Choice(ARCHIVE_FORMATS), default=None,
+              help='Archive file format (default: ARCHIVE_FORMAT).')
+@click.option('--dry-run', is_flag=True, help='Count the rows that would be archived without changing anything.')
+def archive_tracking_command(days, archive_format, dry_run):
+    """Roll up, archive and delete old tracking rows (run nightly from cron)"""
+    try:
+        result = archive_tracking_data(
+            app.instance_path,
+            retention_days=days if days is not None else app.config.get('TRACKING_RETENTION_DAYS', 90),
+            admin_log_retention_days=app.config.get('ADMIN_LOG_RETENTION_DAYS', 365),
+            batch_size=app.config.get('ARCHIVE_BATCH_SIZE', 1000),
+            pause=app.config.get('ARCHIVE_BATCH_PAUSE_MS', 50) / 1000,
+            archive_format=archive_format or app.config.get('ARCHIVE_FORMAT', 'jsonl'),
+            dry_run=dry_run
+        )
+    except RuntimeError as e:
+        click.echo(f"⚠ {e}")
+        return
+    verb = 'Would archive' if dry_run else 'Archived'
+    for table, counts in result['tables'].items():
+        click.echo(f"✓ {verb} {counts['rows']:,} {table} row(s) in {counts['batches']} batch(es)")
+    for path in result['files']:
+        click.echo(f"  {os.path.relpath(path, app.instance_path)}")
+@db_cli.command('query-archive')
+@click.argument('table', type=click.Choice(sorted(POLICY_BY_TABLE)))
+@click.option('--since', default=None, help='Only rows dated on or after this ISO date.')
+@click.option('--until', default=None, help='Only rows dated before this ISO date.')
+@click.option('--match', multiple=True, help='column=value filter, may be repeated.')
+@click.option('--limit', type=int, default=0, help='Stop after this many rows (0 = all).')
+def query_archive_command(table, since, until, match, limit):
+    """Print archived tracking rows as JSON lines"""
+    filters = dict(item.split('=', 1) for item in match if '=' in item)
+    for count, record in enumerate(read_archive(app.instance_path, table, since, until, filters), start=1):
+        click.echo(json.dumps(record))
+        if limit and count >= limit:
+            break
+@db_cli.command('slow-queries')
+@click.option('--hours', type=float, default=24, help='Only queries from the last N hours (0 = whole log).')
+@click.option('--sort', type=click.Choice(['total', 'count', 'p99', 'slow']), default='total')
+@click.option('--source', default=None, help='Only queries from this endpoint or tagged function.')
+@click.option('--limit', type=int, default=20)
+@click.option('--plans', is_flag=True, help='Print the captured EXPLAIN plan of each fingerprint.')
+def slow_queries_command(hours, sort, source, limit, plans):
+    """Rank SQL fingerprints from the slow query log"""
+    slow_query_log.flush()
+    since = datetime.now(timezone.utc) - timedelta(hours=hours) if hours else None
+    rows = slow_query_report(slow_query_log.log_dir, since=since, source=source, sort=sort, limit=limit)
+    if not rows:
+        click.echo("⚠ No queries logged yet")
+        return
+    click.echo(f"{'fingerprint':<16}  {'est. count':>10}  {'est. total':>11}  {'p99':>9}  {'slow':>5}  {'max':>9}  sources")
+    for row in rows:
+        p99 = f"{row['p99_ms']:.1f}ms" if row['p99_ms'] is not None else '-'
+        click.echo(f"{row['fp']:<16}  {row['est_count']:>10,.0f}  {row['est_total_ms'] / 1000:>10.2f}s  {p99:>9}  "
+                   f"{row['slow_count']:>5}  {row['max_ms']:>7.1f}ms  {', '.join(row['sources'])}")
+        click.echo(f"  {row['sql'][:300]}")
+        if plans and row['plan']:
+            for step in row['plan']:
+                click.echo(f"    {step}")
+app.cli.add_command(db_cli)
 if __name__ == '__main__':
-    with app.app_context():
-        add_missing_columns()
     init_db()
     if app.config.get('DEBUG'):
         print("\nSEO Routes Registered:")
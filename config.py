@@ -6,14 +6,45 @@ class Config:
         raise ValueError("SECRET_KEY environment variable must be set in production!")
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///pcm_store.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Server database pool settings; utils.db_engine swaps in the SQLite profile below for SQLite
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,
         'pool_recycle': 3600,
-        # Connection pool settings (only applies to PostgreSQL/MySQL, not SQLite)
         'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),  # Default 10 connections
         'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),  # Allow 20 overflow connections
-        'connect_args': {'check_same_thread': False} if 'sqlite' in (os.environ.get('DATABASE_URL') or 'sqlite:///pcm_store.db') else {}
     }
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16 * 1024))
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 5))
+    SQLITE_MAX_OVERFLOW = int(os.environ.get('SQLITE_MAX_OVERFLOW', 10))
+    SQLITE_CHECKPOINT_INTERVAL = int(os.environ.get('SQLITE_CHECKPOINT_INTERVAL', 300))  # Seconds, 0 disables
+    SQLITE_WAL_TRUNCATE_MB = int(os.environ.get('SQLITE_WAL_TRUNCATE_MB', 64))
+    # Read-only routes use a replica when one is configured, else a read-only pool on the SQLite file
+    SQLALCHEMY_READ_DATABASE_URI = os.environ.get('DATABASE_READ_URL')
+    SQLITE_READ_POOL = os.environ.get('SQLITE_READ_POOL', 'true').lower() in ['true', 'on', '1']
+    SQLITE_READ_POOL_SIZE = int(os.environ.get('SQLITE_READ_POOL_SIZE', 5))
+    READ_REPLICA_MAX_LAG = float(os.environ.get('READ_REPLICA_MAX_LAG', 5))  # Seconds before reads fall back to the primary
+    READ_AFTER_WRITE_SECONDS = int(os.environ.get('READ_AFTER_WRITE_SECONDS', 10))  # Users stay on the primary after writing
+    BACKUP_COMPRESSION = os.environ.get('BACKUP_COMPRESSION', 'gzip')  # gzip, zstd or none
+    BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 1024))
+    BACKUP_STEP_SLEEP_MS = int(os.environ.get('BACKUP_STEP_SLEEP_MS', 10))
+    BACKUP_CHUNK_PAGES = int(os.environ.get('BACKUP_CHUNK_PAGES', 16))  # Pages per incremental chunk
+    BACKUP_KEEP_LAST = int(os.environ.get('BACKUP_KEEP_LAST', 3))
+    BACKUP_KEEP_HOURLY = int(os.environ.get('BACKUP_KEEP_HOURLY', 24))
+    BACKUP_KEEP_DAILY = int(os.environ.get('BACKUP_KEEP_DAILY', 7))
+    BACKUP_KEEP_WEEKLY = int(os.environ.get('BACKUP_KEEP_WEEKLY', 4))
+    DB_STATS_TTL = int(os.environ.get('DB_STATS_TTL', 300))  # Seconds the admin database statistics are cached
+    DB_STATS_ANALYSIS_LIMIT = int(os.environ.get('DB_STATS_ANALYSIS_LIMIT', 1000))  # 0 never runs ANALYZE
+    RESTORE_GATE_WAIT = int(os.environ.get('RESTORE_GATE_WAIT', 15))  # Seconds a write waits for a restore to finish
+    RESTORE_GRACE_SECONDS = float(os.environ.get('RESTORE_GRACE_SECONDS', 1))
+    RESTORE_DRAIN_TIMEOUT = float(os.environ.get('RESTORE_DRAIN_TIMEOUT', 10))
+    # `flask db archive-tracking` moves older tracking rows to instance/archive
+    TRACKING_RETENTION_DAYS = int(os.environ.get('TRACKING_RETENTION_DAYS', 90))  # Page views, user visits, visitors
+    ADMIN_LOG_RETENTION_DAYS = int(os.environ.get('ADMIN_LOG_RETENTION_DAYS', 365))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))  # Rows deleted per write transaction
+    ARCHIVE_BATCH_PAUSE_MS = int(os.environ.get('ARCHIVE_BATCH_PAUSE_MS', 50))
+    ARCHIVE_FORMAT = os.environ.get('ARCHIVE_FORMAT', 'jsonl')  # jsonl (gzip) or parquet (needs pyarrow)
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = 3600
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
@@ -23,6 +54,16 @@ class Config:
     UPLOAD_FOLDER = 'static/uploads'
     MAX_CONTENT_LENGTH = 512 * 1024 * 1024
     MAX_FORM_MEMORY_SIZE = 512 * 1024 * 1024
+    IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', 2))
+    IMAGE_AVIF_ENABLED = os.environ.get('IMAGE_AVIF_ENABLED', 'false').lower() in ['true', 'on', '1']
+    PDF_PREVIEW_PAGES = int(os.environ.get('PDF_PREVIEW_PAGES', 3))
+    PDF_PREVIEW_WIDTH = int(os.environ.get('PDF_PREVIEW_WIDTH', 480))
+    STREAM_SLOTS_PER_USER = int(os.environ.get('STREAM_SLOTS_PER_USER', 3))
+    STREAM_SLOTS_PER_IP = int(os.environ.get('STREAM_SLOTS_PER_IP', 6))
+    STREAM_SLOTS_GLOBAL = int(os.environ.get('STREAM_SLOTS_GLOBAL', 24))
+    STREAM_SLOT_DIR = os.environ.get('STREAM_SLOT_DIR')  # Slot files shared by the workers, instance/stream_slots by default
+    STREAM_RETRY_AFTER = int(os.environ.get('STREAM_RETRY_AFTER', 10))
+    STREAM_RATE_LIMIT_KBPS = int(os.environ.get('STREAM_RATE_LIMIT_KBPS', 0))  # 0 disables shaping
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'txt', 'mp4', 'avi', 'mov', 'wmv', 'flv', 'webm', 'mkv', 'm4v', '3gp', 'ppt', 'pptx', 'xls', 'xlsx', 'zip', 'rar', '7z'}
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 587)
@@ -45,12 +86,27 @@ class Config:
     MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL')
     ITEMS_PER_PAGE = 12
     ADMIN_ITEMS_PER_PAGE = 20
+    KEYSET_COUNT_TTL = int(os.environ.get('KEYSET_COUNT_TTL', 60))  # Seconds a listing's total count is cached
+    LAZY_LOAD_DETECTION = os.environ.get('LAZY_LOAD_DETECTION', 'off')  # off, log or raise on lazy loads in templates
+    # Per-response DB time and query count; off by default, it lets any client time queries
+    SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'false').lower() in ['true', 'on', '1']
+    PERF_SAMPLE_SIZE = int(os.environ.get('PERF_SAMPLE_SIZE', 512))  # Recent requests per endpoint behind p50/p95
+    PERF_SLOWEST_PER_ENDPOINT = int(os.environ.get('PERF_SLOWEST_PER_ENDPOINT', 5))
+    # Sampled SQL fingerprints in instance/slow_queries, reported by `flask db slow-queries`
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', 'true').lower() in ['true', 'on', '1']
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))  # Always logged above this
+    SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 0.01))  # Share of all statements logged
+    SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() in ['true', 'on', '1']
+    SLOW_QUERY_LOG_MAX_MB = int(os.environ.get('SLOW_QUERY_LOG_MAX_MB', 10))
+    SLOW_QUERY_LOG_BACKUPS = int(os.environ.get('SLOW_QUERY_LOG_BACKUPS', 5))
     RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL') or 'memory://'
     RATELIMIT_DEFAULT = "100 per hour"
     POSTS_PER_PAGE = 10
 class DevelopmentConfig(Config):
     DEBUG = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///pcm_store_dev.db'
+    LAZY_LOAD_DETECTION = os.environ.get('LAZY_LOAD_DETECTION', 'log')
+    SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'true').lower() in ['true', 'on', '1']
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or 'sqlite:///pcm_store_dev.db'  # Benchmarks use their own file
 class ProductionConfig(Config):
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///pcm_store.db'
@@ -61,6 +117,8 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    IMAGE_PROCESSING_WORKERS = 0
+    LAZY_LOAD_DETECTION = 'raise'
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
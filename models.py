@@ -3,7 +3,9 @@ from flask_login import UserMixin
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
-db = SQLAlchemy()
+from utils.db_routing import RoutingSession
+from utils.slow_query_log import query_source
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -14,7 +16,7 @@ class User(UserMixin, db.Model):
     phone = db.Column(db.String(20))
     is_admin = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     last_login = db.Column(db.DateTime)
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -37,6 +39,7 @@ class User(UserMixin, db.Model):
                     return dt.replace(tzinfo=timezone.utc)
                 return dt
             return None
+    @query_source('subscription_check')
     def has_active_access(self):
         """Check if user has active access (subscription only - no more 90-day trial)"""
         if self.is_admin:
@@ -47,6 +50,7 @@ class User(UserMixin, db.Model):
             Subscription.end_date > datetime.now(timezone.utc)
         ).first()
         return active_subscription is not None
+    @query_source('subscription_check')
     def get_access_status(self):
         """Get user's current access status"""
         if self.is_admin:
@@ -154,10 +158,30 @@ class Material(db.Model):
     video_duration = db.Column(db.Integer)  # Duration in seconds
     video_quality = db.Column(db.String(20))
     video_thumbnail = db.Column(db.String(500))
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    # Engagement counters, maintained by utils.engagement
+    download_count = db.Column(db.Integer, default=0, nullable=False)
+    view_count = db.Column(db.Integer, default=0, nullable=False)
+    purchase_count = db.Column(db.Integer, default=0, nullable=False)
+    __table_args__ = (
+        db.Index('ix_materials_is_active_created_at', 'is_active', 'created_at'),
+        db.Index('ix_materials_is_active_download_count', 'is_active', 'download_count', 'created_at'),
+        db.Index('ix_materials_is_active_view_count', 'is_active', 'view_count', 'created_at'),
+    )
     def __repr__(self):
         return f'<Material {self.title}>'
+class StoredBlob(db.Model):
+    """Content-addressed upload shared by every material that references it"""
+    __tablename__ = 'stored_blobs'
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    file_path = db.Column(db.String(500), unique=True, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    def __repr__(self):
+        return f'<StoredBlob {self.sha256[:12]} refs:{self.ref_count}>'
 class MobilePaymentMethod(db.Model):
     __tablename__ = 'mobile_payment_methods'
     id = db.Column(db.Integer, primary_key=True)
@@ -189,6 +213,10 @@ class MpesaTransaction(db.Model):
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     user = db.relationship('User', backref='mpesa_transactions')
     material = db.relationship('Material', backref='mpesa_transactions')
+    __table_args__ = (
+        db.Index('ix_mpesa_transactions_transaction_reference', 'transaction_reference'),
+        db.Index('ix_mpesa_transactions_status_created_at', 'status', 'created_at'),
+    )
     def __repr__(self):
         return f'<MpesaTransaction {self.transaction_reference} - {self.status}>'
 class MaterialView(db.Model):
@@ -237,7 +265,7 @@ class VisitorRecord(db.Model):
     """Track website visitors"""
     __tablename__ = 'visitor_records'
     id = db.Column(db.Integer, primary_key=True)
-    ip_address = db.Column(db.String(45), nullable=False)
+    ip_address = db.Column(db.String(45), nullable=False, index=True)
     user_agent = db.Column(db.Text)
     country = db.Column(db.String(100))
     city = db.Column(db.String(100))
@@ -259,10 +287,11 @@ class News(db.Model):
     is_published = db.Column(db.Boolean, default=True)
     is_featured = db.Column(db.Boolean, default=False)
     view_count = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     published_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     author = db.relationship('User', backref='news_articles')
+    __table_args__ = (db.Index('ix_news_is_published_created_at', 'is_published', 'created_at'),)
     def __repr__(self):
         return f'<News {self.title} by {self.author.email}>'
     @property
@@ -287,6 +316,10 @@ class PageView(db.Model):
     last_viewed = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     visitor = db.relationship('VisitorRecord', backref='page_views')
+    __table_args__ = (
+        db.Index('ix_page_views_page_url_visitor_id', 'page_url', 'visitor_id'),
+        db.Index('ix_page_views_visitor_id', 'visitor_id'),
+    )
     def __repr__(self):
         return f'<PageView {self.page_url} - {self.view_count} views>'
 class WishlistItem(db.Model):
@@ -348,7 +381,7 @@ class Subscription(db.Model):
     materials_accessed = db.Column(db.Integer, default=0)
     is_active = db.Column(db.Boolean, default=True, index=True)
     payment_status = db.Column(db.String(20), default='pending', index=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     user = db.relationship('User', foreign_keys=[user_id], backref=db.backref('subscriptions', lazy='dynamic'))
     plan = db.relationship('SubscriptionPlan', backref='subscriptions')
     def _normalize_datetime(self, dt):
@@ -477,6 +510,9 @@ class LimitedAccessDownload(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     user = db.relationship('User', backref=db.backref('limited_downloads', lazy='dynamic'))
     material = db.relationship('Material', backref=db.backref('limited_downloads', lazy='dynamic'))
+    __table_args__ = (
+        db.Index('ix_limited_access_downloads_user_date_type', 'user_id', 'download_date', 'download_type'),
+    )
     def __repr__(self):
         return f'<LimitedAccessDownload {self.user.email} - {self.material.title} - {self.download_date}>'
 class TermsOfService(db.Model):
@@ -526,6 +562,18 @@ class UserVisit(db.Model):
     __table_args__ = (db.UniqueConstraint('user_id', 'visit_date', name='unique_user_visit_date'),)
     def __repr__(self):
         return f'<UserVisit {self.user.email} - {self.visit_date}>'
+class TrackingRollup(db.Model):
+    """Aggregates of tracking rows moved to instance/archive by utils.retention"""
+    __tablename__ = 'tracking_rollups'
+    id = db.Column(db.Integer, primary_key=True)
+    metric = db.Column(db.String(30), nullable=False)  # page_views, user_visits, visitors or admin_actions
+    period = db.Column(db.Date, nullable=False)  # Day, or first day of the month for user_visits
+    key = db.Column(db.String(500), nullable=False, default='')  # Path, user id or admin action
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('metric', 'period', 'key', name='unique_tracking_rollup'),)
+    def __repr__(self):
+        return f'<TrackingRollup {self.metric} {self.period} {self.key}: {self.total}>'
 class TopUser(db.Model):
     """Top 10 Users leaderboard"""
     __tablename__ = 'top_users'
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+"""
+Endpoint Benchmark
+Times the hot request paths through the Flask test client against a seeded,
+deterministic dataset and writes the results as JSON, so runs on different
+commits can be compared
+
+At --scale 1 the dataset is 100k users, 20k materials spread over the
+default category tree, 1M page views, 200k subscriptions and 500k
+downloads (plus the visitors and user visits those refer to). It is seeded
+once into instance/benchmark-<scale>-<seed>.db and reused by later runs;
+the development database is never touched.
+
+Each endpoint gets warm-up requests, then timed ones. Query counts and
+database time come from the Server-Timing header of every response.
+
+tests/test_benchmark_endpoints.py runs the same seed and cases at scale
+0.001 under pytest, checking each returns 200 within a query budget.
+
+Usage:
+    python scripts/benchmark_endpoints.py [--scale 0.05] [--requests 20] [--output results.json]
+    python scripts/benchmark_endpoints.py --compare previous.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+# Add parent directory to path
+sys.path.insert(0, str(ROOT))
+
+FULL_DATASET = {
+    'users': 100_000,
+    'materials': 20_000,
+    'visitors': 50_000,
+    'page_views': 1_000_000,
+    'subscriptions': 200_000,
+    'downloads': 500_000,
+    'user_visits': 300_000,
+}
+BENCHMARK_PASSWORD = 'benchmark'
+ADMIN_EMAIL = 'admin@pcmlegacy.store'
+ADMIN_PASSWORD = 'admin123'
+EPOCH = datetime(2026, 1, 1)  # Every seeded timestamp is relative to this, never to now
+INSERT_CHUNK = 20_000
+TOPICS = ['Algebra', 'Calculus', 'Kinematics', 'Optics', 'Electrolysis', 'Organic Chemistry', 'Statistics',
+          'Thermodynamics', 'Geometry', 'Waves', 'Acids and Bases', 'Trigonometry', 'Magnetism', 'Probability']
+KINDS = ['Notes', 'Past Paper', 'Revision Guide', 'Worked Examples', 'Video Lesson']
+STATIC_PAGES = ['/', '/news', '/search', '/subscriptions', '/top-10-users', '/dashboard']
+SERVER_TIMING = re.compile(r'(\w[\w-]*);(?:dur=([\d.]+))?(?:;?desc="?(\d+)"?)?')
+
+
+def dataset_sizes(scale):
+    return {name: max(1, int(count * scale)) for name, count in FULL_DATASET.items()}
+
+
+def database_path(scale, seed):
+    return ROOT / 'instance' / f"benchmark-{scale:g}-{seed}.db"
+
+
+def chunks(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_CHUNK:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(app, db, sizes, seed_value):
+    """Insert the synthetic dataset with bulk Core inserts, in a fixed order from one RNG"""
+    from werkzeug.security import generate_password_hash
+    from app import init_db
+    from models import (
+        Category, User, Material, VisitorRecord, PageView, Subscription, SubscriptionPlan,
+        DownloadRecord, UserVisit
+    )
+    from utils.engagement import reconcile_counters
+
+    rng = random.Random(seed_value)
+    init_db()
+    with app.app_context():
+        categories = [row.id for row in Category.query.order_by(Category.id).all()]
+        plans = [(plan.id, plan.duration_days, plan.max_materials)
+                 for plan in SubscriptionPlan.query.order_by(SubscriptionPlan.id).all()]
+        first_user_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+        password_hash = generate_password_hash(BENCHMARK_PASSWORD)
+
+        def insert(model, rows, label):
+            started = time.perf_counter()
+            count = 0
+            for batch in chunks(rows):
+                with db.engine.begin() as conn:
+                    conn.execute(model.__table__.insert(), batch)
+                count += len(batch)
+            print(f"  {label:<14} {count:>10,} rows  {time.perf_counter() - started:6.1f}s")
+
+        insert(User, ({
+            'email': f"user{i}@benchmark.example",
+            'password_hash': password_hash,
+            'first_name': f"User{i}",
+            'last_name': rng.choice(TOPICS).split()[0],
+            'is_admin': False,
+            'is_active': rng.random() > 0.02,
+            'created_at': EPOCH - timedelta(minutes=i * 3),
+            'last_login': EPOCH - timedelta(days=rng.randrange(0, 120)),
+        } for i in range(sizes['users'])), 'users')
+        user_ids = range(first_user_id, first_user_id + sizes['users'])
+
+        insert(Material, ({
+            'title': f"{rng.choice(TOPICS)} {rng.choice(KINDS)} {i}",
+            'description': f"Synthetic benchmark material {i} covering {rng.choice(TOPICS).lower()}.",
+            'price': rng.choice([0, 500, 1000, 2000, 5000]),
+            'category_id': rng.choice(categories),
+            'file_path': f"materials/benchmark-{i}.pdf",
+            'file_format': 'pdf',
+            'image_path': 'uploads/images/benchmark.jpg',
+            'is_active': rng.random() > 0.05,
+            'is_free': rng.random() < 0.2,
+            'created_at': EPOCH - timedelta(minutes=i * 17),
+            'updated_at': EPOCH - timedelta(minutes=i * 17),
+        } for i in range(sizes['materials'])), 'materials')
+        material_ids = [row[0] for row in db.session.query(Material.id).order_by(Material.id).all()]
+
+        insert(VisitorRecord, ({
+            'ip_address': f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            'user_agent': 'Mozilla/5.0 (benchmark)',
+            'first_visit': EPOCH - timedelta(days=rng.randrange(0, 365)),
+            'last_visit': EPOCH - timedelta(days=rng.randrange(0, 30)),
+            'visit_count': rng.randrange(1, 50),
+        } for i in range(sizes['visitors'])), 'visitors')
+        visitor_ids = [row[0] for row in db.session.query(VisitorRecord.id).order_by(VisitorRecord.id).all()]
+
+        # Popular materials get most of the traffic
+        def popular_material():
+            return material_ids[min(len(material_ids) - 1, int(rng.paretovariate(1.2)) - 1)]
+
+        def page_view(i):
+            url = (f"/material/{popular_material()}" if rng.random() < 0.7 else rng.choice(STATIC_PAGES))
+            visitor = rng.choice(visitor_ids)
+            return {
+                'page_url': url,
+                'page_title': url,
+                'visitor_id': visitor,
+                'ip_address': f"10.0.{visitor // 256 % 256}.{visitor % 256}",
+                'user_agent': 'Mozilla/5.0 (benchmark)',
+                'view_count': 1,
+                'last_viewed': EPOCH - timedelta(seconds=i * 7),
+                'created_at': EPOCH - timedelta(seconds=i * 7),
+            }
+        insert(PageView, (page_view(i) for i in range(sizes['page_views'])), 'page_views')
+
+        def subscription(i):
+            plan_id, duration, max_materials = rng.choice(plans)
+            start = EPOCH - timedelta(days=rng.randrange(0, 720))
+            # A third run until 2099 so the active share does not depend on the day of the run
+            end = datetime(2099, 1, 1) if rng.random() < 0.33 else start + timedelta(days=duration)
+            return {
+                'user_id': rng.choice(user_ids),
+                'plan_id': plan_id,
+                'start_date': start,
+                'end_date': end,
+                'max_materials': max_materials,
+                'materials_accessed': rng.randrange(0, max_materials),
+                'is_active': rng.random() > 0.1,
+                'payment_status': rng.choice(['paid', 'paid', 'paid', 'pending', 'failed']),
+                'created_at': start,
+            }
+        insert(Subscription, (subscription(i) for i in range(sizes['subscriptions'])), 'subscriptions')
+
+        def downloads():
+            seen = set()
+            while len(seen) < min(sizes['downloads'], len(user_ids) * len(material_ids)):
+                # Heavy users download far more than most
+                pair = (user_ids[min(len(user_ids) - 1, int(rng.paretovariate(0.8)) - 1)]
+                        if rng.random() < 0.3 else rng.choice(user_ids), popular_material())
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                when = EPOCH - timedelta(minutes=rng.randrange(0, 525_600))
+                yield {'user_id': pair[0], 'material_id': pair[1], 'download_type': 'purchase',
+                       'download_count': 1, 'last_downloaded': when, 'created_at': when}
+        insert(DownloadRecord, downloads(), 'downloads')
+
+        def user_visits():
+            seen = set()
+            while len(seen) < sizes['user_visits']:
+                pair = (rng.choice(user_ids), (EPOCH - timedelta(days=rng.randrange(0, 365))).date())
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                yield {'user_id': pair[0], 'visit_date': pair[1], 'visit_count': rng.randrange(1, 5),
+                       'created_at': datetime.combine(pair[1], datetime.min.time())}
+        insert(UserVisit, user_visits(), 'user_visits')
+
+        result = reconcile_counters()
+        print(f"  engagement counters backfilled for {result['corrected']:,} material counter(s)")
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+
+def parse_server_timing(values):
+    metrics = {}
+    for value in values:
+        for name, duration, description in SERVER_TIMING.findall(value):
+            if duration:
+                metrics[name] = float(duration)
+            if description:
+                metrics[name] = int(description)
+    return metrics
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(client, method, path, requests, warmup, setup=None):
+    """Warm up, then time requests; setup(i) returns the request kwargs and is not timed"""
+    timings, queries, db_times, statuses = [], [], [], set()
+    for i in range(warmup + requests):
+        kwargs = setup(i) if setup else {}
+        started = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        response.close()
+        if i < warmup:
+            continue
+        metrics = parse_server_timing(response.headers.getlist('Server-Timing'))
+        timings.append(elapsed * 1000)
+        queries.append(metrics.get('db-count', 0))
+        db_times.append(metrics.get('db', 0.0))
+        statuses.add(response.status_code)
+    timings.sort()
+    return {
+        'method': method,
+        'path': path,
+        'status': sorted(statuses),
+        'requests': requests,
+        'p50_ms': round(percentile(timings, 0.50), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'min_ms': round(timings[0], 2),
+        'queries': max(queries),
+        'db_ms_mean': round(sum(db_times) / len(db_times), 2),
+    }
+
+
+def login(client, email, password):
+    response = client.post('/login', data={'email': email, 'password': password})
+    if response.status_code != 302:
+        raise RuntimeError(f"Could not log in as {email}")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(app, db, args, sizes):
+    from models import User, Material, DownloadRecord, MpesaTransaction
+
+    with app.app_context():
+        heavy_user_id = (db.session.query(DownloadRecord.user_id)
+                         .group_by(DownloadRecord.user_id)
+                         .order_by(db.func.count().desc(), DownloadRecord.user_id).limit(1).scalar())
+        heavy_user = db.session.get(User, heavy_user_id)
+        material_ids = [row[0] for row in db.session.query(Material.id).filter(Material.is_active == True)
+                        .order_by(Material.id).all()]
+        material_id = material_ids[len(material_ids) // 2]
+        heavy_email, heavy_user_id = heavy_user.email, heavy_user.id
+
+    run_id = f"{int(time.time())}-{os.getpid()}"
+
+    def callback_setup(i):
+        # A fresh pending purchase per request, so every callback is a first completion
+        with app.app_context():
+            transaction = MpesaTransaction(
+                user_id=heavy_user_id, material_id=material_ids[i % len(material_ids)],
+                msisdn='255700000000', amount=1000, conversation_id=f"BENCH-{run_id}-{i}",
+                transaction_reference=f"MAT{run_id}{i}", status='pending'
+            )
+            db.session.add(transaction)
+            db.session.commit()
+        return {'json': {'output_ConversationID': f"BENCH-{run_id}-{i}", 'output_ResponseCode': 'INS-0',
+                         'output_ResponseDesc': 'Request processed successfully',
+                         'output_TransactionID': f"T{run_id}{i}"}}
+
+    anonymous = app.test_client()
+    user = app.test_client()
+    login(user, heavy_email, BENCHMARK_PASSWORD)
+    admin = app.test_client()
+    login(admin, ADMIN_EMAIL, ADMIN_PASSWORD)
+
+    cases = [
+        ('index', anonymous, 'GET', '/', None),
+        ('search', anonymous, 'GET', '/search?q=calculus', None),
+        ('material_detail', anonymous, 'GET', f'/material/{material_id}', None),
+        ('top_users', user, 'GET', '/top-10-users', None),
+        ('dashboard', user, 'GET', '/dashboard', None),
+        ('admin_dashboard', admin, 'GET', '/admin', None),
+        ('admin_visitor_stats', admin, 'GET', '/admin/visitor-stats', None),
+        ('mpesa_callback', anonymous, 'POST', '/api/mpesa/callback', callback_setup),
+    ]
+    results = {}
+    for name, client, method, path, setup in cases:
+        results[name] = measure(client, method, path, args.requests, args.warmup, setup)
+        row = results[name]
+        print(f"  {name:<20} p50 {row['p50_ms']:8.1f} ms  p95 {row['p95_ms']:8.1f} ms  "
+              f"{row['queries']:>4} queries  status {','.join(map(str, row['status']))}")
+    return results
+
+
+def compare(current, previous_path):
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous.get('commit', '?')[:12]} ({previous_path}):")
+    for name, row in current['endpoints'].items():
+        before = previous.get('endpoints', {}).get(name)
+        if not before:
+            print(f"  {name:<20} (new)")
+            continue
+        change = (row['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+        print(f"  {name:<20} p50 {before['p50_ms']:8.1f} -> {row['p50_ms']:8.1f} ms ({change:+.0f}%)  "
+              f"queries {before['queries']} -> {row['queries']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='Fraction of the full dataset size')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=20, help='Timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--reseed', action='store_true', help='Rebuild the dataset even if it exists')
+    parser.add_argument('--output', default=None, help='JSON results file (default instance/benchmarks/<commit>.json)')
+    parser.add_argument('--compare', default=None, help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    sizes = dataset_sizes(args.scale)
+    path = database_path(args.scale, args.seed)
+    if args.reseed and path.exists():
+        for suffix in ('', '-wal', '-shm'):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+    needs_seed = not path.exists()
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # The app reads its configuration at import time
+    os.environ['FLASK_ENV'] = 'development'
+    os.environ['DEV_DATABASE_URL'] = f"sqlite:///{path.resolve()}"
+    os.environ.setdefault('LAZY_LOAD_DETECTION', 'off')
+    from app import app, db
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    print("=" * 60)
+    print("ENDPOINT BENCHMARK")
+    print(f"{path.name}: " + ', '.join(f"{count:,} {name}" for name, count in sizes.items()))
+    print("=" * 60)
+    if needs_seed:
+        print("Seeding dataset...")
+        started = time.perf_counter()
+        seed(app, db, sizes, args.seed)
+        print(f"✓ Seeded in {time.perf_counter() - started:.1f}s")
+
+    endpoints = run(app, db, args, sizes)
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'dataset': {'scale': args.scale, 'seed': args.seed, **sizes},
+        'requests': args.requests,
+        'warmup': args.warmup,
+        'endpoints': endpoints,
+    }
+    output = Path(args.output) if args.output else ROOT / 'instance' / 'benchmarks' / f"{(commit or 'results')[:12]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    print(f"✓ Results written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
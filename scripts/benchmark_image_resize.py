@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Responsive Image Benchmark
+Compares per-image CPU time of generate_responsive_images against the
+previous implementation (one optimize_image decode per size)
+
+Usage:
+    python scripts/benchmark_image_resize.py [image ...]
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+from utils.image_optimizer import (
+    generate_responsive_images,
+    optimize_image,
+    RESPONSIVE_SIZES,
+    WEBP_QUALITY
+)
+
+
+def legacy_generate_responsive_images(input_path, output_dir):
+    """The pre-cascade implementation: two opens and one full decode per size"""
+    for size_name, max_size in RESPONSIVE_SIZES.items():
+        output_path = Path(output_dir) / f"legacy_{size_name}.webp"
+        with Image.open(input_path) as img:
+            if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
+                optimize_image(input_path, output_path, format='webp', quality=WEBP_QUALITY,
+                               max_size=max_size, sharpen=True)
+            else:
+                optimize_image(input_path, output_path, format='webp', quality=WEBP_QUALITY,
+                               sharpen=False)
+
+
+def make_sample_photo(path, size=(4000, 3000)):
+    """Write a noisy gradient JPEG that compresses roughly like a photo"""
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    gradient = Image.linear_gradient('L').resize(size).convert('RGB')
+    Image.blend(noise, gradient, 0.5).save(path, 'JPEG', quality=90)
+
+
+def measure(func, *args):
+    """Return (cpu_seconds, wall_seconds) for one call"""
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    func(*args)
+    return time.process_time() - cpu_start, time.perf_counter() - wall_start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        images = sys.argv[1:]
+        if not images:
+            sample = os.path.join(workdir, 'sample.jpg')
+            make_sample_photo(sample)
+            images = [sample]
+
+        print("=" * 60)
+        print("RESPONSIVE IMAGE BENCHMARK")
+        print("=" * 60)
+        for image in images:
+            with Image.open(image) as img:
+                print(f"\n{os.path.basename(image)} ({img.size[0]}x{img.size[1]} {img.format})")
+            legacy_cpu, legacy_wall = measure(legacy_generate_responsive_images, image, workdir)
+            new_cpu, new_wall = measure(generate_responsive_images, image, workdir, 'bench')
+            print(f"  legacy:  {legacy_cpu:7.2f}s CPU  {legacy_wall:7.2f}s wall")
+            print(f"  cascade: {new_cpu:7.2f}s CPU  {new_wall:7.2f}s wall")
+            print(f"  speedup: {legacy_cpu / new_cpu:5.1f}x CPU  {legacy_wall / new_wall:5.1f}x wall")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+SQLite Concurrency Benchmark
+Compares concurrent read/write throughput of the previous engine settings
+(rollback journal, default PRAGMAs) with the tuned profile from
+utils.db_engine (WAL, busy timeout, mmap)
+
+Reader threads run catalog-style queries; writer threads replay the
+track_visitor pattern (look the visitor up, then update or insert it).
+
+Usage:
+    python scripts/benchmark_sqlite_concurrency.py [--readers 8] [--writers 4] [--seconds 10]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from utils.db_engine import engine_options, install_sqlite_pragmas, sqlite_pragmas
+
+LEGACY_OPTIONS = {
+    'pool_pre_ping': True,
+    'pool_recycle': 3600,
+    'pool_size': 10,
+    'max_overflow': 20,
+    'connect_args': {'check_same_thread': False},
+}
+MATERIALS = 2000
+VISITORS = 5000
+
+
+def make_engine(path, tuned):
+    url = f"sqlite:///{path}"
+    if not tuned:
+        return create_engine(url, **LEGACY_OPTIONS)
+    engine = create_engine(url, **engine_options(url, LEGACY_OPTIONS))
+    install_sqlite_pragmas(engine, sqlite_pragmas())
+    return engine
+
+
+def seed(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE materials (id INTEGER PRIMARY KEY, title TEXT, is_active BOOLEAN, created_at REAL)"))
+        conn.execute(text("CREATE INDEX ix_materials_active_created ON materials (is_active, created_at)"))
+        conn.execute(text("CREATE TABLE visitor_records (id INTEGER PRIMARY KEY, ip_address TEXT, visit_count INTEGER, last_visit REAL)"))
+        conn.execute(text("CREATE INDEX ix_visitor_records_ip ON visitor_records (ip_address)"))
+        conn.execute(text("INSERT INTO materials (title, is_active, created_at) VALUES (:t, 1, :c)"),
+                     [{'t': f"Material {i}", 'c': time.time() - i} for i in range(MATERIALS)])
+        conn.execute(text("INSERT INTO visitor_records (ip_address, visit_count, last_visit) VALUES (:ip, 1, :t)"),
+                     [{'ip': f"10.0.{i // 256}.{i % 256}", 't': time.time()} for i in range(VISITORS)])
+
+
+def reader(engine, stop, counts):
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT * FROM materials WHERE is_active = 1 ORDER BY created_at DESC "
+                                  "LIMIT 12 OFFSET :o"), {'o': random.randrange(0, MATERIALS - 12)}).fetchall()
+            counts['reads'] += 1
+        except OperationalError:
+            counts['read_errors'] += 1
+
+
+def writer(engine, stop, counts):
+    while not stop.is_set():
+        ip = f"10.0.{random.randrange(0, 40)}.{random.randrange(0, 256)}"
+        try:
+            with engine.begin() as conn:
+                row = conn.execute(text("SELECT id FROM visitor_records WHERE ip_address = :ip"), {'ip': ip}).first()
+                if row:
+                    conn.execute(text("UPDATE visitor_records SET visit_count = visit_count + 1, last_visit = :t "
+                                      "WHERE id = :id"), {'t': time.time(), 'id': row[0]})
+                else:
+                    conn.execute(text("INSERT INTO visitor_records (ip_address, visit_count, last_visit) "
+                                      "VALUES (:ip, 1, :t)"), {'ip': ip, 't': time.time()})
+            counts['writes'] += 1
+        except OperationalError:
+            counts['write_errors'] += 1
+
+
+def run(tuned, readers, writers, seconds):
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = make_engine(os.path.join(workdir, 'bench.db'), tuned)
+        seed(engine)
+        stop = threading.Event()
+        per_thread = []
+        threads = []
+        for target, count in ((reader, readers), (writer, writers)):
+            for _ in range(count):
+                counts = {'reads': 0, 'writes': 0, 'read_errors': 0, 'write_errors': 0}
+                per_thread.append(counts)
+                threads.append(threading.Thread(target=target, args=(engine, stop, counts)))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+    return {key: sum(counts[key] for counts in per_thread) for key in per_thread[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("SQLITE CONCURRENCY BENCHMARK")
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds:g}s per profile")
+    print("=" * 60)
+    results = {}
+    for name, tuned in (('legacy', False), ('tuned', True)):
+        result = results[name] = run(tuned, args.readers, args.writers, args.seconds)
+        print(f"  {name:7} {result['reads'] / args.seconds:9.0f} reads/s  {result['writes'] / args.seconds:7.0f} writes/s  "
+              f"{result['read_errors'] + result['write_errors']:5} lock errors")
+    legacy, tuned = results['legacy'], results['tuned']
+    print(f"  speedup: {tuned['reads'] / max(1, legacy['reads']):5.1f}x reads  "
+          f"{tuned['writes'] / max(1, legacy['writes']):5.1f}x writes")
+
+
+if __name__ == '__main__':
+    main()
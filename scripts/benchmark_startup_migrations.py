@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Startup Migration Benchmark
+Compares the schema check every worker runs on a cold start: the previous
+introspection pass (create_all, migrate_all_tables, migrate_indexes and
+add_missing_columns) against the schema_migrations ledger lookup
+
+Both run against the configured database after it has been migrated, which
+is the state a reloaded worker finds it in. A fresh engine is used for every
+round so each one pays the connection setup a new worker would.
+
+Usage:
+    python scripts/benchmark_startup_migrations.py [--rounds 20]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import app, db, add_missing_columns
+from utils.db_migrations import (
+    migrate_all_tables, migrate_indexes, safe_migrate_database, run_migrations
+)
+
+
+def legacy_startup():
+    """The pre-ledger safe_migrate_database body"""
+    db.create_all()
+    migrate_all_tables()
+    migrate_indexes()
+    add_missing_columns()
+
+
+def ledger_startup():
+    result = safe_migrate_database()
+    if result['migrations_applied']:
+        raise RuntimeError("Schema was not current, run `flask db migrate` first")
+
+
+def measure(function, rounds):
+    timings = []
+    for _ in range(rounds):
+        db.engine.dispose()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2], timings[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("STARTUP MIGRATION BENCHMARK")
+    print(f"{app.config['SQLALCHEMY_DATABASE_URI']}, {args.rounds} rounds")
+    print("=" * 60)
+    with app.app_context():
+        run_migrations()
+        legacy_median, legacy_best = measure(legacy_startup, args.rounds)
+        ledger_median, ledger_best = measure(ledger_startup, args.rounds)
+    print(f"  introspection  median {legacy_median * 1000:8.1f} ms   best {legacy_best * 1000:8.1f} ms")
+    print(f"  ledger         median {ledger_median * 1000:8.1f} ms   best {ledger_best * 1000:8.1f} ms")
+    print(f"  saved per worker start: {(legacy_median - ledger_median) * 1000:.1f} ms "
+          f"({legacy_median / max(ledger_median, 1e-9):.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ document.addEventListener('DOMContentLoaded', function() {
         initMobileNavigation();
         initSearch();
         initLazyLoading();
+        initLoadMore();
         initPerformanceOptimizations();
         initFlashMessages();
     } catch (error) {
@@ -160,6 +161,69 @@ function initLazyLoading() {
     }
 }
 
+function initLoadMore() {
+    // Cursor-paginated lists: the Next link appends the following page in place
+    // when it scrolls into view (or is clicked), and stays a plain link without JS
+    try {
+        const link = document.querySelector('a[data-load-more]');
+        if (!link || !window.fetch || !window.DOMParser) return;
+        const selector = link.dataset.loadMore;
+        let loading = false;
+
+        const loadNext = (anchor) => {
+            if (loading) return;
+            loading = true;
+            anchor.classList.add('loading');
+            fetch(anchor.href, { credentials: 'same-origin', headers: { 'X-Requested-With': 'fetch' } })
+                .then(response => {
+                    if (!response.ok) throw new Error('HTTP ' + response.status);
+                    return response.text();
+                })
+                .then(html => {
+                    const page = new DOMParser().parseFromString(html, 'text/html');
+                    const target = document.querySelector(selector);
+                    const incoming = page.querySelector(selector);
+                    if (!target || !incoming) throw new Error('List not found in next page');
+                    target.append(...incoming.children);
+                    const nextLink = page.querySelector('a[data-load-more]');
+                    // The list now starts at the first page, so only Next is kept
+                    anchor.closest('.pagination').querySelectorAll('a').forEach(a => {
+                        if (a !== anchor) a.remove();
+                    });
+                    if (nextLink) {
+                        anchor.href = nextLink.href;
+                    } else {
+                        anchor.closest('.pagination').remove();
+                        if (observer) observer.disconnect();
+                    }
+                    initLazyLoading();
+                })
+                .catch(error => {
+                    // Fall back to a normal page load
+                    console.error('Error loading more items:', error);
+                    if (observer) observer.disconnect();
+                    window.location.href = anchor.href;
+                })
+                .finally(() => {
+                    anchor.classList.remove('loading');
+                    loading = false;
+                });
+        };
+
+        link.addEventListener('click', (event) => {
+            event.preventDefault();
+            loadNext(link);
+        });
+
+        const observer = 'IntersectionObserver' in window ? new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNext(link);
+        }, { rootMargin: '200px' }) : null;
+        if (observer) observer.observe(link);
+    } catch (error) {
+        console.error('Error in initLoadMore:', error);
+    }
+}
+
 function initPerformanceOptimizations() {
     try {
         preloadCriticalResources();
@@ -227,8 +291,19 @@ function initServiceWorker() {
     // Check for service worker support with feature detection
     if ('serviceWorker' in navigator && window.browserCompatibility && window.browserCompatibility.hasServiceWorker) {
         window.addEventListener('load', function() {
-            // Use Promise.resolve for better browser compatibility
-            var registrationPromise = navigator.serviceWorker.register('/static/js/sw.js');
+            // Served from the root so its scope covers every page, not just /static/js/
+            var registrationPromise = navigator.serviceWorker.register('/sw.js', { scope: '/' });
+            
+            // Retire the worker older releases registered under /static/js/
+            if (navigator.serviceWorker.getRegistrations) {
+                navigator.serviceWorker.getRegistrations().then(function(registrations) {
+                    registrations.forEach(function(registration) {
+                        if (registration.scope.indexOf('/static/js/') !== -1) {
+                            registration.unregister();
+                        }
+                    });
+                }).catch(function() {});
+            }
             
             if (registrationPromise && typeof registrationPromise.then === 'function') {
                 registrationPromise
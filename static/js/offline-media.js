@@ -0,0 +1,85 @@
+/**
+ * Offline Media
+ * "Save for offline" buttons: ask the service worker to keep a material's
+ * page and file in its offline cache so it reopens without a connection
+ */
+
+(function() {
+    'use strict';
+
+    function sendToWorker(message) {
+        return navigator.serviceWorker.ready.then(function(registration) {
+            return new Promise(function(resolve, reject) {
+                const channel = new MessageChannel();
+                channel.port1.onmessage = function(event) {
+                    const reply = event.data || {};
+                    if (reply.ok) {
+                        resolve(reply);
+                    } else {
+                        reject(new Error(reply.error || 'Offline storage is unavailable'));
+                    }
+                };
+                registration.active.postMessage(message, [channel.port2]);
+            });
+        });
+    }
+
+    function notify(message, type) {
+        if (window.showNotification) {
+            window.showNotification(message, type);
+        }
+    }
+
+    function setState(button, saved, busy) {
+        button.disabled = !!busy;
+        button.dataset.saved = saved ? 'true' : 'false';
+        if (busy) {
+            button.textContent = saved ? '⏳ Removing...' : '⏳ Saving for offline...';
+        } else {
+            button.textContent = saved ? '✓ Saved offline (tap to remove)' : '💾 Save for offline';
+        }
+        button.setAttribute('aria-pressed', saved ? 'true' : 'false');
+    }
+
+    function initButton(button) {
+        let urls;
+        try {
+            urls = JSON.parse(button.dataset.offlineUrls || '[]');
+        } catch (error) {
+            return;
+        }
+        if (!urls.length) {
+            return;
+        }
+        button.hidden = false;
+
+        sendToWorker({ type: 'offline-status', urls: urls })
+            .then(function(reply) { setState(button, reply.saved, false); })
+            .catch(function() { setState(button, false, false); });
+
+        button.addEventListener('click', function() {
+            const saved = button.dataset.saved === 'true';
+            setState(button, saved, true);
+            if (!saved && navigator.storage && navigator.storage.persist) {
+                // Ask the browser not to evict saved media under storage pressure
+                navigator.storage.persist().catch(function() {});
+            }
+            sendToWorker({ type: saved ? 'offline-remove' : 'offline-save', urls: urls })
+                .then(function(reply) {
+                    setState(button, reply.saved, false);
+                    notify(reply.saved ? 'Saved for offline use' : 'Offline copy removed', 'success');
+                })
+                .catch(function(error) {
+                    setState(button, saved, false);
+                    notify(error.message, 'error');
+                });
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function() {
+        if (!('serviceWorker' in navigator) || !('caches' in window) || !window.MessageChannel) {
+            return;
+        }
+        document.querySelectorAll('[data-offline-urls]').forEach(initButton);
+    });
+})();
@@ -1,26 +1,247 @@
+/**
+ * Service Worker
+ * Served from /sw.js with self.PRECACHE_MANIFEST ({version, urls}) prepended
+ * from the `flask assets build` output, so every deploy rolls the caches over.
+ *
+ * Strategies:
+ *   content-hashed CSS/JS       cache-first (names change whenever bytes do)
+ *   catalog pages               stale-while-revalidate
+ *   reader/player pages         network-first
+ *   other static files          stale-while-revalidate
+ *   media saved for offline     served from the offline cache, Range-aware
+ *   everything else             network, falling back to saved copies offline
+ */
 
+const PRECACHE = self.PRECACHE_MANIFEST || { version: 'dev', urls: [] };
+const CACHE_PREFIX = 'pcm-';
+const ASSET_CACHE = CACHE_PREFIX + 'assets-' + PRECACHE.version;
+const STATIC_CACHE = CACHE_PREFIX + 'static-' + PRECACHE.version;
+const PAGE_CACHE = CACHE_PREFIX + 'pages-' + PRECACHE.version;
+// Filled only when a subscriber taps "Save for offline"; kept across deploys
+const OFFLINE_CACHE = CACHE_PREFIX + 'offline-media';
+const CURRENT_CACHES = [ASSET_CACHE, STATIC_CACHE, PAGE_CACHE, OFFLINE_CACHE];
 
-const CACHE_NAME = 'e-materials-store-v1';
-const STATIC_CACHE = 'static-v1';
-const DYNAMIC_CACHE = 'dynamic-v1';
+const MAX_PAGE_ENTRIES = 50;
+const MAX_STATIC_ENTRIES = 150;
 
-const urlsToCache = [
-  '/',
-  '/static/css/style.css',
-  '/static/js/main.js',
-  '/static/images/favicon.ico'
+const HASHED_ASSET = /^\/static\/.+\.[0-9a-f]{8}\.(?:css|js)$/;
+const CATALOG_PAGES = [
+  /^\/$/,
+  /^\/search$/,
+  /^\/material\/\d+$/,
+  /^\/news(?:\/\d+)?$/,
+  /^\/top-10-users$/
 ];
+// Reader/player pages: network-first, the copy is reused when saving for offline
+// (refetching would count as another subscription access)
+const READER_PAGES = [/^\/read\/\d+$/, /^\/stream\/\d+$/];
+// Large files: never cached implicitly, only when saved for offline use
+const MEDIA_PATHS = [/^\/video\/\d+$/, /^\/static\/uploads\//];
+
+function isCatalogPage(url) {
+  return CATALOG_PAGES.some(function(pattern) { return pattern.test(url.pathname); });
+}
+
+function isReaderPage(url) {
+  return READER_PAGES.some(function(pattern) { return pattern.test(url.pathname); });
+}
+
+function isMedia(url) {
+  return MEDIA_PATHS.some(function(pattern) { return pattern.test(url.pathname); });
+}
+
+function isCacheable(response) {
+  // Redirected responses are usually the login page standing in for the real one
+  return response && response.status === 200 && response.type === 'basic' && !response.redirected;
+}
+
+function trimCache(cache, maxEntries) {
+  return cache.keys().then(function(keys) {
+    // Keys come back in insertion order, so the oldest entries go first
+    return Promise.all(keys.slice(0, Math.max(0, keys.length - maxEntries)).map(function(key) {
+      return cache.delete(key);
+    }));
+  });
+}
+
+function putInCache(cacheName, request, response, maxEntries) {
+  return caches.open(cacheName)
+    .then(function(cache) {
+      return cache.put(request, response).then(function() {
+        return maxEntries ? trimCache(cache, maxEntries) : undefined;
+      });
+    })
+    .catch(function(error) {
+      // Storage blocked by tracking prevention or over quota
+      console.warn('Cache write failed:', cacheName, error);
+    });
+}
+
+function cacheFirst(event, cacheName) {
+  const request = event.request;
+  return caches.open(cacheName)
+    .then(function(cache) { return cache.match(request); })
+    .catch(function() { return undefined; })
+    .then(function(cached) {
+      if (cached) {
+        return cached;
+      }
+      return fetch(request).then(function(response) {
+        if (isCacheable(response)) {
+          event.waitUntil(putInCache(cacheName, request, response.clone()));
+        }
+        return response;
+      });
+    });
+}
+
+function staleWhileRevalidate(event, cacheName, maxEntries) {
+  const request = event.request;
+  const fetched = fetch(request);
+  // Registered before the page reads the body, so the clone is always possible
+  const updated = fetched
+    .then(function(response) {
+      if (isCacheable(response)) {
+        return putInCache(cacheName, request, response.clone(), maxEntries);
+      }
+    })
+    .catch(function() {});
+  event.waitUntil(updated);
+
+  return caches.open(cacheName)
+    .then(function(cache) { return cache.match(request); })
+    .catch(function() { return undefined; })
+    .then(function(cached) { return cached || fetched; });
+}
+
+function networkFirst(event, cacheName, maxEntries) {
+  const request = event.request;
+  return fetch(request).then(function(response) {
+    if (isCacheable(response)) {
+      event.waitUntil(putInCache(cacheName, request, response.clone(), maxEntries));
+    }
+    return response;
+  });
+}
+
+function offlineFallback(request, error) {
+  // Saved reader pages live in the offline cache, catalog pages in the page cache
+  return caches.match(request, { ignoreVary: true })
+    .then(function(cached) {
+      return cached || caches.match('/', { cacheName: PAGE_CACHE });
+    })
+    .then(function(cached) {
+      if (cached) {
+        return cached;
+      }
+      throw error;
+    });
+}
+
+function parseRange(header, size) {
+  const match = /^bytes=(\d*)-(\d*)$/.exec(header.trim());
+  if (!match || (!match[1] && !match[2])) {
+    return null;
+  }
+  if (!match[1]) {
+    // Suffix range: the last N bytes
+    return { start: Math.max(0, size - parseInt(match[2], 10)), end: size - 1 };
+  }
+  const start = parseInt(match[1], 10);
+  const end = match[2] ? Math.min(parseInt(match[2], 10), size - 1) : size - 1;
+  return { start: start, end: end };
+}
+
+function respondFromSaved(request, saved) {
+  const rangeHeader = request.headers.get('Range');
+  if (!rangeHeader) {
+    return saved;
+  }
+  // Media elements seek with byte ranges; slice the stored body to answer them
+  return saved.blob().then(function(blob) {
+    const range = parseRange(rangeHeader, blob.size);
+    const contentType = saved.headers.get('Content-Type') || blob.type;
+    if (!range) {
+      return new Response(blob, { status: 200, headers: { 'Content-Type': contentType, 'Accept-Ranges': 'bytes' } });
+    }
+    if (range.start >= blob.size || range.start > range.end) {
+      return new Response('', { status: 416, headers: { 'Content-Range': 'bytes */' + blob.size } });
+    }
+    const body = blob.slice(range.start, range.end + 1);
+    return new Response(body, {
+      status: 206,
+      statusText: 'Partial Content',
+      headers: {
+        'Content-Type': contentType,
+        'Content-Length': String(body.size),
+        'Content-Range': 'bytes ' + range.start + '-' + range.end + '/' + blob.size,
+        'Accept-Ranges': 'bytes'
+      }
+    });
+  });
+}
+
+function savedOrNetwork(request) {
+  return caches.open(OFFLINE_CACHE)
+    .then(function(cache) { return cache.match(request.url, { ignoreVary: true }); })
+    .catch(function() { return undefined; })
+    .then(function(saved) {
+      return saved ? respondFromSaved(request, saved) : fetch(request);
+    });
+}
+
+function saveForOffline(urls) {
+  return caches.open(OFFLINE_CACHE).then(function(cache) {
+    // One at a time, a slow connection should not split its bandwidth
+    return urls.reduce(function(previous, url) {
+      return previous.then(function() {
+        const copy = caches.match(url, { cacheName: PAGE_CACHE }).catch(function() { return undefined; });
+        return copy.then(function(cached) {
+          return cached || fetch(url, { credentials: 'same-origin' });
+        }).then(function(response) {
+          if (!isCacheable(response)) {
+            throw new Error(response.status === 429
+              ? 'Too many downloads in progress, please try again shortly'
+              : 'Could not download ' + url + ' (' + response.status + ')');
+          }
+          return cache.put(url, response);
+        });
+      });
+    }, Promise.resolve());
+  }).catch(function(error) {
+    // All or nothing, a page without its file is useless offline
+    return removeOffline(urls).then(function() { throw error; });
+  });
+}
+
+function removeOffline(urls) {
+  return caches.open(OFFLINE_CACHE).then(function(cache) {
+    return Promise.all(urls.map(function(url) { return cache.delete(url); }));
+  });
+}
+
+function isSavedOffline(urls) {
+  return caches.open(OFFLINE_CACHE).then(function(cache) {
+    return Promise.all(urls.map(function(url) { return cache.match(url, { ignoreVary: true }); }));
+  }).then(function(matches) {
+    return matches.every(Boolean);
+  });
+}
 
 self.addEventListener('install', function(event) {
-  console.log('Service Worker installing...');
   event.waitUntil(
-    caches.open(STATIC_CACHE)
-      .then(function(cache) {
-        console.log('Opened cache');
-        return cache.addAll(urlsToCache);
+    Promise.all([caches.open(ASSET_CACHE), caches.open(STATIC_CACHE), caches.open(PAGE_CACHE)])
+      .then(function(opened) {
+        const hashed = PRECACHE.urls.filter(function(url) { return HASHED_ASSET.test(url); });
+        const other = PRECACHE.urls.filter(function(url) { return !HASHED_ASSET.test(url); });
+        return Promise.all([
+          opened[0].addAll(hashed),
+          opened[1].addAll(other),
+          // Offline fallback for navigations
+          opened[2].add('/').catch(function() {})
+        ]);
       })
       .then(function() {
-        console.log('Static resources cached');
         return self.skipWaiting();
       })
       .catch(function(error) {
@@ -33,13 +254,11 @@ self.addEventListener('install', function(event) {
 });
 
 self.addEventListener('activate', function(event) {
-  console.log('Service Worker activating...');
   event.waitUntil(
     caches.keys().then(function(cacheNames) {
       return Promise.all(
         cacheNames.map(function(cacheName) {
-          if (cacheName !== STATIC_CACHE && cacheName !== DYNAMIC_CACHE) {
-            console.log('Deleting old cache:', cacheName);
+          if (CURRENT_CACHES.indexOf(cacheName) === -1) {
             return caches.delete(cacheName).catch(function(error) {
               console.warn('Failed to delete cache:', cacheName, error);
             });
@@ -47,7 +266,6 @@ self.addEventListener('activate', function(event) {
         })
       );
     }).then(function() {
-      console.log('Service Worker activated');
       return self.clients.claim();
     }).catch(function(error) {
       // Handle storage access blocked by tracking prevention
@@ -59,69 +277,65 @@ self.addEventListener('activate', function(event) {
 });
 
 self.addEventListener('fetch', function(event) {
-  
-  if (event.request.method !== 'GET') {
+  const request = event.request;
+  if (!request.url.startsWith(self.location.origin + '/')) {
     return;
   }
+  const url = new URL(request.url);
 
-  
-  if (!event.request.url.startsWith('http')) {
+  if (url.pathname === '/logout' || (request.method === 'POST' && url.pathname === '/login')) {
+    // Cached catalog pages show the previous account's header and access state
+    event.waitUntil(caches.delete(PAGE_CACHE).catch(function() {}));
+    return;
+  }
+  if (request.method !== 'GET') {
     return;
   }
 
-  event.respondWith(
-    caches.match(event.request)
-      .then(function(response) {
-        
-        if (response) {
-          return response;
-        }
-        
-        
-        const fetchRequest = event.request.clone();
-        
-        return fetch(fetchRequest).then(function(response) {
-          
-          if (!response || response.status !== 200 || response.type !== 'basic') {
-            return response;
-          }
-          
-          
-          const responseToCache = response.clone();
-          
-          
-          const cacheToUse = event.request.url.includes('/static/') ? STATIC_CACHE : DYNAMIC_CACHE;
-          
-          // Try to cache, but don't fail if storage is blocked
-          caches.open(cacheToUse)
-            .then(function(cache) {
-              cache.put(event.request, responseToCache);
-            })
-            .catch(function(error) {
-              // Silently handle storage access blocked by tracking prevention
-              // The response will still be returned to the client
-            });
-          
-          return response;
-        }).catch(function(error) {
-          console.log('Fetch failed:', error);
-          
-          // Try to return cached fallback, but handle storage access errors
-          if (event.request.mode === 'navigate') {
-            return caches.match('/').catch(function() {
-              // If cache access fails, return the fetch error
-              throw error;
-            });
-          }
-          throw error;
-        });
-      })
-      .catch(function(error) {
-        // If cache.match fails (storage blocked), just fetch normally
-        return fetch(event.request).catch(function(fetchError) {
-          console.log('Both cache and fetch failed:', fetchError);
-          throw fetchError;
-        });
-      })
-  );
+  if (HASHED_ASSET.test(url.pathname)) {
+    event.respondWith(cacheFirst(event, ASSET_CACHE));
+  } else if (isMedia(url)) {
+    event.respondWith(savedOrNetwork(request));
+  } else if (url.pathname.startsWith('/static/')) {
+    event.respondWith(staleWhileRevalidate(event, STATIC_CACHE, MAX_STATIC_ENTRIES));
+  } else if (request.mode === 'navigate' && isCatalogPage(url)) {
+    event.respondWith(staleWhileRevalidate(event, PAGE_CACHE, MAX_PAGE_ENTRIES).catch(function(error) {
+      return offlineFallback(request, error);
+    }));
+  } else if (request.mode === 'navigate' && isReaderPage(url)) {
+    event.respondWith(networkFirst(event, PAGE_CACHE, MAX_PAGE_ENTRIES).catch(function(error) {
+      return offlineFallback(request, error);
+    }));
+  } else if (request.mode === 'navigate') {
+    event.respondWith(fetch(request).catch(function(error) {
+      return offlineFallback(request, error);
+    }));
+  }
+});
+
+self.addEventListener('message', function(event) {
+  const data = event.data || {};
+  const port = event.ports && event.ports[0];
+  const urls = Array.isArray(data.urls) ? data.urls : [];
+  let work;
+
+  if (data.type === 'offline-save') {
+    work = saveForOffline(urls).then(function() { return { saved: true }; });
+  } else if (data.type === 'offline-remove') {
+    work = removeOffline(urls).then(function() { return { saved: false }; });
+  } else if (data.type === 'offline-status') {
+    work = isSavedOffline(urls).then(function(saved) { return { saved: saved }; });
+  } else {
+    return;
+  }
+
+  event.waitUntil(work.then(function(result) {
+    if (port) {
+      port.postMessage(Object.assign({ ok: true }, result));
+    }
+  }, function(error) {
+    if (port) {
+      port.postMessage({ ok: false, error: (error && error.message) || String(error) });
+    }
+  }));
 });
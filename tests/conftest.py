@@ -0,0 +1,57 @@
+"""
+Test fixtures
+The app runs on a throwaway SQLite file migrated once per session; each
+test gets a request context and its leftover session state rolled back
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'portal-sdk')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# app.py reads its configuration and starts the slow query log, stream
+# slots and restore state at import, so everything it writes is pointed at
+# a throwaway directory first
+_DATA_DIR = tempfile.mkdtemp(prefix='pcm-tests-')
+os.environ['FLASK_ENV'] = 'development'
+os.environ['DEV_DATABASE_URL'] = 'sqlite:///' + os.path.join(_DATA_DIR, 'test.db')
+os.environ['INSTANCE_PATH'] = os.path.join(_DATA_DIR, 'instance')
+os.environ['STREAM_SLOT_DIR'] = os.path.join(_DATA_DIR, 'stream_slots')
+os.environ['SLOW_QUERY_LOG'] = 'false'
+
+from app import app as flask_app, init_db  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    init_db()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def ctx(app):
+    """Request context for code that reads current_app, g or request"""
+    with app.test_request_context():
+        yield app
+        db.session.rollback()
+
+
+@pytest.fixture
+def data_dir():
+    """Scratch directory inside the session's data directory"""
+    path = tempfile.mkdtemp(dir=_DATA_DIR)
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
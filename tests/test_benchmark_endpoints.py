@@ -0,0 +1,48 @@
+"""
+Hot request paths over a small seeded benchmark dataset
+
+Runs scripts/benchmark_endpoints.py's seed and cases at a thousandth of the
+full size, so CI catches a hot path that errors or starts issuing a query
+per row. Timings are left to the full-scale script and its JSON results.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from models import db
+from scripts.benchmark_endpoints import dataset_sizes, seed, run
+
+SCALE = 0.001  # 100 users, 20 materials, 1,000 page views, 500 downloads
+# Queries per request; the counts do not depend on the dataset size
+MAX_QUERIES = {
+    'index': 5,
+    'search': 5,
+    'material_detail': 5,
+    'top_users': 12,
+    'dashboard': 8,
+    'admin_dashboard': 20,
+    'admin_visitor_stats': 10,
+    'mpesa_callback': 8,
+}
+
+
+@pytest.fixture(scope='module')
+def results(app):
+    sizes = dataset_sizes(SCALE)
+    seed(app, db, sizes, 42)
+    return run(app, db, SimpleNamespace(requests=2, warmup=1), sizes)
+
+
+def test_every_case_is_checked(results):
+    assert set(results) == set(MAX_QUERIES)
+
+
+@pytest.mark.parametrize('name', sorted(MAX_QUERIES))
+def test_hot_path_succeeds(results, name):
+    assert results[name]['status'] == [200]
+
+
+@pytest.mark.parametrize('name', sorted(MAX_QUERIES))
+def test_hot_path_query_count_is_bounded(results, name):
+    assert 0 < results[name]['queries'] <= MAX_QUERIES[name]
@@ -0,0 +1,143 @@
+"""Content addressed upload store: deduplication, reference counts and release"""
+
+import io
+import os
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from models import db, Material, StoredBlob
+from utils import content_store
+from utils.content_store import store_upload, release_blob, rebuild_ref_counts, blob_relative_path
+
+
+def upload(data, filename='notes.pdf'):
+    return FileStorage(io.BytesIO(data), filename=filename)
+
+
+@pytest.fixture
+def store(ctx, data_dir, request):
+    """Static folder and content unique to the test"""
+    content = f'content of {request.node.name}'.encode()
+    yield data_dir, content
+    db.session.rollback()
+    StoredBlob.query.filter(StoredBlob.file_path.like('uploads/%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def blob_file(static_folder, blob):
+    return os.path.join(static_folder, blob.file_path)
+
+
+def test_identical_uploads_share_one_blob(store):
+    static_folder, content = store
+    first, first_deduplicated = store_upload(upload(content), static_folder)
+    second, second_deduplicated = store_upload(upload(content, 'copy.pdf'), static_folder)
+    db.session.commit()
+
+    assert (first_deduplicated, second_deduplicated) == (False, True)
+    assert first.id == second.id
+    assert second.ref_count == 2
+    assert os.path.exists(blob_file(static_folder, first))
+    assert len(os.listdir(os.path.dirname(blob_file(static_folder, first)))) == 1
+
+
+def test_release_keeps_blob_until_last_reference(store):
+    static_folder, content = store
+    blob, _ = store_upload(upload(content), static_folder)
+    store_upload(upload(content), static_folder)
+    db.session.commit()
+    path = blob_file(static_folder, blob)
+
+    assert release_blob(blob.file_path, static_folder) is False
+    db.session.commit()
+    assert os.path.exists(path)
+    assert db.session.get(StoredBlob, blob.id).ref_count == 1
+
+    assert release_blob(blob.file_path, static_folder) is True
+    db.session.commit()
+    assert not os.path.exists(path)
+    assert StoredBlob.query.filter_by(sha256=blob.sha256).first() is None
+
+
+def test_file_is_only_deleted_on_commit(store):
+    static_folder, content = store
+    blob, _ = store_upload(upload(content), static_folder)
+    db.session.commit()
+    path, blob_id = blob_file(static_folder, blob), blob.id
+
+    assert release_blob(blob.file_path, static_folder) is True
+    assert os.path.exists(path)
+    db.session.rollback()
+
+    assert os.path.exists(path)
+    assert db.session.get(StoredBlob, blob_id).ref_count == 1
+    db.session.commit()
+    assert os.path.exists(path)
+
+
+def test_reupload_in_same_transaction_keeps_file(store):
+    static_folder, content = store
+    blob, _ = store_upload(upload(content), static_folder)
+    db.session.commit()
+    path = blob_file(static_folder, blob)
+
+    release_blob(blob.file_path, static_folder)
+    db.session.flush()
+    again, _ = store_upload(upload(content), static_folder)
+    db.session.commit()
+
+    assert os.path.exists(path)
+    assert again.ref_count == 1
+
+
+def test_rebuild_ref_counts_matches_materials(store):
+    static_folder, content = store
+    blob, _ = store_upload(upload(content), static_folder)
+    material = Material(title='Rebuilt', description='x', price=0, file_path=blob.file_path)
+    db.session.add(material)
+    blob.ref_count = 7
+    db.session.commit()
+
+    counts = rebuild_ref_counts()
+    db.session.commit()
+
+    assert counts[blob.file_path] == 1
+    assert db.session.get(StoredBlob, blob.id).ref_count == 1
+    db.session.delete(material)
+    db.session.commit()
+
+
+@pytest.mark.parametrize('winner_ext', ['.pdf', '.docx'])
+def test_losing_a_concurrent_insert_leaves_no_orphan(store, monkeypatch, winner_ext):
+    static_folder, content = store
+    sha256 = hashlib.sha256(content).hexdigest()
+    winner_path = blob_relative_path(sha256, winner_ext)
+    # The other upload renamed its file and committed its row between our lookup and insert
+    os.makedirs(os.path.dirname(os.path.join(static_folder, winner_path)), exist_ok=True)
+    with open(os.path.join(static_folder, winner_path), 'wb') as f:
+        f.write(content)
+    with db.engine.begin() as conn:
+        conn.execute(StoredBlob.__table__.insert().values(
+            sha256=sha256, file_path=winner_path, size=len(content), ref_count=1))
+    real_query = StoredBlob.query
+    lookups = []
+
+    class FirstLookupMisses:
+        def filter_by(self, **criteria):
+            lookups.append(criteria)
+            if len(lookups) == 1:
+                return SimpleNamespace(first=lambda: None)
+            return real_query.filter_by(**criteria)
+
+    monkeypatch.setattr(content_store.StoredBlob, 'query', FirstLookupMisses())
+    blob, deduplicated = store_upload(upload(content, 'race.pdf'), static_folder)
+    monkeypatch.undo()
+    db.session.commit()
+
+    assert deduplicated is True
+    assert (blob.file_path, blob.ref_count) == (winner_path, 2)
+    blob_dir = os.path.dirname(os.path.join(static_folder, winner_path))
+    assert os.listdir(blob_dir) == [os.path.basename(winner_path)]
@@ -0,0 +1,98 @@
+"""DOCX pre-rendering: render failures are recorded and not resubmitted"""
+
+import os
+
+import pytest
+
+import app as app_module
+from models import db, Material, User
+from utils.docx_renderer import render_docx, render_failed, get_docx_pages, pages_dir_for
+
+docx = pytest.importorskip('docx')
+
+FILE_PATH = 'uploads/materials/handout.docx'
+
+
+def write_docx(static_folder, text):
+    path = os.path.join(static_folder, FILE_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    document = docx.Document()
+    document.add_paragraph(text)
+    document.save(path)
+    return path
+
+
+def write_broken(static_folder):
+    path = os.path.join(static_folder, FILE_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'not a zip archive')
+    return path
+
+
+def render(static_folder):
+    source = os.path.join(static_folder, FILE_PATH)
+    return render_docx(source, pages_dir_for(source), f'/static/{pages_dir_for(FILE_PATH)}')
+
+
+def test_failed_render_is_recorded(data_dir):
+    write_broken(data_dir)
+    with pytest.raises(Exception):
+        render(data_dir)
+    assert render_failed(data_dir, FILE_PATH)
+    assert get_docx_pages(data_dir, FILE_PATH) == []
+
+
+def test_changed_file_is_tried_again(data_dir):
+    write_broken(data_dir)
+    with pytest.raises(Exception):
+        render(data_dir)
+
+    write_docx(data_dir, 'Replaced in place')
+
+    assert not render_failed(data_dir, FILE_PATH)
+    assert render(data_dir)['pages'] == 1
+    assert not render_failed(data_dir, FILE_PATH)
+    assert not os.path.exists(os.path.join(data_dir, pages_dir_for(FILE_PATH), 'render-failed.json'))
+
+
+def test_unrendered_docx_is_never_failed(data_dir):
+    write_docx(data_dir, 'Fresh upload')
+    assert not render_failed(data_dir, FILE_PATH)
+
+
+@pytest.fixture
+def reader(app, data_dir, monkeypatch):
+    """Admin client reading a DOCX material from a scratch static folder, with queued renders recorded"""
+    monkeypatch.setattr(app, 'static_folder', data_dir)
+    queued = []
+    monkeypatch.setattr(app_module, 'queue_docx_render', queued.append)
+    with app.app_context():
+        material = Material(title='Handout', description='x', price=0, file_path=FILE_PATH, file_format='docx')
+        db.session.add(material)
+        db.session.commit()
+        material_id = material.id
+        admin_id = User.query.filter_by(is_admin=True).first().id
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+    yield client, material_id, queued
+    with app.app_context():
+        db.session.delete(db.session.get(Material, material_id))
+        db.session.commit()
+
+
+@pytest.mark.skipif(not app_module.DOCX_RENDER_AVAILABLE, reason='mammoth is not installed')
+def test_read_does_not_resubmit_a_failed_render(reader, data_dir):
+    client, material_id, queued = reader
+    write_broken(data_dir)
+
+    assert client.get(f'/read/{material_id}').status_code == 200
+    assert queued == [FILE_PATH]
+    with pytest.raises(Exception):
+        render(data_dir)
+
+    for _ in range(3):
+        assert client.get(f'/read/{material_id}').status_code == 200
+    assert queued == [FILE_PATH]
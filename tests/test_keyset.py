@@ -0,0 +1,93 @@
+"""Keyset pagination: cursor round trips and NULL listing keys"""
+
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from models import db, User
+from utils.keyset import keyset_paginate, encode_cursor, decode_cursor
+from utils.db_migrations import backfill_listing_keys
+
+_batches = itertools.count()
+
+
+@pytest.fixture
+def users(ctx):
+    """30 users under a unique email domain, created_at spaced a minute apart with ties"""
+    domain = f'keyset{next(_batches)}.test'
+    start = datetime(2024, 1, 1)
+    created = []
+    for index in range(30):
+        user = User(email=f'user{index}@{domain}', first_name='Key', last_name=str(index),
+                    password_hash='x', created_at=start + timedelta(minutes=index // 3))
+        db.session.add(user)
+        created.append(user)
+    db.session.commit()
+    yield User.query.filter(User.email.like(f'%@{domain}')), [user.id for user in created]
+    User.query.filter(User.email.like(f'%@{domain}')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def walk(query, order_by, per_page=8, limit=20):
+    """Ids of every page following next_cursor, and the cursors seen"""
+    ids, cursors, cursor = [], [], None
+    for _ in range(limit):
+        page = keyset_paginate(query, order_by, cursor, per_page=per_page)
+        ids.extend(user.id for user in page)
+        cursor = page.next_cursor
+        if cursor is None:
+            return ids, cursors
+        cursors.append(cursor)
+    pytest.fail('next_cursor never ended')
+
+
+def test_cursor_round_trip(ctx):
+    values = [datetime(2024, 5, 1, 12, 30, 15, 250), 42]
+    token = encode_cursor(values, 'prev')
+    assert decode_cursor(token) == (values, 'prev')
+
+
+def test_tampered_cursor_shows_first_page(ctx):
+    token = encode_cursor([datetime(2024, 5, 1), 1], 'next')
+    assert decode_cursor(token[:-2] + 'xx') == (None, 'next')
+    assert decode_cursor(None) == (None, 'next')
+
+
+def test_next_pages_cover_every_row_once(users):
+    query, ids = users
+    seen, _ = walk(query, [User.created_at.desc()])
+    assert sorted(seen) == sorted(ids)
+    assert len(seen) == len(set(seen))
+    created = [db.session.get(User, user_id).created_at for user_id in seen]
+    assert created == sorted(created, reverse=True)
+
+
+def test_prev_cursor_returns_previous_page(users):
+    query, _ = users
+    first = keyset_paginate(query, [User.created_at.desc()], per_page=8)
+    second = keyset_paginate(query, [User.created_at.desc()], first.next_cursor, per_page=8)
+    back = keyset_paginate(query, [User.created_at.desc()], second.prev_cursor, per_page=8)
+    assert [user.id for user in back] == [user.id for user in first]
+    assert not back.has_prev
+    assert back.has_next
+
+
+def test_null_keys_reachable_after_backfill(users):
+    query, ids = users
+    null_ids = ids[10:]
+    db.session.execute(
+        text('UPDATE users SET created_at = NULL WHERE id IN (%s)' % ','.join(str(i) for i in null_ids))
+    )
+    db.session.commit()
+    db.session.expire_all()
+
+    applied = backfill_listing_keys()
+
+    assert f'Backfilled created_at on {len(null_ids)} users row(s)' in applied
+    db.session.expire_all()
+    seen, _ = walk(query, [User.created_at.desc()])
+    assert sorted(seen) == sorted(ids)
+    assert len(seen) == len(set(seen))
+    assert seen[-len(null_ids):] == sorted(null_ids, reverse=True)
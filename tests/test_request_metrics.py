@@ -0,0 +1,53 @@
+"""Per-request metrics: the Server-Timing header and latency percentiles"""
+
+import os
+
+import pytest
+
+from config import DevelopmentConfig, ProductionConfig
+from utils.request_metrics import request_metrics, _percentile
+
+
+@pytest.fixture
+def server_timing(app):
+    """Set the header switch for one test"""
+    saved = request_metrics._header
+
+    def switch(enabled):
+        request_metrics._header = enabled
+        return app.test_client()
+    yield switch
+    request_metrics._header = saved
+
+
+@pytest.mark.skipif('SERVER_TIMING_HEADER' in os.environ, reason='set explicitly in the environment')
+def test_header_is_off_outside_development():
+    assert ProductionConfig.SERVER_TIMING_HEADER is False
+    assert DevelopmentConfig.SERVER_TIMING_HEADER is True
+
+
+def test_no_header_when_off(server_timing):
+    response = server_timing(False).get('/')
+    assert 'Server-Timing' not in response.headers
+
+
+def test_header_reports_database_time_when_on(server_timing):
+    response = server_timing(True).get('/')
+    header = response.headers['Server-Timing']
+    assert 'db;dur=' in header and 'db-count;desc=' in header and 'total;dur=' in header
+
+
+@pytest.mark.parametrize('count, fraction, expected', [
+    (100, 0.95, 95),
+    (100, 0.50, 50),
+    (2, 0.50, 1),
+    (1, 0.95, 1),
+    (20, 0.95, 19),
+    (3, 0.50, 2),
+])
+def test_percentile_is_nearest_rank(count, fraction, expected):
+    assert _percentile(list(range(1, count + 1)), fraction) == expected
+
+
+def test_percentile_of_nothing():
+    assert _percentile([], 0.5) == 0.0
@@ -0,0 +1,64 @@
+"""Maintenance gate during a hot database restore"""
+
+import os
+import time
+
+import pytest
+
+from models import db
+from utils.db_restore import restore_coordinator
+
+
+@pytest.fixture
+def coordinator(app, data_dir):
+    """The restore coordinator on a state file of its own, never the app's shared one"""
+    saved = dict(restore_coordinator.__dict__)
+    with app.app_context():
+        restore_coordinator.init_app(db.engine, os.path.join(data_dir, 'db_state.json'), db.session)
+    yield restore_coordinator
+    restore_coordinator.__dict__.update(saved)
+
+
+@pytest.fixture
+def closed_gate(app, coordinator):
+    """The restore gate closed as another worker's swap_in would, with no wait"""
+    wait = app.config.get('RESTORE_GATE_WAIT')
+    app.config['RESTORE_GATE_WAIT'] = 0
+    coordinator._write_state(maintenance=True, since=time.time())
+    yield app.test_client()
+    coordinator._write_state(maintenance=False, since=None)
+    app.config['RESTORE_GATE_WAIT'] = wait
+
+
+def test_reads_pass_while_restoring(closed_gate):
+    assert closed_gate.get('/').status_code == 200
+
+
+def test_posts_are_held(closed_gate):
+    response = closed_gate.post('/login', data={'email': 'a@b.c', 'password': 'x'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+
+@pytest.mark.parametrize('path', [
+    '/download/1', '/read/1', '/stream/1', '/admin/subscriptions/delete/1',
+    '/subscription/purchase/1', '/admin/top-users/1/edit',
+])
+def test_writing_gets_are_held(closed_gate, path):
+    response = closed_gate.get(path)
+    assert response.status_code == 503
+
+
+def test_open_gate_lets_writes_through(app, coordinator):
+    assert not coordinator.sync()
+    response = app.test_client().get('/download/1')
+    assert response.status_code != 503
+
+
+
+def test_shared_state_file_is_untouched(app, closed_gate):
+    shared = os.path.join(app.instance_path, 'db_state.json')
+    assert str(restore_coordinator._state_path) != shared
+    if os.path.exists(shared):
+        with open(shared) as f:
+            assert '"maintenance": true' not in f.read()
@@ -0,0 +1,95 @@
+"""Tracking data retention: batched archiving, rollups and archived totals"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from flask import template_rendered
+
+from models import db, User, PageView, TrackingRollup, UserVisit, VisitorRecord
+from utils.retention import archive_tracking_data, archived_totals, read_archive
+
+
+@pytest.fixture
+def tracking(ctx):
+    """Two visitors and two page views past the retention window, one of each inside it"""
+    for model in (PageView, UserVisit, VisitorRecord, TrackingRollup):
+        model.query.delete()
+    db.session.commit()
+    old = datetime.now() - timedelta(days=120)
+    recent = datetime.now() - timedelta(days=1)
+    browsing = VisitorRecord(ip_address='10.0.0.1', first_visit=old, last_visit=old, visit_count=2)
+    bounced = VisitorRecord(ip_address='10.0.0.2', first_visit=old, last_visit=old, visit_count=4)
+    current = VisitorRecord(ip_address='10.0.0.3', first_visit=recent, last_visit=recent, visit_count=1)
+    db.session.add_all([browsing, bounced, current])
+    db.session.flush()
+    db.session.add_all([
+        PageView(page_url='/materials?page=1', visitor_id=browsing.id, view_count=3, last_viewed=old),
+        PageView(page_url='/materials?page=2', visitor_id=browsing.id, view_count=2, last_viewed=old),
+        PageView(page_url='/news', visitor_id=current.id, view_count=1, last_viewed=recent),
+    ])
+    db.session.commit()
+    yield old.date()
+    for model in (PageView, UserVisit, VisitorRecord, TrackingRollup):
+        model.query.delete()
+    db.session.commit()
+
+
+def test_archive_moves_old_rows_in_batches(tracking, data_dir):
+    result = archive_tracking_data(data_dir, retention_days=90, batch_size=1, pause=0)
+
+    assert result['tables']['page_views'] == {'rows': 2, 'batches': 2}
+    # Visitors are archived once their page views are gone, in the same run
+    assert result['tables']['visitor_records'] == {'rows': 2, 'batches': 2}
+    assert PageView.query.count() == 1
+    assert [visitor.ip_address for visitor in VisitorRecord.query.all()] == ['10.0.0.3']
+    archived_urls = sorted(row['page_url'] for row in read_archive(data_dir, 'page_views'))
+    assert archived_urls == ['/materials?page=1', '/materials?page=2']
+
+
+def test_rollups_keep_the_totals(tracking, data_dir):
+    archive_tracking_data(data_dir, retention_days=90, batch_size=1, pause=0)
+
+    rollup = TrackingRollup.query.filter_by(metric='page_views').one()
+    assert (rollup.period, rollup.key, rollup.row_count, rollup.total) == (tracking, '/materials', 2, 5)
+    totals = archived_totals()
+    assert totals['page_views'] == {'rows': 2, 'total': 5}
+    assert totals['visitors'] == {'rows': 2, 'total': 6}
+
+
+def test_second_run_archives_nothing(tracking, data_dir):
+    archive_tracking_data(data_dir, retention_days=90, batch_size=10, pause=0)
+    before = archived_totals()
+
+    result = archive_tracking_data(data_dir, retention_days=90, batch_size=10, pause=0)
+
+    assert all(table['rows'] == 0 for table in result['tables'].values())
+    assert archived_totals() == before
+
+
+def test_dry_run_changes_nothing(tracking, data_dir):
+    result = archive_tracking_data(data_dir, retention_days=90, batch_size=1, pause=0, dry_run=True)
+
+    assert result['tables']['page_views']['rows'] == 2
+    assert PageView.query.count() == 3
+    assert TrackingRollup.query.count() == 0
+
+
+def test_unique_visitors_are_live_only(app, tracking, data_dir):
+    archive_tracking_data(data_dir, retention_days=90, batch_size=10, pause=0)
+    admin = User.query.filter_by(is_admin=True).first()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+    rendered = []
+
+    def capture(sender, template, context, **extra):
+        rendered.append(context)
+
+    with template_rendered.connected_to(capture, app):
+        response = client.get('/admin/visitor-stats')
+
+    assert response.status_code == 200
+    assert rendered[0]['unique_visitors'] == 1
+    assert rendered[0]['total_visitors'] == 3
+    assert rendered[0]['total_page_views'] == 3
@@ -0,0 +1,53 @@
+"""Slow query log statement normalisation, fingerprints and the p99 estimate"""
+
+import pytest
+
+from utils.slow_query_log import normalize, fingerprint, _p99
+
+
+def test_literals_and_placeholders_become_markers():
+    statement = "SELECT * FROM users WHERE email = 'o''brien@x.io' AND id = 42 AND score > -3.5e2"
+    assert normalize(statement) == 'SELECT * FROM users WHERE email = ? AND id = ? AND score > ?'
+
+
+def test_driver_parameter_styles():
+    statement = 'SELECT a FROM t WHERE x = :x_1 AND y = %(y)s AND z = %s AND w = $1'
+    assert normalize(statement) == 'SELECT a FROM t WHERE x = ? AND y = ? AND z = ? AND w = ?'
+
+
+def test_identifiers_with_digits_are_kept():
+    assert normalize('SELECT t2.col1 FROM table2 AS t2') == 'SELECT t2.col1 FROM table2 AS t2'
+
+
+def test_in_lists_collapse_to_one_fingerprint():
+    one = fingerprint('SELECT id FROM users WHERE id IN (?)')
+    many = fingerprint('SELECT id FROM users WHERE id IN (1, 2, 3)')
+    assert one == many
+    assert one[1] == 'SELECT id FROM users WHERE id IN (?+)'
+
+
+def test_multi_row_values_collapse():
+    statement = 'INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)'
+    assert normalize(statement) == 'INSERT INTO t (a, b) VALUES (?, ?), ...'
+    assert fingerprint(statement) == fingerprint('INSERT INTO t (a, b) VALUES (1, 2), (3, 4)')
+
+
+def test_whitespace_is_squeezed():
+    assert normalize('SELECT  a\n   FROM t\tWHERE b = 1 ') == 'SELECT a FROM t WHERE b = ?'
+
+
+def test_fingerprint_shape_and_distinctness():
+    fingerprint_id, normalized = fingerprint('SELECT a FROM t WHERE b = 1')
+    assert len(fingerprint_id) == 16
+    int(fingerprint_id, 16)
+    assert normalized == 'SELECT a FROM t WHERE b = ?'
+    assert fingerprint_id != fingerprint('SELECT a FROM t WHERE c = 1')[0]
+
+
+@pytest.mark.parametrize('count, expected', [(1, 1), (99, 99), (100, 99), (101, 100), (1000, 990)])
+def test_p99_is_nearest_rank(count, expected):
+    assert _p99(list(range(1, count + 1))) == expected
+
+
+def test_p99_of_nothing():
+    assert _p99([]) is None
@@ -11,6 +11,13 @@ from .image_optimizer import (
     WEBP_QUALITY,
     RESPONSIVE_SIZES
 )
+from .image_pipeline import (
+    enqueue_image_job,
+    get_image_variants,
+    srcset_candidates,
+    AVIF_AVAILABLE
+)
+from .variant_index import VariantIndex, variant_index
 
 __all__ = [
     'optimize_image',
@@ -19,6 +26,12 @@ __all__ = [
     'get_image_info',
     'is_webp_supported',
     'WEBP_QUALITY',
-    'RESPONSIVE_SIZES'
+    'RESPONSIVE_SIZES',
+    'enqueue_image_job',
+    'get_image_variants',
+    'srcset_candidates',
+    'AVIF_AVAILABLE',
+    'VariantIndex',
+    'variant_index'
 ]
 
@@ -0,0 +1,398 @@
+"""
+Static Asset Pipeline
+Minifies CSS/JS sources and writes gzip/brotli variants at maximum
+compression so static files are never compressed per request
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+try:
+    import rjsmin
+    RJSMIN_AVAILABLE = True
+except ImportError:
+    RJSMIN_AVAILABLE = False
+
+try:
+    import rcssmin
+    RCSSMIN_AVAILABLE = True
+except ImportError:
+    RCSSMIN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ASSET_DIRS = ('css', 'js')
+# Served at a fixed URL by design (a service worker's scope is its own path)
+UNVERSIONED_ASSETS = {'js/sw.js'}
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.xml', '.html', '.map'}
+MIN_COMPRESS_SIZE = 256  # Smaller files gain nothing from a variant
+# Preferred first; 'br' is only offered when the brotli module can write it
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+MANIFEST_FILENAME = 'assets-manifest.json'
+PRECACHE_FILENAME = 'precache-manifest.json'
+SERVICE_WORKER_SOURCE = 'js/sw.js'
+# Shell files the service worker installs alongside every built CSS/JS asset
+PRECACHE_EXTRAS = ('images/favicon.svg', 'images/favicon.ico')
+HASH_LENGTH = 8
+MANIFEST_CHECK_INTERVAL = 1.0  # Seconds between checks for a rebuilt manifest
+
+_HASHED_NAME = re.compile(r'\.[0-9a-f]{%d}\.(?:css|js)$' % HASH_LENGTH)
+
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/|\s+', re.S)
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')  # Not ':', 'a :hover' differs from 'a:hover'
+
+
+def _minify_css_builtin(css):
+    """Strip comments and collapse whitespace outside string literals"""
+    def _token(match):
+        if match.group(1):
+            return match.group(1)
+        return '' if match.group(0).startswith('/*') else ' '
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', _CSS_TOKENS.sub(_token, css))
+    # Even indexes are outside strings; only those may lose punctuation spacing
+    for index in range(0, len(parts), 2):
+        parts[index] = _CSS_PUNCTUATION.sub(r'\1', parts[index]).replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_css(css):
+    """Minify a stylesheet, using rcssmin when installed"""
+    if RCSSMIN_AVAILABLE:
+        return rcssmin.cssmin(css)
+    return _minify_css_builtin(css)
+
+
+def minify_js(js):
+    """
+    Minify a script with rjsmin, or None when it is not installed
+
+    There is no safe regex-based JS minifier (regex literals, template
+    strings, ASI), so there is deliberately no built-in fallback.
+    """
+    if RJSMIN_AVAILABLE:
+        return rjsmin.jsmin(js)
+    return None
+
+
+def is_hashed_asset(filename):
+    """True for a content-hashed build output such as js/main.3f9c2a1b.js"""
+    return bool(_HASHED_NAME.search(filename))
+
+
+def is_source_asset(name):
+    """True for a hand-written .css/.js file (not a build output)"""
+    stem, ext = os.path.splitext(name)
+    return ext in ('.css', '.js') and not stem.endswith('.min') and not is_hashed_asset(name)
+
+
+def read_asset_manifest(static_folder):
+    """Load the asset manifest, treating a missing or corrupt file as empty"""
+    try:
+        with open(os.path.join(static_folder, MANIFEST_FILENAME)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {'version': None, 'assets': {}}
+    except ValueError as e:
+        logger.error(f"Ignoring unreadable asset manifest: {e}")
+        return {'version': None, 'assets': {}}
+    manifest.setdefault('assets', {})
+    return manifest
+
+
+def hash_assets(static_folder, asset_dirs=ASSET_DIRS):
+    """
+    Copy each asset's built (minified when available) bytes to a content-hashed name
+
+    Hashed files from the previous build are kept so pages cached before a
+    deploy can still load their scripts; anything older is removed.
+
+    Returns:
+        Manifest dictionary {'version', 'assets': {source path: hashed path}}
+    """
+    previous = read_asset_manifest(static_folder)['assets']
+    assets = {}
+    for asset_dir in asset_dirs:
+        root = os.path.join(static_folder, asset_dir)
+        if not os.path.isdir(root):
+            continue
+        for name in sorted(os.listdir(root)):
+            if not is_source_asset(name) or f"{asset_dir}/{name}" in UNVERSIONED_ASSETS:
+                continue
+            stem, ext = os.path.splitext(name)
+            source_path = os.path.join(root, name)
+            built_path = os.path.join(root, f"{stem}.min{ext}")
+            # A hand-maintained .min older than its source would ship stale code
+            if not os.path.exists(built_path) or os.path.getmtime(built_path) < os.path.getmtime(source_path):
+                built_path = source_path
+            with open(built_path, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+            hashed_name = f"{stem}.{digest}{ext}"
+            _write_if_changed(os.path.join(root, hashed_name), data)
+            assets[f"{asset_dir}/{name}"] = f"{asset_dir}/{hashed_name}"
+
+        keep = set(assets.values()) | set(previous.values())
+        for name in os.listdir(root):
+            base = name[:-3] if name.endswith(('.gz', '.br')) else name
+            if is_hashed_asset(base) and f"{asset_dir}/{base}" not in keep:
+                os.remove(os.path.join(root, name))
+
+    version = hashlib.sha256(json.dumps(assets, sort_keys=True).encode()).hexdigest()[:HASH_LENGTH]
+    manifest = {'version': version, 'assets': assets}
+    _write_if_changed(os.path.join(static_folder, MANIFEST_FILENAME),
+                      json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def read_precache_manifest(static_folder):
+    """Load the service worker precache list, or None when no build has written it"""
+    try:
+        with open(os.path.join(static_folder, PRECACHE_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.error(f"Ignoring unreadable precache manifest: {e}")
+        return None
+
+
+def write_precache_manifest(static_folder, manifest):
+    """
+    Write the list of static files the service worker installs up front
+
+    The version covers the hashed asset names, the extras and the service
+    worker source itself, so any deploy that changes what clients should
+    run rolls their caches over.
+
+    Args:
+        static_folder: Flask static folder
+        manifest: Asset manifest returned by hash_assets
+
+    Returns:
+        Dictionary {'version', 'assets': [static-relative paths]}
+    """
+    assets = sorted(manifest['assets'].values())
+    assets += [path for path in PRECACHE_EXTRAS if os.path.exists(os.path.join(static_folder, path))]
+    digest = hashlib.sha256(json.dumps(assets).encode())
+    try:
+        with open(os.path.join(static_folder, SERVICE_WORKER_SOURCE), 'rb') as f:
+            digest.update(f.read())
+    except FileNotFoundError:
+        pass
+    precache = {'version': digest.hexdigest()[:HASH_LENGTH], 'assets': assets}
+    _write_if_changed(os.path.join(static_folder, PRECACHE_FILENAME),
+                      json.dumps(precache, indent=1).encode('utf-8'))
+    return precache
+
+
+class AssetManifest:
+    """
+    In-memory view of assets-manifest.json, reloaded when a build replaces it
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._static_folder = None
+        self._assets = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self.version = None
+
+    def init_app(self, static_folder):
+        self._static_folder = static_folder
+        self._reload()
+
+    def resolve(self, path):
+        """Hashed static path for a source path, or None when it was not built"""
+        if self._static_folder is None:
+            return None
+        now = time.monotonic()
+        if now - self._checked_at >= MANIFEST_CHECK_INTERVAL:
+            self._checked_at = now
+            self._reload()
+        return self._assets.get(path)
+
+    def _reload(self):
+        try:
+            mtime = os.stat(os.path.join(self._static_folder, MANIFEST_FILENAME)).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        manifest = read_asset_manifest(self._static_folder)
+        with self._lock:
+            self._assets = manifest['assets']
+            self.version = manifest.get('version')
+            self._mtime = mtime
+
+
+def _write_if_changed(path, data):
+    """Write bytes only when they differ, keeping mtimes stable for unchanged outputs"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def compress_file(path):
+    """
+    Write maximum-compression .gz (and .br) variants of a file
+
+    Variants that would not be smaller than the original are removed
+    rather than written.
+
+    Returns:
+        Dictionary of encoding -> variant size in bytes
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    results = {}
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if BROTLI_AVAILABLE:
+        variants['br'] = brotli.compress(data, quality=11, mode=brotli.MODE_TEXT)
+    for encoding, suffix in ENCODINGS:
+        variant_path = f"{path}{suffix}"
+        compressed = variants.get(encoding)
+        if compressed is None or len(compressed) >= len(data):
+            if os.path.exists(variant_path):
+                os.remove(variant_path)
+            continue
+        # Always rewritten so the variant is never older than its source
+        tmp_path = f"{variant_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, variant_path)
+        results[encoding] = len(compressed)
+    return results
+
+
+def build_assets(static_folder, asset_dirs=ASSET_DIRS):
+    """
+    Minify every CSS/JS source to <name>.min.<ext>, write content-hashed
+    copies plus the asset and precache manifests, and precompress all text assets
+
+    Args:
+        static_folder: Flask static folder
+        asset_dirs: Sub-directories of the static folder to process
+
+    Returns:
+        Dictionary with 'minified' ({'path', 'source_size', 'size'}) and
+        'compressed' ({'path', 'size', 'gzip', 'br'}) entries, paths
+        static-relative, plus the new 'manifest' and 'precache' list
+    """
+    report = {'minified': [], 'compressed': []}
+    for asset_dir in asset_dirs:
+        root = os.path.join(static_folder, asset_dir)
+        if not os.path.isdir(root):
+            continue
+        for name in sorted(os.listdir(root)):
+            if not is_source_asset(name):
+                continue
+            stem, ext = os.path.splitext(name)
+            if f"{asset_dir}/{name}" in UNVERSIONED_ASSETS:
+                continue
+            with open(os.path.join(root, name), encoding='utf-8') as f:
+                source = f.read()
+            minified = minify_css(source) if ext == '.css' else minify_js(source)
+            if minified is None:
+                # Keep the existing .min file rather than replacing it with the source
+                logger.warning(f"rjsmin not installed, {asset_dir}/{stem}.min{ext} left as is")
+                continue
+            min_path = os.path.join(root, f"{stem}.min{ext}")
+            _write_if_changed(min_path, minified.encode('utf-8'))
+            os.utime(min_path)  # Mark it current so hash_assets trusts it over the source
+            report['minified'].append({'path': f"{asset_dir}/{stem}.min{ext}",
+                                       'source_size': len(source.encode('utf-8')),
+                                       'size': len(minified.encode('utf-8'))})
+    report['manifest'] = hash_assets(static_folder, asset_dirs)
+    report['precache'] = write_precache_manifest(static_folder, report['manifest'])
+
+    for asset_dir in asset_dirs:
+        root = os.path.join(static_folder, asset_dir)
+        if not os.path.isdir(root):
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                    continue
+                size = os.path.getsize(path)
+                if size < MIN_COMPRESS_SIZE:
+                    continue
+                variants = compress_file(path)
+                report['compressed'].append(dict(
+                    {'path': os.path.relpath(path, static_folder).replace(os.sep, '/'), 'size': size},
+                    gzip=variants.get('gzip'), br=variants.get('br')
+                ))
+    return report
+
+
+def accepted_encodings(accept_encoding):
+    """Encodings a client accepts, from an Accept-Encoding header (q=0 excluded)"""
+    accepted = set()
+    for part in (accept_encoding or '').lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(coding.strip())
+    return accepted
+
+
+def find_precompressed(full_path, accept_encoding):
+    """
+    Pick the best precompressed variant of a static file for a client
+
+    A variant older than its source is ignored so an edited file is never
+    served with stale compressed bytes.
+
+    Returns:
+        Tuple of (variant path, content encoding) or None
+    """
+    accepted = accepted_encodings(accept_encoding)
+    if not accepted:
+        return None
+    try:
+        source_mtime = os.stat(full_path).st_mtime
+    except OSError:
+        return None
+    for encoding, suffix in ENCODINGS:
+        if encoding not in accepted and '*' not in accepted:
+            continue
+        variant_path = f"{full_path}{suffix}"
+        try:
+            if os.stat(variant_path).st_mtime >= source_mtime:
+                return variant_path, encoding
+        except OSError:
+            continue
+    return None
+
+
+def guess_mimetype(filename):
+    """Content type of the original (uncompressed) file"""
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+asset_manifest = AssetManifest()
@@ -0,0 +1,338 @@
+"""
+Content-Addressed Upload Store
+Stores material files once per SHA-256 digest under static/uploads/blobs and
+shares them between materials through reference counting
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, StoredBlob
+from .db_routing import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+BLOBS_SUBDIR = 'uploads/blobs'
+LEGACY_SUBDIR = 'uploads/materials'
+CHUNK_SIZE = 1024 * 1024  # 1MB read size, keeps memory flat for large videos
+PENDING_UNLINKS_KEY = 'content_store_unlinks'
+
+
+def unlink_after_commit(full_path, derivatives=False):
+    """
+    Delete a file once the current session transaction commits
+
+    Files are only removed after the rows that referenced them are gone
+    for good; if the transaction rolls back, the file stays.
+
+    Args:
+        full_path: Absolute path of the file
+        derivatives: Also delete files derived from it (linearized PDF, previews)
+    """
+    db.session.info.setdefault(PENDING_UNLINKS_KEY, {})[full_path] = derivatives
+
+
+def _keep_file(full_path):
+    """Cancel a pending unlink, when the same path is stored again in this transaction"""
+    db.session.info.get(PENDING_UNLINKS_KEY, {}).pop(full_path, None)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _unlink_committed(session):
+    if session.in_nested_transaction():
+        return  # A released savepoint, the outer transaction can still roll back
+    pending = session.info.pop(PENDING_UNLINKS_KEY, None)
+    for full_path, derivatives in (pending or {}).items():
+        if derivatives:
+            _remove_derivatives(full_path)
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not delete {full_path}: {e}")
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_unlinks(session):
+    if not session.in_nested_transaction():
+        session.info.pop(PENDING_UNLINKS_KEY, None)
+
+
+def is_blob_path(file_path):
+    """True when a static-relative path points into the content store"""
+    return bool(file_path) and file_path.startswith(f"{BLOBS_SUBDIR}/")
+
+
+def blob_relative_path(sha256, ext):
+    """Static-relative path for a digest, fanned out by its first two hex characters"""
+    return f"{BLOBS_SUBDIR}/{sha256[:2]}/{sha256}{ext.lower()}"
+
+
+def _hash_to_temp(stream, blobs_dir):
+    """
+    Copy a stream into a temporary file inside the store while hashing it
+
+    The temp file lives on the same filesystem as the final blob so it can be
+    moved into place with an atomic rename.
+
+    Returns:
+        Tuple of (temp path, hex digest, size in bytes)
+    """
+    blobs_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=blobs_dir, prefix='.upload-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def _add_reference(tmp_path, sha256, size, ext, static_folder):
+    """
+    Move a hashed temp file into the store, or drop it if the content exists
+
+    Returns:
+        Tuple of (StoredBlob, deduplicated flag)
+    """
+    blob = StoredBlob.query.filter_by(sha256=sha256).first()
+    if blob and os.path.exists(os.path.join(static_folder, blob.file_path)):
+        os.unlink(tmp_path)
+        db.session.execute(
+            update(StoredBlob)
+            .where(StoredBlob.id == blob.id)
+            .values(ref_count=StoredBlob.ref_count + 1)
+        )
+        db.session.refresh(blob)
+        return blob, True
+
+    rel_path = blob.file_path if blob else blob_relative_path(sha256, ext)
+    final_path = Path(static_folder) / rel_path
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, final_path)
+    _keep_file(str(final_path))
+    if blob:
+        # Row survived but the file went missing, the rename above restored it
+        blob.ref_count = (blob.ref_count or 0) + 1
+        blob.size = size
+        db.session.flush()
+        return blob, False
+    try:
+        with db.session.begin_nested():
+            blob = StoredBlob(sha256=sha256, file_path=rel_path, size=size, ref_count=1)
+            db.session.add(blob)
+    except IntegrityError:
+        # A concurrent upload of the same content inserted the row first; the
+        # file it renamed into place has the same bytes as ours
+        blob = StoredBlob.query.filter_by(sha256=sha256).one()
+        if blob.file_path != rel_path:
+            # Stored under another extension, so our copy is referenced by nothing
+            try:
+                os.unlink(final_path)
+            except FileNotFoundError:
+                pass
+        db.session.execute(
+            update(StoredBlob)
+            .where(StoredBlob.id == blob.id)
+            .values(ref_count=StoredBlob.ref_count + 1)
+        )
+        db.session.refresh(blob)
+        return blob, True
+    return blob, False
+
+
+def store_upload(file, static_folder):
+    """
+    Save an uploaded file into the content store
+
+    The caller owns the transaction and must commit (or roll back) the
+    session once the referencing material has been updated.
+
+    Args:
+        file: Werkzeug FileStorage from the upload form
+        static_folder: Flask static folder, blob paths are relative to it
+
+    Returns:
+        Tuple of (StoredBlob, deduplicated flag)
+    """
+    ext = os.path.splitext(file.filename or '')[1]
+    blobs_dir = Path(static_folder) / BLOBS_SUBDIR
+    tmp_path, sha256, size = _hash_to_temp(file.stream, blobs_dir)
+    try:
+        return _add_reference(tmp_path, sha256, size, ext, static_folder)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def release_blob(file_path, static_folder):
+    """
+    Drop one reference to a stored blob, deleting it when nothing uses it
+
+    The row changes belong to the caller's transaction; the file and its
+    derivatives are only deleted once that transaction commits.
+
+    Args:
+        file_path: Static-relative path previously returned by store_upload
+        static_folder: Flask static folder
+
+    Returns:
+        True if the blob will be removed from disk on commit
+    """
+    if not is_blob_path(file_path):
+        return False
+    blob = StoredBlob.query.filter_by(file_path=file_path).first()
+    if not blob:
+        return False
+    db.session.execute(
+        update(StoredBlob)
+        .where(StoredBlob.id == blob.id)
+        .values(ref_count=StoredBlob.ref_count - 1)
+    )
+    db.session.refresh(blob)
+    if blob.ref_count > 0:
+        return False
+    db.session.delete(blob)
+    full_path = os.path.join(static_folder, file_path)
+    unlink_after_commit(full_path, derivatives=True)
+    return os.path.exists(full_path)
+
+
+def _remove_derivatives(full_path):
+    """Delete files derived from a blob (e.g. <sha256>.linear.pdf, <sha256>.previews/)"""
+    blob_dir, blob_name = os.path.split(full_path)
+    prefix = f"{os.path.splitext(blob_name)[0]}."
+    try:
+        entries = list(os.scandir(blob_dir))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.name == blob_name or not entry.name.startswith(prefix):
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+
+
+def migrate_uploads(static_folder, dry_run=False):
+    """
+    Move legacy uploads/materials files into the content store
+
+    Every Material.file_path under uploads/materials is hashed and pointed
+    at its blob. Reference counts are then recomputed from the materials
+    table so they are exact after the run. The legacy files are deleted
+    only after that commit succeeds, so an interrupted run leaves every
+    material pointing at a file that still exists.
+
+    Args:
+        static_folder: Flask static folder
+        dry_run: Hash and report without moving files or touching the database
+
+    Returns:
+        Dictionary with migrated/deduplicated/missing counts and bytes_reclaimed
+    """
+    from models import Material
+
+    stats = {'migrated': 0, 'deduplicated': 0, 'missing': 0, 'unreferenced': 0,
+             'bytes_reclaimed': 0}
+    blobs_dir = Path(static_folder) / BLOBS_SUBDIR
+    converted = {}   # legacy path -> blob path, for materials sharing one file
+    legacy_files = []  # Deleted once the new paths are committed
+    seen_digests = {}  # digest -> blob path, so dry runs also spot duplicates
+
+    materials = Material.query.filter(Material.file_path.like(f"{LEGACY_SUBDIR}/%")).all()
+    for material in materials:
+        legacy_path = material.file_path
+        if legacy_path in converted:
+            material.file_path = converted[legacy_path]
+            continue
+        full_path = os.path.join(static_folder, legacy_path)
+        if not os.path.exists(full_path):
+            stats['missing'] += 1
+            logger.warning(f"Upload missing on disk, skipped: {legacy_path}")
+            continue
+
+        size = os.path.getsize(full_path)
+        if dry_run:
+            digest = hashlib.sha256()
+            with open(full_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+            existing = StoredBlob.query.filter_by(sha256=sha256).first()
+            if sha256 in seen_digests or existing:
+                stats['deduplicated'] += 1
+                stats['bytes_reclaimed'] += size
+            seen_digests.setdefault(sha256, blob_relative_path(sha256, os.path.splitext(legacy_path)[1]))
+            converted[legacy_path] = seen_digests[sha256]
+            stats['migrated'] += 1
+            continue
+
+        with open(full_path, 'rb') as f:
+            tmp_path, sha256, size = _hash_to_temp(f, blobs_dir)
+        blob, deduplicated = _add_reference(tmp_path, sha256, size,
+                                            os.path.splitext(legacy_path)[1], static_folder)
+        legacy_files.append(full_path)
+        if deduplicated:
+            stats['deduplicated'] += 1
+            stats['bytes_reclaimed'] += size
+        converted[legacy_path] = blob.file_path
+        material.file_path = blob.file_path
+        stats['migrated'] += 1
+
+    legacy_dir = Path(static_folder) / LEGACY_SUBDIR
+    if legacy_dir.exists():
+        referenced = {os.path.basename(path) for path in converted}
+        stats['unreferenced'] = sum(
+            1 for entry in os.scandir(legacy_dir)
+            if entry.is_file() and entry.name not in referenced
+        )
+
+    if dry_run:
+        db.session.rollback()
+        return stats
+
+    db.session.flush()
+    rebuild_ref_counts()
+    db.session.commit()
+    for full_path in legacy_files:
+        try:
+            os.remove(full_path)
+        except OSError as e:
+            logger.warning(f"Migrated upload could not be deleted: {full_path}: {e}")
+    return stats
+
+
+def rebuild_ref_counts():
+    """Recompute every blob's ref_count from the materials that point at it"""
+    from models import Material
+
+    counts = dict(
+        db.session.query(Material.file_path, db.func.count(Material.id))
+        .filter(Material.file_path.like(f"{BLOBS_SUBDIR}/%"))
+        .group_by(Material.file_path)
+        .all()
+    )
+    for blob in StoredBlob.query.all():
+        blob.ref_count = counts.get(blob.file_path, 0)
+    return counts
@@ -3,12 +3,46 @@ Database Backup and Restore Utility
 Provides functions for backing up and restoring SQLite databases
 """
 import os
+import gzip
+import json
+import time
+import uuid
 import shutil
+import logging
+import tempfile
+import threading
 from datetime import datetime
 from pathlib import Path
 import sqlite3
 from flask import current_app
 
+from .incremental_backup import (
+    get_store_directory, store_snapshot, read_manifests, rebuild_snapshot, apply_retention, store_usage,
+    DEFAULT_CHUNK_PAGES, DEFAULT_KEEP_LAST, DEFAULT_KEEP_HOURLY, DEFAULT_KEEP_DAILY, DEFAULT_KEEP_WEEKLY
+)
+from .db_stats import database_stats, DEFAULT_TTL as DEFAULT_STATS_TTL, DEFAULT_ANALYSIS_LIMIT
+from .db_restore import restore_coordinator, DEFAULT_GRACE_SECONDS, DEFAULT_DRAIN_TIMEOUT
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = 'pcm_store_backup_'
+# Longest suffix first so "x.db.gz" is not taken for a plain ".db"
+BACKUP_EXTENSIONS = {'.db.zst': 'zstd', '.db.gz': 'gzip', '.db': 'none'}
+JOBS_DIRNAME = '.jobs'
+DEFAULT_PAGES_PER_STEP = 1024
+DEFAULT_STEP_SLEEP_MS = 10
+COPY_CHUNK_SIZE = 1024 * 1024
+STATUS_WRITE_INTERVAL = 0.5  # Seconds between progress writes to the job file
+
+_job_lock = threading.Lock()
+restore_coordinator.add_listener(database_stats.invalidate)
+
 
 def get_database_path():
     """Get the path to the database file"""
@@ -80,35 +114,363 @@ def get_table_count(db_path):
         return 0
 
 
-def backup_database():
-    """Create a backup of the database"""
-    db_path = get_database_path()
-    if not db_path or not os.path.exists(db_path):
-        raise FileNotFoundError(f"Database file not found: {db_path}")
-    
-    backup_dir = get_backup_directory()
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_filename = f"pcm_store_backup_{timestamp}.db"
-    backup_path = backup_dir / backup_filename
-    
+def backup_extension(filename):
+    """Return the backup extension of a filename, or None if it is not a backup"""
+    if os.path.basename(filename) != filename:
+        return None
+    for extension in BACKUP_EXTENSIONS:
+        if filename.startswith(BACKUP_PREFIX) and filename.endswith(extension):
+            return extension
+    return None
+
+
+def backup_compression(config=None):
+    """Configured compression, falling back to gzip when zstandard is missing"""
+    config = config if config is not None else current_app.config
+    compression = config.get('BACKUP_COMPRESSION', 'gzip')
+    if compression == 'zstd' and not ZSTD_AVAILABLE:
+        return 'gzip'
+    return compression if compression in ('zstd', 'gzip', 'none') else 'gzip'
+
+
+def _open_compressed_writer(path, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(open(path, 'wb'), closefd=True)
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=6)
+    return open(path, 'wb')
+
+
+def _open_compressed_reader(path):
+    extension = backup_extension(os.path.basename(path))
+    if extension == '.db.zst':
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("zstandard is required to read .zst backups")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    if extension == '.db.gz':
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(path)
     try:
-        # Copy database file
-        shutil.copy2(db_path, backup_path)
-        
-        # Get backup file info
+        rows = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    problems = [row[0] for row in rows if row[0] != 'ok']
+    if problems:
+        raise sqlite3.DatabaseError(f"Backup failed integrity check: {'; '.join(problems[:5])}")
+
+
+def online_snapshot(db_path, dest_path, pages_per_step=DEFAULT_PAGES_PER_STEP,
+                    step_sleep=DEFAULT_STEP_SLEEP_MS / 1000, progress=None):
+    """
+    Copy a live SQLite database with the online backup API
+
+    Pages are copied in steps of pages_per_step with a short sleep between
+    steps, so writers get the lock in between. In WAL mode the source holds
+    one read transaction for the whole copy: writers keep going, and the copy
+    is a consistent snapshot that never has to restart.
+
+    Args:
+        db_path: Live database file
+        dest_path: New database file to write
+        pages_per_step: Pages copied per backup step
+        step_sleep: Seconds to sleep between steps
+        progress: Optional callable(remaining, total) called after each step
+    """
+    source = sqlite3.connect(db_path, timeout=30)
+    dest = sqlite3.connect(dest_path)
+    try:
+        wal = source.execute("PRAGMA journal_mode").fetchone()[0].lower() == 'wal'
+        if wal:
+            # A rollback-journal reader would block writers for the whole copy
+            source.execute("BEGIN")
+            source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+
+        def on_step(status, remaining, total):
+            if progress:
+                progress(remaining, total)
+            if remaining and step_sleep:
+                time.sleep(step_sleep)
+
+        source.backup(dest, pages=max(1, int(pages_per_step)), progress=on_step)
+        if wal:
+            source.rollback()
+    finally:
+        dest.close()
+        source.close()
+
+
+def _write_job(jobs_dir, job):
+    tmp_path = jobs_dir / f"{job['id']}.json.tmp"
+    tmp_path.write_text(json.dumps(job, default=str))
+    os.replace(tmp_path, jobs_dir / f"{job['id']}.json")
+
+
+def _job_reporter(job, jobs_dir, copy_share):
+    """
+    Status helpers for a running job
+
+    Returns:
+        Tuple of update(**changes), which writes the job file at once, and
+        on_progress(remaining, total), which maps page progress onto the
+        first copy_share percent and writes at most every STATUS_WRITE_INTERVAL
+    """
+    last_write = [0.0]
+
+    def update(**changes):
+        job.update(changes)
+        _write_job(jobs_dir, job)
+
+    def on_progress(remaining, total):
+        job['pages_total'] = total
+        job['pages_remaining'] = remaining
+        job['percent'] = round(copy_share * (total - remaining) / total, 1) if total else copy_share
+        if time.monotonic() - last_write[0] >= STATUS_WRITE_INTERVAL:
+            last_write[0] = time.monotonic()
+            _write_job(jobs_dir, job)
+
+    return update, on_progress
+
+
+def _run_backup(job, db_path, backup_dir, compression, pages_per_step, step_sleep):
+    """Take the snapshot, check it, then stream it through the compressor"""
+    backup_path = backup_dir / job['backup_filename']
+    partial_path = backup_dir / f"{job['backup_filename']}.part"
+    fd, snapshot_path = tempfile.mkstemp(prefix='.snapshot-', suffix='.db', dir=str(backup_dir))
+    os.close(fd)
+    update, on_progress = _job_reporter(job, backup_dir / JOBS_DIRNAME, 80)
+
+    try:
+        update(status='copying', started_at=datetime.now().isoformat())
+        online_snapshot(db_path, snapshot_path, pages_per_step, step_sleep, on_progress)
+
+        update(status='verifying', percent=80)
+        _integrity_check(snapshot_path)
+
+        update(status='compressing', percent=85)
+        with open(snapshot_path, 'rb') as src, _open_compressed_writer(partial_path, compression) as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        os.replace(partial_path, backup_path)
+
         backup_size = os.path.getsize(backup_path)
-        
-        return {
+        database_size = os.path.getsize(snapshot_path)
+        update(status='done', percent=100, finished_at=datetime.now().isoformat(), result={
             'success': True,
             'backup_path': str(backup_path),
-            'backup_filename': backup_filename,
+            'backup_filename': job['backup_filename'],
             'size': backup_size,
             'size_formatted': format_file_size(backup_size),
-            'timestamp': timestamp,
-            'created_at': datetime.now()
-        }
+            'database_size': database_size,
+            'compression': compression,
+            'timestamp': job['timestamp'],
+            'created_at': datetime.now(),
+        })
     except Exception as e:
-        raise Exception(f"Failed to create backup: {str(e)}")
+        logger.error(f"Backup {job['id']} failed: {e}")
+        update(status='failed', error=str(e), finished_at=datetime.now().isoformat())
+        if partial_path.exists():
+            partial_path.unlink()
+    finally:
+        if os.path.exists(snapshot_path):
+            os.unlink(snapshot_path)
+    return job
+
+
+def _run_incremental(job, db_path, backup_dir, pages_per_step, step_sleep, chunk_pages, retention):
+    """Take the snapshot, check it, store its changed chunks, then apply the rotation"""
+    store_dir = get_store_directory(backup_dir)
+    fd, snapshot_path = tempfile.mkstemp(prefix='.snapshot-', suffix='.db', dir=str(backup_dir))
+    os.close(fd)
+    update, on_progress = _job_reporter(job, backup_dir / JOBS_DIRNAME, 60)
+
+    def on_store(done, total):
+        job['percent'] = round(65 + 30 * done / total, 1) if total else 95
+
+    try:
+        update(status='copying', started_at=datetime.now().isoformat())
+        online_snapshot(db_path, snapshot_path, pages_per_step, step_sleep, on_progress)
+
+        update(status='verifying', percent=60)
+        _integrity_check(snapshot_path)
+
+        update(status='storing', percent=65)
+        manifest = store_snapshot(snapshot_path, store_dir, chunk_pages, on_store)
+
+        update(status='pruning', percent=95)
+        pruned = apply_retention(store_dir, **retention)
+        update(status='done', percent=100, finished_at=datetime.now().isoformat(), result={
+            'success': True,
+            'snapshot_id': manifest['id'],
+            'database_size': manifest['db_size'],
+            'chunks': len(manifest['chunks']),
+            'new_chunks': manifest['new_chunks'],
+            'new_bytes': manifest['new_bytes'],
+            'size_formatted': format_file_size(manifest['new_bytes']),
+            'pruned_snapshots': pruned['deleted_snapshots'],
+            'freed_bytes': pruned['freed_bytes'],
+            'created_at': manifest['created_at'],
+        })
+    except Exception as e:
+        logger.error(f"Incremental backup {job['id']} failed: {e}")
+        update(status='failed', error=str(e), finished_at=datetime.now().isoformat())
+    finally:
+        if os.path.exists(snapshot_path):
+            os.unlink(snapshot_path)
+    return job
+
+
+def _retention_policy(config):
+    return {
+        'last': int(config.get('BACKUP_KEEP_LAST', DEFAULT_KEEP_LAST)),
+        'hourly': int(config.get('BACKUP_KEEP_HOURLY', DEFAULT_KEEP_HOURLY)),
+        'daily': int(config.get('BACKUP_KEEP_DAILY', DEFAULT_KEEP_DAILY)),
+        'weekly': int(config.get('BACKUP_KEEP_WEEKLY', DEFAULT_KEEP_WEEKLY)),
+    }
+
+
+def _new_job(incremental=False):
+    """
+    Prepare the paths and job record for one backup, in the request context
+
+    Returns:
+        Tuple of (job dictionary, run function, keyword arguments for it)
+    """
+    db_path = get_database_path()
+    if not db_path or not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database file not found: {db_path}")
+
+    backup_dir = get_backup_directory()
+    config = current_app.config
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': 'incremental' if incremental else 'full',
+        'status': 'queued',
+        'percent': 0,
+        'pages_total': None,
+        'pages_remaining': None,
+        'backup_filename': None,
+        'timestamp': None,
+        'error': None,
+        'result': None,
+    }
+    options = {
+        'db_path': db_path,
+        'backup_dir': backup_dir,
+        'pages_per_step': int(config.get('BACKUP_PAGES_PER_STEP', DEFAULT_PAGES_PER_STEP)),
+        'step_sleep': int(config.get('BACKUP_STEP_SLEEP_MS', DEFAULT_STEP_SLEEP_MS)) / 1000,
+    }
+    if incremental:
+        options['chunk_pages'] = int(config.get('BACKUP_CHUNK_PAGES', DEFAULT_CHUNK_PAGES))
+        options['retention'] = _retention_policy(config)
+        return job, _run_incremental, options
+
+    compression = backup_compression()
+    extension = next(ext for ext, name in BACKUP_EXTENSIONS.items() if name == compression)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    # A restore takes its safety backup within the same second as the one it restores
+    base, suffix = timestamp, 1
+    while any((backup_dir / f"{BACKUP_PREFIX}{timestamp}{ext}").exists() for ext in BACKUP_EXTENSIONS):
+        suffix += 1
+        timestamp = f"{base}_{suffix}"
+    job['backup_filename'] = f"{BACKUP_PREFIX}{timestamp}{extension}"
+    job['timestamp'] = timestamp
+    options['compression'] = compression
+    return job, _run_backup, options
+
+
+def _run_now(incremental):
+    job, run, options = _new_job(incremental)
+    (options['backup_dir'] / JOBS_DIRNAME).mkdir(exist_ok=True)
+    run(job, **options)
+    if job['status'] != 'done':
+        raise Exception(f"Failed to create backup: {job['error']}")
+    return job['result']
+
+
+def backup_database():
+    """
+    Create a backup of the database and wait for it
+
+    Uses the same online copy, integrity check and compression as
+    start_backup_job, in the calling thread.
+
+    Returns:
+        Dictionary with backup_filename, size and compression details
+    """
+    return _run_now(incremental=False)
+
+
+def create_incremental_backup():
+    """
+    Take an incremental snapshot and apply the retention policy, in the calling thread
+
+    Returns:
+        Dictionary with snapshot_id, chunk counts, new_bytes and pruning results
+    """
+    return _run_now(incremental=True)
+
+
+def start_backup_job(incremental=False):
+    """
+    Start a backup in a background thread
+
+    Only one backup runs at a time; asking again while one is in progress
+    returns the running job.
+
+    Args:
+        incremental: Take an incremental snapshot instead of a full copy
+
+    Returns:
+        Job status dictionary (see get_backup_job)
+    """
+    backup_dir = get_backup_directory()
+    jobs_dir = backup_dir / JOBS_DIRNAME
+    jobs_dir.mkdir(exist_ok=True)
+    with _job_lock:
+        for running in _list_jobs(jobs_dir):
+            if running['status'] not in ('done', 'failed'):
+                return running
+        job, run, options = _new_job(incremental)
+        _write_job(jobs_dir, job)
+    threading.Thread(target=run, args=(job,), kwargs=options,
+                     name=f"db-backup-{job['id'][:8]}", daemon=True).start()
+    return dict(job)
+
+
+def _list_jobs(jobs_dir, stale_after=6 * 3600):
+    jobs = []
+    for path in jobs_dir.glob('*.json'):
+        try:
+            job = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        if time.time() - path.stat().st_mtime > stale_after:
+            # Finished long ago, or abandoned by a worker that was restarted
+            path.unlink()
+            continue
+        jobs.append(job)
+    return jobs
+
+
+def get_backup_job(job_id):
+    """
+    Status of a backup job, readable from any worker process
+
+    Returns:
+        Dictionary with id, status (queued, copying, verifying, compressing,
+        done or failed), percent, pages_total, pages_remaining, error and
+        result, or None for an unknown job
+    """
+    if not job_id.isalnum():
+        return None
+    path = get_backup_directory() / JOBS_DIRNAME / f"{job_id}.json"
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
 
 
 def list_backups():
@@ -119,7 +481,10 @@ def list_backups():
     if not backup_dir.exists():
         return backups
     
-    for backup_file in backup_dir.glob('pcm_store_backup_*.db'):
+    for backup_file in backup_dir.glob(f'{BACKUP_PREFIX}*'):
+        extension = backup_extension(backup_file.name)
+        if not extension:
+            continue
         try:
             stat = backup_file.stat()
             backups.append({
@@ -128,7 +493,8 @@ def list_backups():
                 'size': stat.st_size,
                 'size_formatted': format_file_size(stat.st_size),
                 'created_at': datetime.fromtimestamp(stat.st_mtime),
-                'timestamp': backup_file.stem.replace('pcm_store_backup_', '')
+                'timestamp': backup_file.name[len(BACKUP_PREFIX):-len(extension)],
+                'compression': BACKUP_EXTENSIONS[extension]
             })
         except Exception:
             continue
@@ -138,38 +504,125 @@ def list_backups():
     return backups
 
 
+def _install_database(restored_path, db_path):
+    """Put a checked database file in place of the live one, without a restart"""
+    config = current_app.config
+    generation = restore_coordinator.swap_in(
+        restored_path, db_path,
+        grace=float(config.get('RESTORE_GRACE_SECONDS', DEFAULT_GRACE_SECONDS)),
+        drain_timeout=float(config.get('RESTORE_DRAIN_TIMEOUT', DEFAULT_DRAIN_TIMEOUT))
+    )
+    database_stats.invalidate(db_path)
+    return generation
+
+
 def restore_database(backup_filename, create_backup=True):
     """Restore database from a backup file"""
     backup_dir = get_backup_directory()
     backup_path = backup_dir / backup_filename
     
-    if not backup_path.exists():
+    if not backup_extension(backup_filename) or not backup_path.exists():
         raise FileNotFoundError(f"Backup file not found: {backup_filename}")
     
     db_path = get_database_path()
     if not db_path:
         raise ValueError("Database path not configured")
     
+    fd, restored_path = tempfile.mkstemp(prefix='.restore-', suffix='.db', dir=str(backup_dir))
+    os.close(fd)
     try:
+        # Decompress and check the backup before touching the live database
+        with _open_compressed_reader(str(backup_path)) as src, open(restored_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        _integrity_check(restored_path)
+
         # Create a backup of current database before restoring
         if create_backup and os.path.exists(db_path):
             current_backup = backup_database()
             current_app.logger.info(f"Created backup before restore: {current_backup['backup_filename']}")
         
-        # Close any existing database connections
-        # Note: In production, you may need to restart the app after restore
-        
-        # Copy backup file to database location
-        shutil.copy2(backup_path, db_path)
+        generation = _install_database(restored_path, db_path)
         
         return {
             'success': True,
             'restored_from': backup_filename,
             'database_path': db_path,
+            'generation': generation,
             'restored_at': datetime.now()
         }
     except Exception as e:
         raise Exception(f"Failed to restore database: {str(e)}")
+    finally:
+        os.unlink(restored_path)
+
+
+def restore_snapshot(snapshot_id, create_backup=True):
+    """
+    Restore the database from an incremental snapshot
+
+    The snapshot is rebuilt from its chunks and checked before the live
+    database is touched; the safety copy of the current database is itself
+    an incremental snapshot, so it costs only the pages that changed.
+    """
+    backup_dir = get_backup_directory()
+    db_path = get_database_path()
+    if not db_path:
+        raise ValueError("Database path not configured")
+
+    fd, restored_path = tempfile.mkstemp(prefix='.restore-', suffix='.db', dir=str(backup_dir))
+    os.close(fd)
+    try:
+        rebuild_snapshot(get_store_directory(backup_dir), snapshot_id, restored_path)
+        _integrity_check(restored_path)
+
+        if create_backup and os.path.exists(db_path):
+            current_backup = create_incremental_backup()
+            current_app.logger.info(f"Created snapshot before restore: {current_backup['snapshot_id']}")
+
+        generation = _install_database(restored_path, db_path)
+
+        return {
+            'success': True,
+            'restored_from': snapshot_id,
+            'database_path': db_path,
+            'generation': generation,
+            'restored_at': datetime.now()
+        }
+    except Exception as e:
+        raise Exception(f"Failed to restore snapshot: {str(e)}")
+    finally:
+        os.unlink(restored_path)
+
+
+def list_snapshots():
+    """List incremental snapshots, newest first, without their chunk lists"""
+    snapshots = []
+    for manifest in read_manifests(get_store_directory(get_backup_directory())):
+        snapshots.append({
+            'id': manifest['id'],
+            'created_at': datetime.fromisoformat(manifest['created_at']),
+            'size': manifest['db_size'],
+            'size_formatted': format_file_size(manifest['db_size']),
+            'chunks': len(manifest['chunks']),
+            'new_chunks': manifest['new_chunks'],
+            'new_bytes': manifest['new_bytes'],
+            'new_size_formatted': format_file_size(manifest['new_bytes']),
+        })
+    return snapshots
+
+
+def get_snapshot_usage():
+    """Real (on disk) and logical (as full copies) size of the snapshot store"""
+    usage = store_usage(get_store_directory(get_backup_directory()))
+    usage['real_size_formatted'] = format_file_size(usage['real_size'])
+    usage['logical_size_formatted'] = format_file_size(usage['logical_size'])
+    return usage
+
+
+def prune_snapshots():
+    """Apply the configured hourly/daily/weekly retention to the snapshot store"""
+    store_dir = get_store_directory(get_backup_directory())
+    return apply_retention(store_dir, **_retention_policy(current_app.config))
 
 
 def delete_backup(backup_filename):
@@ -177,7 +630,7 @@ def delete_backup(backup_filename):
     backup_dir = get_backup_directory()
     backup_path = backup_dir / backup_filename
     
-    if not backup_path.exists():
+    if not backup_extension(backup_filename) or not backup_path.exists():
         raise FileNotFoundError(f"Backup file not found: {backup_filename}")
     
     try:
@@ -191,46 +644,30 @@ def delete_backup(backup_filename):
 
 
 def get_database_statistics():
-    """Get database statistics"""
+    """
+    Get database statistics
+
+    Served from the database_stats cache (DB_STATS_TTL seconds): row counts
+    come from sqlite_stat1 or an exact recount, sizes from dbstat.
+    """
     db_path = get_database_path()
     if not db_path or not os.path.exists(db_path):
         return None
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get table names
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        stats = {}
-        total_rows = 0
-        
-        for table in tables:
-            cursor.execute(f"SELECT COUNT(*) FROM {table}")
-            count = cursor.fetchone()[0]
-            stats[table] = count
-            total_rows += count
-        
-        # Get database page count and size
-        cursor.execute("PRAGMA page_count")
-        page_count = cursor.fetchone()[0]
-        cursor.execute("PRAGMA page_size")
-        page_size = cursor.fetchone()[0]
-        db_size = page_count * page_size
-        
-        conn.close()
-        
-        return {
-            'tables': stats,
-            'total_tables': len(tables),
-            'total_rows': total_rows,
-            'page_count': page_count,
-            'page_size': page_size,
-            'calculated_size': db_size
-        }
+        return database_stats.get(
+            db_path,
+            ttl=int(current_app.config.get('DB_STATS_TTL', DEFAULT_STATS_TTL)),
+            analysis_limit=int(current_app.config.get('DB_STATS_ANALYSIS_LIMIT', DEFAULT_ANALYSIS_LIMIT))
+        )
     except Exception as e:
         current_app.logger.error(f"Error getting database statistics: {e}")
         return None
 
+
+def start_statistics_recount():
+    """Start an exact row count of every table in the background"""
+    db_path = get_database_path()
+    if not db_path or not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database file not found: {db_path}")
+    return database_stats.start_recount(db_path)
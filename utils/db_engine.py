@@ -0,0 +1,218 @@
+"""
+Database Engine Profile
+Backend-appropriate SQLAlchemy engine options, a tuned per-connection SQLite
+profile (WAL, busy timeout, mmap) and periodic WAL checkpoints
+"""
+
+import os
+import time
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from .db_restore import restore_coordinator
+
+logger = logging.getLogger(__name__)
+
+# Pool arguments only QueuePool understands; StaticPool rejects them
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE_KB = 16 * 1024  # Per connection, so kept modest
+DEFAULT_POOL_SIZE = 5  # SQLite has one writer at a time, more connections only add memory
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_CHECKPOINT_INTERVAL = 300
+DEFAULT_WAL_TRUNCATE_MB = 64
+
+
+def is_sqlite(database_uri):
+    return make_url(database_uri).get_backend_name() == 'sqlite'
+
+
+def is_memory_sqlite(database_uri):
+    url = make_url(database_uri)
+    return url.get_backend_name() == 'sqlite' and (
+        url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+    )
+
+
+def sqlite_pragmas(config=None):
+    """
+    PRAGMAs applied to every new SQLite connection
+
+    WAL lets readers run while a write is in progress; synchronous=NORMAL is
+    durable in WAL mode except for the last transactions on power loss; the
+    busy timeout makes a second writer wait for the lock instead of failing
+    with "database is locked".
+    """
+    config = config or {}
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(config.get('SQLITE_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS)),
+        'mmap_size': int(config.get('SQLITE_MMAP_SIZE', DEFAULT_MMAP_SIZE)),
+        'cache_size': -int(config.get('SQLITE_CACHE_SIZE_KB', DEFAULT_CACHE_SIZE_KB)),  # Negative = KiB
+        'temp_store': 'MEMORY',
+    }
+
+
+def engine_options(database_uri, options=None, config=None):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS suited to the database backend
+
+    Server databases keep the configured QueuePool sizing. File SQLite gets a
+    small QueuePool (connections keep their warmed page cache and PRAGMAs)
+    without pre-ping, which only costs a query on a local file. In-memory
+    SQLite must share one connection, so it gets StaticPool and none of the
+    pool sizing arguments.
+
+    Args:
+        database_uri: SQLALCHEMY_DATABASE_URI
+        options: Base engine options from the config
+        config: Flask config for the SQLITE_* settings
+
+    Returns:
+        New options dictionary
+    """
+    config = config or {}
+    options = dict(options or {})
+    if not is_sqlite(database_uri):
+        return options
+
+    connect_args = dict(options.get('connect_args') or {})
+    connect_args['check_same_thread'] = False
+    # sqlite3's own lock wait, in seconds, matches the busy_timeout PRAGMA
+    connect_args.setdefault('timeout', int(config.get('SQLITE_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS)) / 1000)
+    options['connect_args'] = connect_args
+    options.pop('pool_pre_ping', None)
+    options.pop('pool_recycle', None)
+
+    if is_memory_sqlite(database_uri):
+        for key in QUEUE_POOL_OPTIONS:
+            options.pop(key, None)
+        options['poolclass'] = StaticPool
+    else:
+        options['poolclass'] = QueuePool
+        options['pool_size'] = int(config.get('SQLITE_POOL_SIZE', DEFAULT_POOL_SIZE))
+        options['max_overflow'] = int(config.get('SQLITE_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW))
+    return options
+
+
+def install_sqlite_pragmas(engine, pragmas, on_connect=None):
+    """Apply PRAGMAs to each new DBAPI connection of an SQLite engine"""
+    if is_memory_sqlite(str(engine.url)):
+        pragmas = {name: value for name, value in pragmas.items() if name not in ('journal_mode', 'mmap_size')}
+
+    @event.listens_for(engine, 'connect')
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+        if on_connect:
+            on_connect()
+
+
+class WalCheckpointer:
+    """
+    Background PASSIVE checkpoints, escalating to TRUNCATE when the WAL grows large
+
+    SQLite's auto-checkpoint never shrinks the -wal file and can be starved
+    by a steady stream of readers. One daemon thread per process (started
+    lazily, so forked workers each get their own) keeps it in check.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._engine = None
+        self._interval = DEFAULT_CHECKPOINT_INTERVAL
+        self._truncate_bytes = DEFAULT_WAL_TRUNCATE_MB * 1024 * 1024
+        self.last_result = None
+
+    def configure(self, engine, interval, truncate_bytes):
+        self._engine = engine
+        self._interval = interval
+        self._truncate_bytes = truncate_bytes
+
+    def ensure_started(self):
+        """Start the checkpoint thread for this process if it is not running yet"""
+        if self._engine is None or self._interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='wal-checkpoint', daemon=True).start()
+
+    def wal_size(self):
+        try:
+            return os.path.getsize(f"{self._engine.url.database}-wal")
+        except (OSError, TypeError):
+            return 0
+
+    def checkpoint(self, mode=None):
+        """
+        Run one checkpoint
+
+        Args:
+            mode: PASSIVE, FULL, RESTART or TRUNCATE; by default TRUNCATE when
+                the WAL is over the size threshold, otherwise PASSIVE
+
+        Returns:
+            Dictionary with mode, busy flag, WAL frames and checkpointed frames
+        """
+        if mode is None:
+            mode = 'TRUNCATE' if self.wal_size() > self._truncate_bytes else 'PASSIVE'
+        with self._engine.connect() as conn:
+            busy, log_frames, checkpointed = conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        self.last_result = {'mode': mode, 'busy': bool(busy), 'log_frames': log_frames,
+                            'checkpointed': checkpointed, 'at': time.time()}
+        return self.last_result
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                result = self.checkpoint()
+                if result['busy']:
+                    logger.info(f"WAL checkpoint ({result['mode']}) could not finish, readers busy")
+            except Exception as e:
+                logger.error(f"WAL checkpoint failed: {e}")
+
+
+def init_engine(app, db):
+    """
+    Initialise Flask-SQLAlchemy with the backend-appropriate engine profile
+
+    Replaces db.init_app(app): engine options are adjusted before the
+    engine is created and SQLite connections get the tuned PRAGMAs.
+    """
+    database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        database_uri, app.config.get('SQLALCHEMY_ENGINE_OPTIONS'), app.config
+    )
+    db.init_app(app)
+    if not is_sqlite(database_uri):
+        return
+    with app.app_context():
+        engine = db.engine
+        on_connect = None
+        if not is_memory_sqlite(database_uri):
+            wal_checkpointer.configure(
+                engine,
+                int(app.config.get('SQLITE_CHECKPOINT_INTERVAL', DEFAULT_CHECKPOINT_INTERVAL)),
+                int(app.config.get('SQLITE_WAL_TRUNCATE_MB', DEFAULT_WAL_TRUNCATE_MB)) * 1024 * 1024
+            )
+            on_connect = wal_checkpointer.ensure_started
+            restore_coordinator.init_app(engine, os.path.join(app.instance_path, 'db_state.json'), db.session)
+        install_sqlite_pragmas(engine, sqlite_pragmas(app.config), on_connect)
+
+
+wal_checkpointer = WalCheckpointer()
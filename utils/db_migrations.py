@@ -2,10 +2,14 @@
 Database Migration System
 Safely migrates database schema without losing data
 """
-from sqlalchemy import inspect, text, MetaData
+from sqlalchemy import inspect, text, bindparam, MetaData
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 from flask import current_app
 from models import db
+import hashlib
+import inspect as pyinspect
 import traceback
+from datetime import datetime, timezone
 
 
 def get_table_columns(table_name):
@@ -91,6 +95,75 @@ def safe_add_column(table_name, column_name, column_type, default_value=None, nu
         raise
 
 
+# Composite/lookup indexes for hot queries, also declared on the models so
+# fresh databases get them from db.create_all()
+# Format: (table_name, index_name, [columns])
+INDEX_DEFINITIONS = [
+    # track_visitor() looks the visitor up by IP on every request
+    ('visitor_records', 'ix_visitor_records_ip_address', ['ip_address']),
+    # track_visitor() page view lookup
+    ('page_views', 'ix_page_views_page_url_visitor_id', ['page_url', 'visitor_id']),
+    # Databases created before unique_user_visit_date existed have no index at all
+    ('user_visits', 'ix_user_visits_user_id_visit_date', ['user_id', 'visit_date']),
+    # Daily limited-access download quota checks
+    ('limited_access_downloads', 'ix_limited_access_downloads_user_date_type',
+     ['user_id', 'download_date', 'download_type']),
+    # M-Pesa callback lookup and the expired-payment cleanup
+    ('mpesa_transactions', 'ix_mpesa_transactions_transaction_reference', ['transaction_reference']),
+    ('mpesa_transactions', 'ix_mpesa_transactions_status_created_at', ['status', 'created_at']),
+    # Index page and news listing: filter + newest first
+    ('materials', 'ix_materials_is_active_created_at', ['is_active', 'created_at']),
+    ('news', 'ix_news_is_published_created_at', ['is_published', 'created_at']),
+]
+
+
+def index_covers(table_name, columns):
+    """
+    Check whether an existing index or unique constraint already starts with the given columns
+
+    Returns:
+        Name of the covering index/constraint, or None
+    """
+    try:
+        inspector = inspect(db.engine)
+        candidates = inspector.get_indexes(table_name) + inspector.get_unique_constraints(table_name)
+    except Exception:
+        return None
+    for candidate in candidates:
+        if list(candidate.get('column_names') or [])[:len(columns)] == list(columns):
+            return candidate.get('name') or '(unnamed)'
+    return None
+
+
+def safe_create_index(table_name, index_name, columns):
+    """
+    Create an index if the table exists and nothing covers the columns yet
+    Returns True if the index was created, False if it was not needed
+    """
+    if not table_exists(table_name):
+        return False
+    if index_covers(table_name, columns):
+        return False
+    with db.engine.begin() as conn:
+        conn.execute(text(f"CREATE INDEX {index_name} ON {table_name} ({', '.join(columns)})"))
+    return True
+
+
+def migrate_indexes():
+    """
+    Create every index in INDEX_DEFINITIONS that is missing
+    Safe to run repeatedly: existing or equivalent indexes are left alone
+    """
+    migrations_applied = []
+    for table_name, index_name, columns in INDEX_DEFINITIONS:
+        try:
+            if safe_create_index(table_name, index_name, columns):
+                migrations_applied.append(f"Created index {index_name} on {table_name}({', '.join(columns)})")
+        except Exception as e:
+            current_app.logger.error(f"Failed to create index {index_name}: {e}")
+    return migrations_applied
+
+
 def migrate_all_tables():
     """
     Migrate all tables to match current models
@@ -105,7 +178,7 @@ def migrate_all_tables():
             DownloadRecord, VisitorRecord, PageView, News, Subscription,
             SubscriptionPlan, PasswordResetToken, LimitedAccessDownload,
             TermsOfService, HelpRequest, TopUser, UserVisit, MpesaTransaction,
-            MaterialView
+            MaterialView, StoredBlob
         )
         
         # Define all tables and their columns with types
@@ -316,6 +389,14 @@ def migrate_all_tables():
                 ('created_at', 'DATETIME', None, True),
                 ('updated_at', 'DATETIME', None, True),
             ],
+            'stored_blobs': [
+                ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT', None, False),
+                ('sha256', 'VARCHAR(64)', None, False),
+                ('file_path', 'VARCHAR(500)', None, False),
+                ('size', 'BIGINT', None, False),
+                ('ref_count', 'INTEGER', '0', True),
+                ('created_at', 'DATETIME', None, True),
+            ],
             'material_views': [
                 ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT', None, False),
                 ('user_id', 'INTEGER', None, False),
@@ -352,26 +433,229 @@ def migrate_all_tables():
         return migrations_applied
 
 
+def create_tables():
+    """Create every model table that does not exist yet"""
+    db.create_all()
+    return []
+
+
+def legacy_columns():
+    """Columns the original add_missing_columns() in app.py added"""
+    from app import add_missing_columns
+    add_missing_columns()
+    return []
+
+
+def engagement_counters():
+    """Material engagement counter columns and their sort indexes, backfilled from the event tables"""
+    from utils.engagement import reconcile_counters
+    migrations_applied = []
+    for column_name in ('download_count', 'view_count', 'purchase_count'):
+        if safe_add_column('materials', column_name, 'INTEGER', 0, False):
+            migrations_applied.append(f"Added {column_name} to materials")
+    # created_at is the tie-breaker of catalog_order(), so the sort needs no temp b-tree
+    for column_name in ('download_count', 'view_count'):
+        index_name = f'ix_materials_is_active_{column_name}'
+        if safe_create_index('materials', index_name, ['is_active', column_name, 'created_at']):
+            migrations_applied.append(f"Created index {index_name} on materials(is_active, {column_name}, created_at)")
+    result = reconcile_counters()
+    if result['corrected']:
+        migrations_applied.append(f"Backfilled {result['corrected']} engagement counter(s)")
+    return migrations_applied
+
+
+def tracking_rollups():
+    """Rollup table for archived tracking rows, and the page view index the visitor archiving needs"""
+    from models import TrackingRollup
+    migrations_applied = []
+    if not table_exists('tracking_rollups'):
+        TrackingRollup.__table__.create(db.engine, checkfirst=True)
+        migrations_applied.append("Created table tracking_rollups")
+    if safe_create_index('page_views', 'ix_page_views_visitor_id', ['visitor_id']):
+        migrations_applied.append("Created index ix_page_views_visitor_id on page_views(visitor_id)")
+    return migrations_applied
+
+
+def listing_indexes():
+    """created_at indexes the keyset paginated admin listings seek on"""
+    migrations_applied = []
+    for table_name in ('users', 'materials', 'subscriptions', 'news'):
+        index_name = f'ix_{table_name}_created_at'
+        if safe_create_index(table_name, index_name, ['created_at']):
+            migrations_applied.append(f"Created index {index_name} on {table_name}(created_at)")
+    return migrations_applied
+
+
+LISTING_KEY_BACKFILL = datetime(1970, 1, 1)
+
+
+def backfill_listing_keys():
+    """
+    Set NULL created_at on the keyset paginated tables to the epoch
+
+    Keyset cursors cannot address a NULL key, so rows imported without a
+    created_at were unreachable past the first page. The epoch sorts them
+    last in the newest-first listings.
+    """
+    migrations_applied = []
+    with db.engine.begin() as conn:
+        for table_name in ('users', 'materials', 'subscriptions', 'news'):
+            if not table_exists(table_name):
+                continue
+            # Bound as a DateTime so the stored text matches what the ORM writes
+            # and compares against; a bare string breaks ties in the cursor range
+            result = conn.execute(
+                text(f"UPDATE {table_name} SET created_at = :epoch WHERE created_at IS NULL")
+                .bindparams(bindparam('epoch', type_=db.DateTime)),
+                {"epoch": LISTING_KEY_BACKFILL}
+            )
+            if result.rowcount:
+                migrations_applied.append(f"Backfilled created_at on {result.rowcount} {table_name} row(s)")
+    return migrations_applied
+
+
+# Ordered, append-only schema steps recorded in the schema_migrations ledger.
+# Each step must be safe on databases that already have its changes (older
+# installs were migrated by introspection). Never edit or reorder a step that
+# has shipped: its checksum is recorded, so add a new step instead.
+# Format: (version, name, function returning a list of applied changes)
+MIGRATIONS = [
+    (1, 'Create tables', create_tables),
+    (2, 'Add columns missing from older databases', migrate_all_tables),
+    (3, 'Legacy subscription and payment method columns', legacy_columns),
+    (4, 'Hot query indexes', migrate_indexes),
+    (5, 'Material engagement counters', engagement_counters),
+    (6, 'Tracking data rollups', tracking_rollups),
+    (7, 'Listing created_at indexes', listing_indexes),
+    (8, 'Backfill NULL listing keys', backfill_listing_keys),
+]
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+LEDGER_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(200) NOT NULL,
+        checksum VARCHAR(64) NOT NULL,
+        applied_at TIMESTAMP NOT NULL
+    )
+"""
+
+
+def migration_checksum(function):
+    """SHA-256 of a migration step's source code"""
+    return hashlib.sha256(pyinspect.getsource(function).encode('utf-8')).hexdigest()
+
+
+def current_schema_version():
+    """
+    Highest applied migration version, 0 for a database without a ledger
+
+    This single query is all a startup costs once the schema is current.
+    """
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(text("SELECT max(version) FROM schema_migrations")).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        return 0
+
+
+def applied_migrations():
+    """Ledger rows as {version: {'name', 'checksum', 'applied_at'}}"""
+    try:
+        with db.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT version, name, checksum, applied_at FROM schema_migrations ORDER BY version"
+            )).fetchall()
+    except (OperationalError, ProgrammingError):
+        return {}
+    return {row[0]: {'name': row[1], 'checksum': row[2], 'applied_at': row[3]} for row in rows}
+
+
+def run_migrations(from_version=None):
+    """
+    Apply the migration steps newer than the ledger, recording each one
+
+    Another worker starting at the same time may apply the same step; steps
+    are idempotent and the duplicate ledger row is ignored.
+
+    Returns:
+        List of change descriptions from the applied steps
+    """
+    if from_version is None:
+        from_version = current_schema_version()
+    with db.engine.begin() as conn:
+        conn.execute(text(LEDGER_DDL))
+
+    migrations_applied = []
+    for version, name, function in MIGRATIONS:
+        if version <= from_version:
+            continue
+        changes = function() or []
+        migrations_applied += changes
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, name, checksum, applied_at) "
+                         "VALUES (:version, :name, :checksum, :applied_at)"),
+                    {'version': version, 'name': name, 'checksum': migration_checksum(function),
+                     'applied_at': datetime.now(timezone.utc)}
+                )
+        except IntegrityError:
+            pass  # Recorded by a concurrent worker
+        current_app.logger.info(f"✓ Schema migration {version}: {name} ({len(changes)} change(s))")
+    return migrations_applied
+
+
+def migration_status():
+    """
+    Compare the ledger with MIGRATIONS
+
+    Returns:
+        List of {'version', 'name', 'status', 'applied_at'} where status is
+        'applied', 'pending' or 'changed' (the step's source no longer
+        matches the checksum recorded when it ran)
+    """
+    applied = applied_migrations()
+    status = []
+    for version, name, function in MIGRATIONS:
+        row = applied.get(version)
+        if not row:
+            state = 'pending'
+        elif row['checksum'] != migration_checksum(function):
+            state = 'changed'
+        else:
+            state = 'applied'
+        status.append({'version': version, 'name': name, 'status': state,
+                       'applied_at': row['applied_at'] if row else None})
+    return status
+
+
 def safe_migrate_database():
     """
     Safe database migration - ensures all tables and columns exist
     without dropping any existing data
+
+    Only steps newer than the schema_migrations ledger run, so a current
+    database costs one query instead of a full schema introspection.
     """
     try:
-        # First, create all tables (only creates if they don't exist)
-        db.create_all()
+        version = current_schema_version()
+        if version >= LATEST_SCHEMA_VERSION:
+            return {
+                'success': True,
+                'migrations_applied': [],
+                'schema_version': version,
+                'message': f'Database schema is current (version {version}).'
+            }
         
-        # Then, migrate columns
-        migrations = migrate_all_tables()
-        
-        # Also run the legacy add_missing_columns for backward compatibility
-        from app import add_missing_columns
-        add_missing_columns()
+        migrations = run_migrations(version)
         
         return {
             'success': True,
             'migrations_applied': migrations,
-            'message': f'Database migration completed. Applied {len(migrations)} migrations.'
+            'schema_version': LATEST_SCHEMA_VERSION,
+            'message': (f'Database migrated from schema version {version} to {LATEST_SCHEMA_VERSION}. '
+                        f'Applied {len(migrations)} migrations.')
         }
     except Exception as e:
         current_app.logger.error(f"Database migration error: {e}")
@@ -381,4 +665,3 @@ def safe_migrate_database():
             'error': str(e),
             'message': f'Database migration failed: {str(e)}'
         }
-
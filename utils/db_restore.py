@@ -0,0 +1,201 @@
+"""
+Hot Database Restore
+Swaps a restored SQLite database in while the site keeps running: a
+maintenance gate shared by every worker pauses writes, the connection pool
+is drained, and a generation stamp tells the other workers to reconnect
+"""
+
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRACE_SECONDS = 1.0
+DEFAULT_DRAIN_TIMEOUT = 10.0
+DEFAULT_GATE_MAX_SECONDS = 600  # A gate older than this was left by a crashed restore
+
+
+def copy_into_live(restored_path, db_path, timeout=30):
+    """
+    Replace the contents of a live database with a restored file
+
+    Runs the SQLite backup API in a single step, so the whole copy is one
+    write transaction on the live file: every connection, in any process,
+    sees either the old or the new database, and the WAL and shared-memory
+    files stay consistent. A restored file with a different page size is
+    converted first (a WAL database cannot change its page size).
+    """
+    live = sqlite3.connect(db_path, timeout=timeout)
+    source = sqlite3.connect(restored_path)
+    try:
+        page_size = live.execute("PRAGMA page_size").fetchone()[0]
+        if source.execute("PRAGMA page_size").fetchone()[0] != page_size:
+            source.execute(f"PRAGMA page_size = {int(page_size)}")
+            source.execute("VACUUM")
+        source.backup(live)
+        live.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        source.close()
+        live.close()
+
+
+class RestoreCoordinator:
+    """
+    Cross-worker restore state kept in one small JSON file
+
+    The file holds the maintenance flag and a generation number. Every
+    request calls sync(), which costs one stat() unless the file changed;
+    a worker that sees a new generation disposes its engine, so no pooled
+    connection (or cache registered with add_listener) outlives a restore.
+    """
+
+    def __init__(self):
+        self._engine = None
+        self._session = None
+        self._state_path = None
+        self._state_mtime = None
+        self._state = {'generation': 0, 'maintenance': False, 'since': None}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def init_app(self, engine, state_path, session=None):
+        self._engine = engine
+        self._session = session
+        self._state_path = Path(state_path)
+        self._state_path.parent.mkdir(parents=True, exist_ok=True)
+        self._generation = self._read_state()['generation']
+
+    def add_listener(self, callback):
+        """Call callback() in each worker after it picks up a restored database"""
+        self._listeners.append(callback)
+
+    def _read_state(self):
+        try:
+            mtime = self._state_path.stat().st_mtime_ns
+        except (OSError, AttributeError):
+            return self._state
+        if mtime != self._state_mtime:
+            try:
+                state = json.loads(self._state_path.read_text())
+            except (OSError, ValueError):
+                return self._state  # Caught mid-replace; the next request rereads it
+            with self._lock:
+                self._state, self._state_mtime = state, mtime
+        return self._state
+
+    def _write_state(self, **changes):
+        state = dict(self._read_state(), **changes)
+        tmp_path = self._state_path.with_name(f"{self._state_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self._state_path)
+        return self._read_state()
+
+    def sync(self):
+        """
+        Pick up restores done by other workers
+
+        Returns:
+            True while the maintenance gate is closed
+        """
+        if self._state_path is None:
+            return False
+        state = self._read_state()
+        if state['generation'] != self._generation:
+            with self._lock:
+                stale = state['generation'] != self._generation
+                self._generation = state['generation']
+            if stale:
+                self._reconnect()
+        return bool(state['maintenance']) and time.time() - (state['since'] or 0) < DEFAULT_GATE_MAX_SECONDS
+
+    def wait_until_writable(self, timeout):
+        """Block while the gate is closed; False if it is still closed after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while self.sync():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def _reconnect(self):
+        if self._engine is not None:
+            self._engine.dispose()
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Restore listener failed: {e}")
+
+    def _drain(self, timeout):
+        """Return this worker's connections to the pool and wait for other threads to do the same"""
+        if self._session is not None:
+            self._session.remove()
+        pool = self._engine.pool
+        deadline = time.monotonic() + timeout
+        while getattr(pool, 'checkedout', lambda: 0)() > 0:
+            if time.monotonic() >= deadline:
+                logger.warning(f"Restore proceeding with {pool.checkedout()} connection(s) still checked out")
+                break
+            time.sleep(0.05)
+        self._engine.dispose()
+
+    def swap_in(self, restored_path, db_path, grace=DEFAULT_GRACE_SECONDS, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        """
+        Install a verified database file without restarting the workers
+
+        Closes the gate, gives in-flight writes in other workers `grace`
+        seconds to finish, drains this worker's pool, copies the file in
+        with copy_into_live, then opens the gate with a new generation.
+
+        Returns:
+            The new generation number
+        """
+        if self._state_path is None:
+            copy_into_live(restored_path, db_path)
+            return None
+        with open(self._state_path.with_name(f"{self._state_path.name}.lock"), 'a') as lock_file:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise RuntimeError("Another restore is already in progress")
+            try:
+                self._write_state(maintenance=True, since=time.time(), pid=os.getpid())
+                try:
+                    time.sleep(grace)
+                    self._drain(drain_timeout)
+                    copy_into_live(restored_path, db_path)
+                except Exception:
+                    self._write_state(maintenance=False, since=None)
+                    raise
+                state = self._write_state(maintenance=False, since=None,
+                                          generation=self._read_state()['generation'] + 1)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self._generation = state['generation']
+        self._reconnect()
+        return state['generation']
+
+
+def writes_database(view):
+    """
+    Mark a GET view that writes (access counters, view and download
+    records), so the maintenance gate holds it during a restore like a POST
+    """
+    view.writes_database = True
+    return view
+
+
+restore_coordinator = RestoreCoordinator()
@@ -0,0 +1,195 @@
+"""
+Read/Write Engine Routing
+Sends the queries of explicitly read-only routes and blocks to a read engine
+(a PostgreSQL replica, or a read-only SQLite pool on the same WAL database)
+while flushes, writes and read-after-write requests stay on the primary
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request, has_app_context, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool
+
+from .db_engine import is_sqlite, is_memory_sqlite, sqlite_pragmas, install_sqlite_pragmas, DEFAULT_BUSY_TIMEOUT_MS
+from .db_restore import restore_coordinator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_READ_POOL_SIZE = 5
+DEFAULT_MAX_LAG = 5.0  # Seconds a replica may trail the primary before reads fall back
+DEFAULT_READ_AFTER_WRITE_SECONDS = 10
+LAG_CHECK_INTERVAL = 2.0  # Seconds a replica lag measurement is reused
+PIN_SESSION_KEY = 'db_primary_until'
+# PRAGMAs that only make sense on the connection that writes
+WRITER_PRAGMAS = ('journal_mode', 'synchronous')
+SERVER_POOL_OPTIONS = ('pool_pre_ping', 'pool_recycle', 'pool_size', 'max_overflow', 'pool_timeout')
+
+REPLICA_LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class DatabaseRouter:
+    """
+    Chooses the engine for each query of a RoutingSession
+
+    A query goes to the read engine only inside read_only() (or a view
+    wrapped with read_only_route), while the session has nothing pending
+    and has not written in its current transaction. With a replica, a user
+    who just wrote is pinned to the primary for READ_AFTER_WRITE_SECONDS,
+    and every read falls back to the primary while the measured lag is over
+    READ_REPLICA_MAX_LAG or the replica cannot be reached.
+    """
+
+    def __init__(self):
+        self.read_engine = None
+        self.kind = None  # 'replica' or 'sqlite'
+        self._max_lag = DEFAULT_MAX_LAG
+        self._pin_seconds = DEFAULT_READ_AFTER_WRITE_SECONDS
+        self._lock = threading.Lock()
+        self._lag = None
+        self._lag_checked_at = 0.0
+
+    def init_app(self, app, db):
+        self._max_lag = float(app.config.get('READ_REPLICA_MAX_LAG', DEFAULT_MAX_LAG))
+        self._pin_seconds = float(app.config.get('READ_AFTER_WRITE_SECONDS', DEFAULT_READ_AFTER_WRITE_SECONDS))
+        replica_uri = app.config.get('SQLALCHEMY_READ_DATABASE_URI')
+        primary_uri = app.config['SQLALCHEMY_DATABASE_URI']
+
+        if replica_uri:
+            base_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+            options = {key: value for key, value in base_options.items() if key in SERVER_POOL_OPTIONS}
+            self.read_engine = create_engine(replica_uri, **options)
+            self.kind = 'replica'
+        elif (is_sqlite(primary_uri) and not is_memory_sqlite(primary_uri)
+              and app.config.get('SQLITE_READ_POOL', True)):
+            with app.app_context():
+                db_path = db.engine.url.database
+                with db.engine.connect() as conn:
+                    journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+            if str(journal_mode).lower() != 'wal':
+                logger.info("SQLite read pool disabled, the database is not in WAL mode")
+                return
+            self.read_engine = self._sqlite_read_engine(db_path, app.config)
+            self.kind = 'sqlite'
+        else:
+            return
+
+        app.after_request(self._pin_after_write)
+        restore_coordinator.add_listener(self.dispose)
+
+    def _sqlite_read_engine(self, db_path, config):
+        """Second pool on the same file, opened read-only so it can never take the write lock"""
+        busy_timeout = int(config.get('SQLITE_BUSY_TIMEOUT_MS', DEFAULT_BUSY_TIMEOUT_MS))
+        engine = create_engine(
+            f"sqlite:///file:{db_path}?mode=ro&uri=true",
+            poolclass=QueuePool,
+            pool_size=int(config.get('SQLITE_READ_POOL_SIZE', DEFAULT_READ_POOL_SIZE)),
+            max_overflow=int(config.get('SQLITE_MAX_OVERFLOW', 10)),
+            connect_args={'check_same_thread': False, 'timeout': busy_timeout / 1000},
+        )
+        pragmas = {name: value for name, value in sqlite_pragmas(config).items() if name not in WRITER_PRAGMAS}
+        pragmas['query_only'] = 1
+        install_sqlite_pragmas(engine, pragmas)
+        return engine
+
+    def dispose(self):
+        """Drop pooled read connections, e.g. after a restore replaced the database"""
+        if self.read_engine is not None:
+            self.read_engine.dispose()
+
+    def replica_lag(self):
+        """
+        Seconds the replica trails the primary, measured at most every LAG_CHECK_INTERVAL
+
+        Returns:
+            0 for the SQLite read pool, None if the replica cannot be reached
+        """
+        if self.kind != 'replica':
+            return 0.0
+        if time.monotonic() - self._lag_checked_at >= LAG_CHECK_INTERVAL:
+            with self._lock:
+                if time.monotonic() - self._lag_checked_at >= LAG_CHECK_INTERVAL:
+                    try:
+                        with self.read_engine.connect() as conn:
+                            lag = conn.execute(text(REPLICA_LAG_SQL)).scalar()
+                        self._lag = float(lag or 0)
+                    except Exception as e:
+                        logger.warning(f"Read replica unavailable, reading from the primary: {e}")
+                        self._lag = None
+                    self._lag_checked_at = time.monotonic()
+        return self._lag
+
+    def _pinned_to_primary(self):
+        if self.kind != 'replica' or not has_request_context():
+            return False
+        return flask_session.get(PIN_SESSION_KEY, 0) > time.time()
+
+    def should_read(self, session):
+        """True if the next query of this session may use the read engine"""
+        if self.read_engine is None or not has_app_context() or not g.get('db_read_only'):
+            return False
+        if session._flushing or session.info.get('wrote') or session.new or session.dirty or session.deleted:
+            return False
+        if self._pinned_to_primary():
+            return False
+        lag = self.replica_lag()
+        return lag is not None and lag <= self._max_lag
+
+    def _pin_after_write(self, response):
+        """Keep a user who just wrote on the primary until the replica has their change"""
+        if self.kind == 'replica' and g.get('db_wrote') and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            flask_session[PIN_SESSION_KEY] = time.time() + self._pin_seconds
+        return response
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that asks db_router where each query should go"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and db_router.should_read(self):
+            return db_router.read_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(session, flush_context):
+    session.info['wrote'] = True
+    if has_app_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+@event.listens_for(RoutingSession, 'after_rollback')
+def _clear_written(session):
+    session.info.pop('wrote', None)
+
+
+@contextmanager
+def read_only():
+    """Route the queries in this block to the read engine where it is safe to"""
+    previous = g.get('db_read_only', False)
+    g.db_read_only = True
+    try:
+        yield
+    finally:
+        g.db_read_only = previous
+
+
+def read_only_route(view):
+    """Decorator for views that only read; the template is rendered inside the block too"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with read_only():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+db_router = DatabaseRouter()
@@ -0,0 +1,275 @@
+"""
+Database Statistics Provider
+Cheap, cached SQLite statistics for the admin pages: approximate row counts
+from sqlite_stat1, per-table and per-index sizes from dbstat, and an
+optional exact recount, with the slow parts run in background threads
+"""
+
+import time
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+from .db_restore import restore_coordinator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+DEFAULT_ANALYSIS_LIMIT = 1000  # Rows ANALYZE samples per index when sqlite_stat1 is missing
+RECOUNT_PAUSE = 0.05  # Seconds between tables during an exact recount
+
+
+def _connect(db_path):
+    """Read-only connection; in WAL mode it never blocks writers"""
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _schema(conn):
+    """Tables (without SQLite's internal ones) mapped to their index names"""
+    tables = {}
+    indexes = []
+    for name, table, kind in conn.execute(
+        "SELECT name, tbl_name, type FROM sqlite_master WHERE type IN ('table', 'index') ORDER BY name"
+    ):
+        if kind == 'table' and not name.startswith('sqlite_'):
+            tables[name] = []
+        elif kind == 'index':
+            indexes.append((name, table))
+    for name, table in indexes:
+        if table in tables:
+            tables[table].append(name)
+    return tables
+
+
+def _stat1_counts(conn):
+    """Row counts recorded by the last ANALYZE, per table"""
+    try:
+        rows = conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1").fetchall()
+    except sqlite3.OperationalError:
+        return {}  # ANALYZE has never run
+    counts = {}
+    for table, index, stat in rows:
+        try:
+            count = int(str(stat).split()[0])
+        except (ValueError, IndexError):
+            continue
+        # The first stat number of any index is the row count of its table
+        counts[table] = max(counts.get(table, 0), count)
+    return counts
+
+
+def _rowid_estimate(conn, table):
+    """max(rowid) is one b-tree descent; an upper bound when rows were deleted"""
+    try:
+        return conn.execute(f"SELECT max(rowid) FROM {_quote(table)}").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return None  # WITHOUT ROWID table
+
+
+class DatabaseStats:
+    """
+    Per-process cache of database statistics
+
+    get() answers from the cache while it is younger than the TTL. When it
+    has expired, row counts are re-read from sqlite_stat1 (a few hundred
+    bytes) and the previous sizes are shown while a background thread
+    re-reads them from dbstat, so the page never waits on a table scan.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._sizes = {}
+        self._exact = {}
+        self._analyzed = set()
+        self._running = set()
+
+    def get(self, db_path, ttl=DEFAULT_TTL, analysis_limit=DEFAULT_ANALYSIS_LIMIT):
+        """
+        Statistics for an SQLite database file
+
+        Returns:
+            Dictionary with tables (name to row count), table_details (rows,
+            rows_source, size, index_size and indexes per table), totals and
+            page information, sizes_at, exact_at and the running job flags
+        """
+        with self._lock:
+            cached = self._cache.get(db_path)
+        if cached is None or time.time() - cached['computed_at'] >= ttl:
+            cached = self._quick_stats(db_path)
+            with self._lock:
+                self._cache[db_path] = cached
+            self._start('sizes', db_path, self._refresh_sizes, analysis_limit)
+        return self._view(db_path, cached)
+
+    def start_recount(self, db_path):
+        """
+        Count every table exactly in the background
+
+        Returns:
+            False if a recount of this database is already running
+        """
+        return self._start('recount', db_path, self._recount)
+
+    def invalidate(self, db_path=None):
+        """Forget cached statistics, e.g. after a restore replaced the file"""
+        with self._lock:
+            if db_path is None:
+                for store in (self._cache, self._sizes, self._exact, self._analyzed):
+                    store.clear()
+                return
+            for store in (self._cache, self._sizes, self._exact):
+                store.pop(db_path, None)
+            self._analyzed.discard(db_path)
+
+    def _start(self, kind, db_path, target, *args):
+        with self._lock:
+            if (kind, db_path) in self._running:
+                return False
+            self._running.add((kind, db_path))
+        threading.Thread(target=self._run, args=(kind, db_path, target) + args,
+                         name=f"db-stats-{kind}", daemon=True).start()
+        return True
+
+    def _run(self, kind, db_path, target, *args):
+        try:
+            target(db_path, *args)
+        except Exception as e:
+            logger.error(f"Database statistics {kind} failed: {e}")
+        finally:
+            with self._lock:
+                self._running.discard((kind, db_path))
+
+    def _quick_stats(self, db_path):
+        conn = _connect(db_path)
+        try:
+            tables = _schema(conn)
+            analyzed = _stat1_counts(conn)
+            counts = {}
+            for table in tables:
+                if table in analyzed:
+                    counts[table] = (analyzed[table], 'analyze')
+                else:
+                    counts[table] = (_rowid_estimate(conn, table), 'rowid')
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'schema': tables,
+            'counts': counts,
+            'page_count': page_count,
+            'page_size': page_size,
+            'freelist_size': freelist_count * page_size,
+            'computed_at': time.time(),
+        }
+
+    def _refresh_sizes(self, db_path, analysis_limit):
+        with self._lock:
+            counts = self._cache.get(db_path, {}).get('counts', {})
+            # Empty tables never get a sqlite_stat1 row, so only try once
+            analyze = db_path not in self._analyzed
+            self._analyzed.add(db_path)
+        if analysis_limit and analyze and any(source == 'rowid' for _, source in counts.values()):
+            self._sampled_analyze(db_path, analysis_limit)
+
+        conn = _connect(db_path)
+        try:
+            try:
+                rows = conn.execute("SELECT name, pgsize FROM dbstat WHERE aggregate = TRUE").fetchall()
+            except sqlite3.OperationalError:
+                # SQLite before 3.31 has no aggregate column
+                rows = conn.execute("SELECT name, sum(pgsize) FROM dbstat GROUP BY name").fetchall()
+        except sqlite3.OperationalError as e:
+            logger.info(f"dbstat unavailable, object sizes not shown: {e}")
+            rows = []
+        finally:
+            conn.close()
+        with self._lock:
+            self._sizes[db_path] = {'sizes': dict(rows), 'at': time.time()}
+
+    def _sampled_analyze(self, db_path, analysis_limit):
+        """
+        ANALYZE with a sample limit, so sqlite_stat1 covers new tables
+
+        Bounded by analysis_limit rows per index, so the write lock it takes
+        is short; the counts it records are estimates. Skipped while a
+        restore holds writes, and tried again on a later refresh.
+        """
+        if restore_coordinator.sync():
+            with self._lock:
+                self._analyzed.discard(db_path)
+            return
+        conn = sqlite3.connect(db_path, timeout=5)
+        try:
+            conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+            conn.execute("ANALYZE")
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            logger.info(f"Sampled ANALYZE skipped: {e}")
+        finally:
+            conn.close()
+        with self._lock:
+            # Counts are re-read from sqlite_stat1 on the next get()
+            self._cache.pop(db_path, None)
+
+    def _recount(self, db_path):
+        counts = {}
+        conn = _connect(db_path)
+        try:
+            for table in _schema(conn):
+                counts[table] = conn.execute(f"SELECT count(*) FROM {_quote(table)}").fetchone()[0]
+                time.sleep(RECOUNT_PAUSE)
+        finally:
+            conn.close()
+        with self._lock:
+            self._exact[db_path] = {'counts': counts, 'at': time.time()}
+
+    def _view(self, db_path, cached):
+        with self._lock:
+            sizes = self._sizes.get(db_path)
+            exact = self._exact.get(db_path)
+            sizes_running = ('sizes', db_path) in self._running
+            recount_running = ('recount', db_path) in self._running
+        object_sizes = sizes['sizes'] if sizes else {}
+
+        details = []
+        for table, index_names in cached['schema'].items():
+            rows, source = cached['counts'].get(table, (None, None))
+            if exact and table in exact['counts']:
+                rows, source = exact['counts'][table], 'exact'
+            indexes = [{'name': name, 'size': object_sizes.get(name)} for name in index_names]
+            details.append({
+                'name': table,
+                'rows': rows,
+                'rows_source': source,
+                'size': object_sizes.get(table),
+                'index_size': sum(index['size'] or 0 for index in indexes) if sizes else None,
+                'indexes': indexes,
+            })
+
+        return {
+            'tables': {detail['name']: detail['rows'] for detail in details},
+            'table_details': details,
+            'total_tables': len(details),
+            'total_rows': sum(detail['rows'] or 0 for detail in details),
+            'approximate': any(detail['rows_source'] != 'exact' for detail in details),
+            'page_count': cached['page_count'],
+            'page_size': cached['page_size'],
+            'calculated_size': cached['page_count'] * cached['page_size'],
+            'freelist_size': cached['freelist_size'],
+            'computed_at': datetime.fromtimestamp(cached['computed_at']),
+            'sizes_at': datetime.fromtimestamp(sizes['at']) if sizes else None,
+            'exact_at': datetime.fromtimestamp(exact['at']) if exact else None,
+            'sizes_running': sizes_running,
+            'recount_running': recount_running,
+        }
+
+
+database_stats = DatabaseStats()
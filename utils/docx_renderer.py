@@ -0,0 +1,304 @@
+"""
+DOCX Pre-Renderer
+Converts DOCX materials to sanitized, paginated HTML once so phones read a
+few kilobytes of markup instead of unzipping and laying out the document
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+from html import escape
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urlparse
+
+from .image_pipeline import get_executor
+
+try:
+    import mammoth
+    MAMMOTH_AVAILABLE = True
+except ImportError:
+    MAMMOTH_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+PAGES_SUFFIX = '.pages'
+FAILED_MARKER = 'render-failed.json'  # Left in the pages directory when a render fails
+PAGE_TEXT_CHARS = 4000  # Roughly two printed pages of text per HTML page
+IMAGE_WEIGHT = 800  # Text characters an image counts for when paginating
+
+ALLOWED_TAGS = {
+    'p', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'b', 'em', 'i', 'u', 's',
+    'sub', 'sup', 'ul', 'ol', 'li', 'table', 'thead', 'tbody', 'tr', 'th', 'td',
+    'a', 'img', 'blockquote', 'pre', 'code', 'hr', 'span'
+}
+VOID_TAGS = {'br', 'img', 'hr'}
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+ALLOWED_ATTRS = {
+    'a': {'href', 'id'},
+    'img': {'src', 'alt'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+    'ol': {'start'},
+}
+SAFE_URL_SCHEMES = {'http', 'https', 'mailto'}
+
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def pages_dir_for(file_path):
+    """Directory holding the rendered pages, beside the DOCX and named after its stem"""
+    return f"{os.path.splitext(file_path)[0]}{PAGES_SUFFIX}"
+
+
+class _Sanitizer(HTMLParser):
+    """
+    Re-emit only allowlisted tags/attributes and split output into top-level blocks
+
+    Image sources must point inside the pages directory; links may only use
+    http(s)/mailto or in-document anchors.
+    """
+
+    def __init__(self, image_prefix):
+        super().__init__(convert_charrefs=True)
+        self.image_prefix = image_prefix
+        self.blocks = []  # (html, weight) per top-level element
+        self._parts = []
+        self._weight = 0
+        self._stack = []
+        self._dropping = 0
+
+    def _safe_url(self, tag, value):
+        if tag == 'img':
+            return value if value.startswith(self.image_prefix) and '..' not in value else None
+        if value.startswith('#'):
+            return value
+        return value if urlparse(value).scheme.lower() in SAFE_URL_SCHEMES else None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self._dropping += 1
+            return
+        if self._dropping or tag not in ALLOWED_TAGS:
+            return
+        rendered = []
+        for name, value in attrs:
+            if name not in ALLOWED_ATTRS.get(tag, ()) or value is None:
+                continue
+            if name in ('href', 'src'):
+                value = self._safe_url(tag, value)
+                if value is None:
+                    continue
+            rendered.append(f' {name}="{escape(value, quote=True)}"')
+        if tag == 'img':
+            if not any(part.startswith(' src=') for part in rendered):
+                return
+            rendered.append(' loading="lazy"')
+            self._weight += IMAGE_WEIGHT
+        if tag == 'a' and any(part.startswith(' href="http') for part in rendered):
+            rendered.append(' rel="noopener nofollow" target="_blank"')
+        self._parts.append(f"<{tag}{''.join(rendered)}>")
+        if tag in VOID_TAGS:
+            self._end_block_if_top_level()
+        else:
+            self._stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self._dropping = max(0, self._dropping - 1)
+            return
+        if self._dropping or tag not in ALLOWED_TAGS or tag in VOID_TAGS or tag not in self._stack:
+            return
+        while self._stack:
+            open_tag = self._stack.pop()
+            self._parts.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+        self._end_block_if_top_level()
+
+    def handle_data(self, data):
+        if self._dropping:
+            return
+        self._parts.append(escape(data, quote=False))
+        self._weight += len(data)
+        self._end_block_if_top_level()
+
+    def _end_block_if_top_level(self):
+        if not self._stack and self._parts:
+            self.blocks.append((''.join(self._parts), self._weight))
+            self._parts = []
+            self._weight = 0
+
+    def close(self):
+        super().close()
+        while self._stack:
+            self._parts.append(f"</{self._stack.pop()}>")
+        self._end_block_if_top_level()
+
+
+def sanitize_and_paginate(html, image_prefix, page_chars=PAGE_TEXT_CHARS):
+    """
+    Sanitize converter output and group its top-level blocks into pages
+
+    Args:
+        html: HTML produced by the DOCX converter
+        image_prefix: URL prefix every allowed image source must start with
+        page_chars: Approximate text characters per page
+
+    Returns:
+        List of page HTML strings (at least one)
+    """
+    sanitizer = _Sanitizer(image_prefix)
+    sanitizer.feed(html)
+    sanitizer.close()
+
+    pages, current, weight = [], [], 0
+    for block, block_weight in sanitizer.blocks:
+        if current and weight + block_weight > page_chars:
+            pages.append(''.join(current))
+            current, weight = [], 0
+        current.append(block)
+        weight += block_weight
+    if current or not pages:
+        pages.append(''.join(current))
+    return pages
+
+
+def render_docx(source_path, output_dir, url_prefix, page_chars=PAGE_TEXT_CHARS):
+    """
+    Convert a DOCX file to paginated HTML pages plus extracted images
+
+    Output is built in a temporary sibling directory and swapped into place,
+    so readers never see a half-written page set.
+
+    Args:
+        source_path: Absolute path to the DOCX file
+        output_dir: Absolute path of the pages directory to (re)create
+        url_prefix: Public URL of output_dir, used for image sources
+        page_chars: Approximate text characters per page
+
+    Returns:
+        Dictionary with 'pages' and 'images' counts
+    """
+    output_dir = Path(output_dir)
+    build_dir = output_dir.with_name(f"{output_dir.name}.{os.getpid()}.tmp")
+    if build_dir.exists():
+        shutil.rmtree(build_dir)
+    build_dir.mkdir(parents=True)
+    url_prefix = url_prefix.rstrip('/') + '/'
+    image_count = 0
+
+    def _save_image(image):
+        nonlocal image_count
+        image_count += 1
+        ext = {'image/png': '.png', 'image/jpeg': '.jpg', 'image/gif': '.gif'}.get(image.content_type)
+        if not ext:
+            return {}  # EMF/WMF and friends cannot be shown by browsers
+        name = f"img-{image_count}{ext}"
+        with image.open() as src, open(build_dir / name, 'wb') as out:
+            shutil.copyfileobj(src, out)
+        return {'src': f"{url_prefix}{name}"}
+
+    try:
+        with open(source_path, 'rb') as f:
+            result = mammoth.convert_to_html(f, convert_image=mammoth.images.img_element(_save_image))
+        pages = sanitize_and_paginate(result.value, url_prefix, page_chars)
+        for number, page_html in enumerate(pages, start=1):
+            (build_dir / f"page-{number}.html").write_text(page_html, encoding='utf-8')
+        if output_dir.exists():
+            shutil.rmtree(output_dir)
+        os.replace(build_dir, output_dir)
+    except Exception as e:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        _record_failure(source_path, output_dir, e)
+        raise
+    return {'pages': len(pages), 'images': image_count}
+
+
+def _source_stamp(source_path):
+    try:
+        stat = os.stat(source_path)
+    except OSError:
+        return {}
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _record_failure(source_path, output_dir, error):
+    """Write the failure marker, stamped with the DOCX it was rendered from"""
+    try:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        marker = {'error': str(error)[:500], 'source': _source_stamp(source_path)}
+        (output_dir / FAILED_MARKER).write_text(json.dumps(marker), encoding='utf-8')
+    except OSError as e:
+        logger.warning(f"Could not record DOCX render failure for {source_path}: {e}")
+
+
+def render_failed(static_folder, file_path):
+    """
+    True if the last render of a DOCX failed and the file has not changed since
+
+    A successful render replaces the pages directory, which clears the
+    marker; a DOCX replaced in place gets another attempt.
+    """
+    marker_path = os.path.join(static_folder, pages_dir_for(file_path), FAILED_MARKER)
+    try:
+        with open(marker_path, encoding='utf-8') as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return marker.get('source') == _source_stamp(os.path.join(static_folder, file_path))
+
+
+def get_docx_pages(static_folder, file_path):
+    """Static-relative paths of the rendered pages of a DOCX, in order (empty if not rendered)"""
+    pages_dir = pages_dir_for(file_path)
+    try:
+        names = [entry.name for entry in os.scandir(os.path.join(static_folder, pages_dir))
+                 if entry.name.startswith('page-') and entry.name.endswith('.html')]
+    except FileNotFoundError:
+        return []
+    names.sort(key=lambda name: int(name[len('page-'):-len('.html')]))
+    return [f"{pages_dir}/{name}" for name in names]
+
+
+def enqueue_docx_job(source_path, url_prefix, max_workers=2):
+    """
+    Queue background rendering for a DOCX file, ignoring duplicates already queued
+
+    Args:
+        source_path: Path to the DOCX file
+        url_prefix: Public URL of the pages directory
+        max_workers: Pool size, 0 renders synchronously
+
+    Returns:
+        Future for the job (None when rendered synchronously or skipped)
+    """
+    if not MAMMOTH_AVAILABLE:
+        return None
+    source_path = os.path.abspath(source_path)
+    output_dir = pages_dir_for(source_path)
+
+    if max_workers <= 0:
+        render_docx(source_path, output_dir, url_prefix)
+        return None
+
+    with _in_flight_lock:
+        if source_path in _in_flight:
+            return None
+        _in_flight.add(source_path)
+
+    def _on_done(future):
+        with _in_flight_lock:
+            _in_flight.discard(source_path)
+        try:
+            result = future.result()
+            logger.info(f"Rendered DOCX {source_path}: {result['pages']} pages")
+        except Exception as e:
+            logger.error(f"DOCX render failed for {source_path}: {e}")
+
+    future = get_executor(max_workers).submit(render_docx, source_path, output_dir, url_prefix)
+    future.add_done_callback(_on_done)
+    return future
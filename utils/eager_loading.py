@@ -0,0 +1,120 @@
+"""
+Eager Loading Policies
+Loader options declared per view, so listing pages load the relationships
+their templates use up front, and a development-mode detector for lazy
+loads that still fire while a template renders (the N+1 pattern)
+"""
+
+import logging
+
+from flask import g, request, has_app_context, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import Material, DownloadRecord, Subscription, HelpRequest, News
+from .db_routing import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+DETECTION_MODES = ('off', 'log', 'raise')
+
+# Endpoint -> model -> loader options for that model's queries in the view.
+# Many-to-one relationships are joined into the row; selectinload (one
+# extra SELECT ... IN) is used where many rows share few targets.
+LOADER_POLICIES = {
+    'dashboard': {
+        DownloadRecord: lambda: (joinedload(DownloadRecord.material).joinedload(Material.category),),
+    },
+    'index': {
+        Material: lambda: (joinedload(Material.category),),
+    },
+    'search': {
+        Material: lambda: (joinedload(Material.category),),
+    },
+    'news': {
+        News: lambda: (joinedload(News.author),),
+    },
+    'admin_materials': {
+        Material: lambda: (joinedload(Material.category),),
+    },
+    'admin_news': {
+        News: lambda: (joinedload(News.author),),
+    },
+    'admin_subscriptions': {
+        Subscription: lambda: (joinedload(Subscription.user), joinedload(Subscription.plan)),
+    },
+    'admin_help_requests': {
+        HelpRequest: lambda: (selectinload(HelpRequest.user),),
+    },
+    'admin_dashboard': {
+        Material: lambda: (joinedload(Material.category),),
+        Subscription: lambda: (joinedload(Subscription.user),),
+    },
+}
+
+
+def eager(model, endpoint=None):
+    """
+    Loader options the view's policy declares for a model
+
+    Args:
+        model: Model class being queried
+        endpoint: View name, the current request's endpoint by default
+
+    Returns:
+        Tuple of loader options for Query.options(), empty if none are declared
+    """
+    if endpoint is None:
+        endpoint = request.endpoint if has_request_context() else None
+    factory = LOADER_POLICIES.get(endpoint, {}).get(model)
+    return factory() if factory else ()
+
+
+class LazyLoadInTemplate(RuntimeError):
+    """A relationship was lazy loaded while a template rendered"""
+
+
+def _start_render(sender, template, context, **extra):
+    g.rendering_templates = g.get('rendering_templates', []) + [template.name]
+
+
+def _end_render(sender, template, context, **extra):
+    rendering = g.get('rendering_templates') or []
+    g.rendering_templates = rendering[:-1]
+
+
+def init_lazy_load_detection(app):
+    """
+    Report lazy loads that run SQL during template rendering
+
+    LAZY_LOAD_DETECTION is 'log' (a warning naming the template, view and
+    relationship), 'raise' (LazyLoadInTemplate, for tests) or 'off'.
+    Relationships served from the identity map run no SQL and are not
+    reported, nor are lazy='dynamic' relationships, which are explicit
+    queries.
+    """
+    mode = str(app.config.get('LAZY_LOAD_DETECTION', 'off')).lower()
+    if mode not in DETECTION_MODES:
+        logger.warning(f"Unknown LAZY_LOAD_DETECTION {mode!r}, detection is off")
+        return
+    if mode == 'off':
+        return
+    before_render_template.connect(_start_render, app)
+    template_rendered.connect(_end_render, app)
+
+    @event.listens_for(RoutingSession, 'do_orm_execute')
+    def _detect_lazy_load(orm_execute_state):
+        if not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None or not has_app_context():
+            return
+        rendering = g.get('rendering_templates')
+        if not rendering:
+            return
+        path = orm_execute_state.loader_strategy_path
+        relationship = path[-1] if path else None
+        message = (f"Lazy load of {relationship} while rendering {rendering[-1]} "
+                   f"(view {request.endpoint if has_request_context() else None}); "
+                   f"declare it in utils.eager_loading.LOADER_POLICIES")
+        g.lazy_loads = g.get('lazy_loads', 0) + 1
+        if mode == 'raise':
+            raise LazyLoadInTemplate(message)
+        logger.warning(message)
@@ -0,0 +1,126 @@
+"""
+Material Engagement Counters
+download_count, view_count and purchase_count kept on each Material:
+incremented in the transaction that records the event, and reconciled
+against the event tables by a nightly job
+"""
+
+from sqlalchemy import func, update
+
+from models import db, Material, DownloadRecord, LimitedAccessDownload, MaterialView, MpesaTransaction
+
+COUNTERS = ('download_count', 'view_count', 'purchase_count')
+
+# Catalog orderings selectable with ?sort=
+SORT_OPTIONS = {
+    'newest': 'Newest',
+    'popular': 'Most downloaded',
+    'viewed': 'Most viewed',
+}
+
+
+def record_engagement(material_id, **increments):
+    """
+    Add to a material's counters in the current session transaction
+
+    The UPDATE runs in the same transaction as the event row the caller
+    added, so both are committed (or rolled back) together, and
+    `counter = counter + n` never loses a concurrent increment.
+
+    Args:
+        material_id: Material the event belongs to
+        increments: Counter names mapped to the amount to add, e.g.
+            download_count=1
+    """
+    values = {getattr(Material, name): getattr(Material, name) + amount
+              for name, amount in increments.items() if name in COUNTERS and amount}
+    if material_id and values:
+        # Counting an event is not an edit, so keep updated_at (and the sitemap lastmod)
+        values[Material.updated_at] = Material.updated_at
+        db.session.execute(
+            update(Material).where(Material.id == material_id).values(values),
+            execution_options={'synchronize_session': False}
+        )
+
+
+def catalog_order(sort):
+    """ORDER BY clauses for a SORT_OPTIONS key, newest first for unknown keys"""
+    if sort == 'popular':
+        return (Material.download_count.desc(), Material.created_at.desc())
+    if sort == 'viewed':
+        return (Material.view_count.desc(), Material.created_at.desc())
+    return (Material.created_at.desc(),)
+
+
+def expected_counts(conn):
+    """
+    Counters recomputed from the event tables, one grouped scan per table
+
+    Downloads are DownloadRecord plus LimitedAccessDownload rows (the same
+    definition the top users ranking uses), views are the summed
+    MaterialView counts, purchases are completed M-Pesa material payments.
+
+    Returns:
+        Dictionary of material id to {counter: value} for materials with events
+    """
+    counts = {}
+
+    def add(counter, query):
+        for material_id, value in conn.execute(query):
+            if material_id is not None:
+                entry = counts.setdefault(material_id, dict.fromkeys(COUNTERS, 0))
+                entry[counter] += int(value or 0)
+
+    add('download_count', db.select(DownloadRecord.material_id, func.count())
+        .group_by(DownloadRecord.material_id))
+    add('download_count', db.select(LimitedAccessDownload.material_id, func.count())
+        .group_by(LimitedAccessDownload.material_id))
+    add('view_count', db.select(MaterialView.material_id, func.sum(MaterialView.view_count))
+        .group_by(MaterialView.material_id))
+    add('purchase_count', db.select(MpesaTransaction.material_id, func.count())
+        .where(MpesaTransaction.status == 'completed', MpesaTransaction.material_id.isnot(None))
+        .group_by(MpesaTransaction.material_id))
+    return counts
+
+
+def reconcile_counters(dry_run=False):
+    """
+    Correct counters that drifted from the event tables
+
+    Counters are read before the event tables, and each correction is only
+    applied if the counter still holds the value that was read. An event
+    recorded in between bumped the counter in its own transaction, so the
+    guard fails and that material is left for the next run instead of
+    being overwritten.
+
+    Args:
+        dry_run: Report the drift without writing
+
+    Returns:
+        Dictionary with checked, corrected and skipped counts and drift, a
+        list of (material_id, counter, stored, expected)
+    """
+    with db.engine.connect() as conn:
+        stored = conn.execute(db.select(Material.id, *(getattr(Material, name) for name in COUNTERS))).fetchall()
+        expected = expected_counts(conn)
+
+    drift = []
+    for row in stored:
+        target = expected.get(row[0], dict.fromkeys(COUNTERS, 0))
+        for index, name in enumerate(COUNTERS, start=1):
+            if (row[index] or 0) != target[name]:
+                drift.append((row[0], name, row[index], target[name]))
+
+    result = {'checked': len(stored), 'corrected': 0, 'skipped': 0, 'drift': drift}
+    if dry_run or not drift:
+        return result
+    with db.engine.begin() as conn:
+        for material_id, name, stored_value, expected_value in drift:
+            column = getattr(Material, name)
+            guard = column.is_(None) if stored_value is None else column == stored_value
+            updated = conn.execute(
+                update(Material).where(Material.id == material_id, guard)
+                .values({column: expected_value, Material.updated_at: Material.updated_at})
+            ).rowcount
+            result['corrected' if updated else 'skipped'] += 1
+    return result
@@ -4,6 +4,7 @@ Converts images to WebP format with high quality settings for clean, crisp image
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageEnhance, ImageFilter
 from pathlib import Path
 import logging
@@ -32,6 +33,58 @@ RESPONSIVE_SIZES = {
 }
 
 
+def _prepare_mode(img, format, preserve_transparency=True):
+    """Convert an image to a colour mode the output format can store"""
+    # Convert RGBA to RGB if saving as JPEG
+    if format.lower() == 'jpeg' and img.mode in ('RGBA', 'LA', 'P'):
+        # Create white background for transparency
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+        img = background
+    
+    # Ensure RGB mode for WebP
+    if format.lower() in ('webp', 'avif') and img.mode not in ('RGB', 'RGBA'):
+        if img.mode == 'P' and preserve_transparency:
+            img = img.convert('RGBA')
+        else:
+            img = img.convert('RGB')
+    return img
+
+
+def _save_kwargs(format, quality, mode, preserve_transparency=True):
+    """Encoder settings for each output format"""
+    save_kwargs = {
+        'optimize': True,
+        'quality': quality
+    }
+    
+    if format.lower() == 'webp':
+        # HD Quality WebP settings
+        save_kwargs.update({
+            'method': 6,  # Best compression method (slower but best quality for HD)
+            'lossless': False,  # Use lossy for smaller files
+            'quality': quality,  # HD quality (92 default)
+            'exact': False  # Allow color space conversion for better quality
+        })
+        if mode == 'RGBA' and preserve_transparency:
+            save_kwargs['lossless'] = False  # Still use lossy but preserve alpha
+            save_kwargs['exact'] = True  # Preserve exact colors for transparency
+    elif format.lower() == 'jpeg':
+        save_kwargs.update({
+            'quality': quality,
+            'progressive': True,  # Progressive JPEG for better loading
+            'optimize': True
+        })
+    elif format.lower() == 'png':
+        save_kwargs.update({
+            'compress_level': PNG_COMPRESSION,
+            'optimize': True
+        })
+    return save_kwargs
+
+
 def optimize_image(input_path, output_path=None, format='webp', quality=WEBP_QUALITY, 
                   max_size=None, sharpen=False, preserve_transparency=True, maintain_hd=True):
     """
@@ -53,21 +106,7 @@ def optimize_image(input_path, output_path=None, format='webp', quality=WEBP_QUA
     try:
         # Open image
         with Image.open(input_path) as img:
-            # Convert RGBA to RGB if saving as JPEG
-            if format.lower() == 'jpeg' and img.mode in ('RGBA', 'LA', 'P'):
-                # Create white background for transparency
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            
-            # Ensure RGB mode for WebP
-            if format.lower() == 'webp' and img.mode not in ('RGB', 'RGBA'):
-                if img.mode == 'P' and preserve_transparency:
-                    img = img.convert('RGBA')
-                else:
-                    img = img.convert('RGB')
+            img = _prepare_mode(img, format, preserve_transparency)
             
             # Resize if max_size specified (maintain aspect ratio)
             if max_size:
@@ -103,37 +142,9 @@ def optimize_image(input_path, output_path=None, format='webp', quality=WEBP_QUA
                 base_path = Path(input_path)
                 output_path = base_path.parent / f"{base_path.stem}.{format.lower()}"
             
-            # Save with high quality settings
-            save_kwargs = {
-                'optimize': True,
-                'quality': quality
-            }
-            
-            if format.lower() == 'webp':
-                # HD Quality WebP settings
-                save_kwargs.update({
-                    'method': 6,  # Best compression method (slower but best quality for HD)
-                    'lossless': False,  # Use lossy for smaller files
-                    'quality': quality,  # HD quality (92 default)
-                    'exact': False  # Allow color space conversion for better quality
-                })
-                if img.mode == 'RGBA' and preserve_transparency:
-                    save_kwargs['lossless'] = False  # Still use lossy but preserve alpha
-                    save_kwargs['exact'] = True  # Preserve exact colors for transparency
-            elif format.lower() == 'jpeg':
-                save_kwargs.update({
-                    'quality': quality,
-                    'progressive': True,  # Progressive JPEG for better loading
-                    'optimize': True
-                })
-            elif format.lower() == 'png':
-                save_kwargs.update({
-                    'compress_level': PNG_COMPRESSION,
-                    'optimize': True
-                })
-            
-            # Save optimized image
-            img.save(output_path, format=format.upper(), **save_kwargs)
+            # Save optimized image with high quality settings
+            img.save(output_path, format=format.upper(),
+                     **_save_kwargs(format, quality, img.mode, preserve_transparency))
             
             logger.info(f"Optimized image: {input_path} -> {output_path} ({format.upper()}, quality: {quality})")
             return str(output_path)
@@ -143,14 +154,37 @@ def optimize_image(input_path, output_path=None, format='webp', quality=WEBP_QUA
         raise
 
 
-def generate_responsive_images(input_path, output_dir=None, base_name=None):
+def _fit_size(source_size, max_size):
+    """Size of source_size scaled down (never up) to fit inside max_size"""
+    width, height = source_size
+    scale = min(max_size[0] / width, max_size[1] / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale)), scale
+
+
+def _sharpen(img):
+    """HD sharpening, applied after downscaling so it runs on the small image"""
+    img = img.filter(ImageFilter.UnsharpMask(radius=1.5, percent=130, threshold=3))
+    return ImageEnhance.Sharpness(img).enhance(1.08)
+
+
+def generate_responsive_images(input_path, output_dir=None, base_name=None, format='webp',
+                               quality=WEBP_QUALITY, workers=None):
     """
-    Generate responsive image sizes in WebP format
+    Generate responsive image sizes from a single decode of the source
+    
+    JPEG sources are decoded with draft() at the smallest scale that still
+    covers the largest output. Sizes are then produced largest to smallest,
+    each resized from the previous output, sharpened after downscaling and
+    encoded in parallel threads (Pillow releases the GIL while encoding).
+    Sizes the source already fits share one full-resolution file.
     
     Args:
         input_path: Path to source image
         output_dir: Output directory (optional)
         base_name: Base name for output files (optional)
+        format: Output format ('webp', 'avif', 'jpeg')
+        quality: Encoder quality
+        workers: Encoder threads (default: CPU count)
     
     Returns:
         Dictionary of size names to file paths
@@ -167,35 +201,53 @@ def generate_responsive_images(input_path, output_dir=None, base_name=None):
         if base_name is None:
             base_name = source_path.stem
         
+        extension = 'jpg' if format.lower() == 'jpeg' else format.lower()
+        
+        with Image.open(input_path) as img:
+            targets = sorted(
+                ((size_name, _fit_size(img.size, max_size)) for size_name, max_size in RESPONSIVE_SIZES.items()),
+                key=lambda item: item[1][2],
+                reverse=True
+            )
+            largest = targets[0][1]
+            if img.format == 'JPEG' and largest[2] < 1.0:
+                # Shrink-on-load: libjpeg decodes at 1/2, 1/4 or 1/8 scale directly
+                img.draft(img.mode, largest[:2])
+            img.load()
+            current = _prepare_mode(img, format)
+            if current is img:
+                # Keep the pixels usable after the source file is closed
+                current = img.copy()
+        
+        # Every fit keeps the source aspect ratio, so each target is no larger
+        # than the one before it and can be resized from it
         responsive_images = {}
+        encode_jobs = []
+        full_size_path = None
+        for size_name, (width, height, scale) in targets:
+            if scale >= 1.0:
+                if full_size_path is None:
+                    full_size_path = output_dir / f"{base_name}_{size_name}.{extension}"
+                    encode_jobs.append((full_size_path, current, False))
+                responsive_images[size_name] = str(full_size_path)
+                continue
+            if current.size != (width, height):
+                current = current.resize((width, height), Image.Resampling.LANCZOS)
+            output_path = output_dir / f"{base_name}_{size_name}.{extension}"
+            encode_jobs.append((output_path, current, True))
+            responsive_images[size_name] = str(output_path)
         
-        # Generate each size
-        for size_name, max_size in RESPONSIVE_SIZES.items():
-            output_path = output_dir / f"{base_name}_{size_name}.webp"
-            
-            # Only resize if source is larger than target
-            with Image.open(input_path) as img:
-                if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-                    optimize_image(
-                        input_path,
-                        output_path,
-                        format='webp',
-                        quality=WEBP_QUALITY,
-                        max_size=max_size,
-                        sharpen=True  # Sharpen resized images
-                    )
-                    responsive_images[size_name] = str(output_path)
-                else:
-                    # Use original if smaller than target
-                    optimize_image(
-                        input_path,
-                        output_path,
-                        format='webp',
-                        quality=WEBP_QUALITY,
-                        sharpen=False  # No need to sharpen if not resizing
-                    )
-                    responsive_images[size_name] = str(output_path)
+        def _encode(job):
+            output_path, image, sharpen = job
+            if sharpen:
+                image = _sharpen(image)
+            image.save(output_path, format=format.upper(),
+                       **_save_kwargs(format, quality, image.mode))
+        
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            list(pool.map(_encode, encode_jobs))
         
+        logger.info(f"Generated {len(encode_jobs)} responsive {format.upper()} images for {input_path}")
         return responsive_images
         
     except Exception as e:
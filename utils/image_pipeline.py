@@ -0,0 +1,192 @@
+"""
+Image Processing Pipeline
+Generates WebP/AVIF responsive variants for uploaded images in a background
+worker pool and records them in a variants manifest
+"""
+
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from PIL import Image
+
+from .image_optimizer import (
+    convert_to_webp,
+    generate_responsive_images
+)
+from .variant_index import get_manifest_path, read_manifest, variant_index
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+try:
+    import pillow_avif  # noqa: F401 - registers the AVIF plugin with Pillow
+    AVIF_AVAILABLE = True
+except ImportError:
+    AVIF_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+AVIF_QUALITY = 60  # AVIF reaches WebP-92 visual quality at much lower settings
+VARIANTS_DIRNAME = 'responsive'
+
+_executor = None
+_executor_lock = threading.Lock()
+_manifest_lock = threading.Lock()
+
+
+def _image_dimensions(path):
+    """Read width/height from the image header without decoding pixels"""
+    with Image.open(path) as img:
+        return img.size
+
+
+def process_image(source_path, formats=('webp',)):
+    """
+    Produce the full-size WebP plus every RESPONSIVE_SIZES variant for an image
+
+    Runs inside a worker process, so it only deals with plain paths and
+    returns plain data that can be pickled back to the web process.
+
+    Args:
+        source_path: Absolute path to the uploaded original
+        formats: Output formats ('webp' and optionally 'avif')
+
+    Returns:
+        Dictionary of format -> size name -> {'path', 'width', 'height'}
+    """
+    source = Path(source_path)
+    variants_dir = source.parent / VARIANTS_DIRNAME
+    variants_dir.mkdir(parents=True, exist_ok=True)
+    result = {}
+
+    if 'webp' in formats:
+        webp_path = convert_to_webp(str(source), str(source.parent / f"{source.stem}.webp"))
+        width, height = _image_dimensions(webp_path)
+        result['webp'] = {'original': {'path': webp_path, 'width': width, 'height': height}}
+        for size_name, path in generate_responsive_images(str(source), variants_dir).items():
+            width, height = _image_dimensions(path)
+            result['webp'][size_name] = {'path': path, 'width': width, 'height': height}
+
+    if 'avif' in formats and AVIF_AVAILABLE:
+        result['avif'] = {}
+        avif_images = generate_responsive_images(str(source), variants_dir, format='avif', quality=AVIF_QUALITY)
+        for size_name, path in avif_images.items():
+            width, height = _image_dimensions(path)
+            result['avif'][size_name] = {'path': path, 'width': width, 'height': height}
+
+    return result
+
+
+def get_executor(max_workers=2):
+    """Lazily create the shared worker pool, falling back to threads"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            try:
+                _executor = ProcessPoolExecutor(max_workers=max_workers)
+            except (OSError, NotImplementedError, ImportError) as e:
+                # Some hosts (and sandboxes) do not allow worker processes
+                logger.warning(f"Process pool unavailable ({e}), using threads for image jobs")
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-job')
+        return _executor
+
+
+def _relative_variants(result, static_folder):
+    """Convert absolute variant paths to static-relative, URL style paths"""
+    relative = {}
+    for fmt, sizes in result.items():
+        relative[fmt] = {}
+        for size_name, info in sizes.items():
+            rel_path = os.path.relpath(info['path'], static_folder).replace(os.sep, '/')
+            relative[fmt][size_name] = dict(info, path=rel_path)
+    return relative
+
+
+def record_variants(static_folder, image_path, variants):
+    """
+    Merge one image's variants into the manifest on disk
+
+    Uses an exclusive file lock so several web workers can finish jobs at
+    the same time, and an atomic rename so readers never see a partial file.
+    """
+    images_dir = Path(static_folder) / os.path.dirname(image_path)
+    manifest_path = get_manifest_path(images_dir)
+    lock_path = manifest_path.with_suffix('.lock')
+    with _manifest_lock, open(lock_path, 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            manifest = read_manifest(manifest_path)
+            manifest[image_path] = {
+                'formats': variants,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }
+            tmp_path = manifest_path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, manifest_path)
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    variant_index.set_variants(image_path, variants)
+    return manifest[image_path]
+
+
+def get_image_variants(image_path):
+    """Variant index entry for a static-relative image path, or None"""
+    if not image_path:
+        return None
+    return variant_index.lookup(image_path)
+
+
+def srcset_candidates(entry, fmt='webp'):
+    """Variants of one format as (path, width) pairs, smallest first, one per width"""
+    if not entry:
+        return []
+    sizes = entry.get('formats', {}).get(fmt, {})
+    candidates = {}
+    for info in sizes.values():
+        candidates.setdefault(info['width'], info['path'])
+    return [(candidates[width], width) for width in sorted(candidates)]
+
+
+def enqueue_image_job(source_path, static_folder, formats=('webp',), max_workers=2):
+    """
+    Queue background variant generation for an uploaded image
+
+    Args:
+        source_path: Path to the saved original upload
+        static_folder: Flask static folder, manifest keys are relative to it
+        formats: Output formats to generate
+        max_workers: Pool size, 0 processes the image synchronously
+
+    Returns:
+        Future for the job (None when processed synchronously)
+    """
+    source_path = os.path.abspath(source_path)
+    static_folder = os.path.abspath(static_folder)
+    image_path = os.path.relpath(source_path, static_folder).replace(os.sep, '/')
+
+    if max_workers <= 0:
+        result = process_image(source_path, formats)
+        record_variants(static_folder, image_path, _relative_variants(result, static_folder))
+        return None
+
+    def _on_done(future):
+        try:
+            result = future.result()
+            record_variants(static_folder, image_path, _relative_variants(result, static_folder))
+            logger.info(f"Generated image variants for {image_path}")
+        except Exception as e:
+            logger.error(f"Image job failed for {image_path}: {e}")
+
+    future = get_executor(max_workers).submit(process_image, source_path, tuple(formats))
+    future.add_done_callback(_on_done)
+    return future
@@ -0,0 +1,272 @@
+"""
+Incremental Backup Store
+Content-addressed chunk store for SQLite snapshots: each snapshot is a
+manifest of chunk hashes, so only pages that changed since any earlier
+snapshot take up space, with hourly/daily/weekly retention and chunk GC
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STORE_DIRNAME = 'incremental'
+SNAPSHOT_PREFIX = 'snapshot_'
+# Pages per chunk: 1 is pure page-level dedup, larger groups keep the
+# object count manageable on big databases (16 x 4 KiB = 64 KiB chunks)
+DEFAULT_CHUNK_PAGES = 16
+DEFAULT_KEEP_LAST = 3
+DEFAULT_KEEP_HOURLY = 24
+DEFAULT_KEEP_DAILY = 7
+DEFAULT_KEEP_WEEKLY = 4
+
+
+def get_store_directory(backup_dir):
+    store_dir = Path(backup_dir) / STORE_DIRNAME
+    (store_dir / 'chunks').mkdir(parents=True, exist_ok=True)
+    (store_dir / 'manifests').mkdir(exist_ok=True)
+    return store_dir
+
+
+@contextmanager
+def store_lock(store_dir):
+    """Exclusive lock so retention never collects chunks a running snapshot just wrote"""
+    with open(Path(store_dir) / '.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _chunk_path(store_dir, digest):
+    return Path(store_dir) / 'chunks' / digest[:2] / digest
+
+
+def _read_page_size(path):
+    with open(path, 'rb') as f:
+        header = f.read(100)
+    if len(header) < 100 or not header.startswith(b'SQLite format 3\x00'):
+        raise ValueError(f"Not an SQLite database: {path}")
+    page_size = int.from_bytes(header[16:18], 'big')
+    return 65536 if page_size == 1 else page_size
+
+
+def _new_snapshot_id(store_dir):
+    snapshot_id = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    base, suffix = snapshot_id, 1
+    while (Path(store_dir) / 'manifests' / f"{snapshot_id}.json").exists():
+        suffix += 1
+        snapshot_id = f"{base}_{suffix}"
+    return snapshot_id
+
+
+def store_snapshot(snapshot_path, store_dir, chunk_pages=DEFAULT_CHUNK_PAGES, progress=None):
+    """
+    Add a consistent database copy to the chunk store
+
+    The file is read in chunks of chunk_pages pages; a chunk is written
+    (zlib-compressed, named by the SHA-256 of its raw bytes) only if no
+    earlier snapshot already stored identical bytes.
+
+    Args:
+        snapshot_path: Database file that is not being written to
+        store_dir: Directory from get_store_directory
+        chunk_pages: Pages per chunk
+        progress: Optional callable(done_bytes, total_bytes)
+
+    Returns:
+        Manifest dictionary (id, created_at, page_size, db_size, chunk_size,
+        chunks, new_chunks, new_bytes)
+    """
+    page_size = _read_page_size(snapshot_path)
+    chunk_size = page_size * max(1, int(chunk_pages))
+    db_size = os.path.getsize(snapshot_path)
+    chunks = []
+    new_chunks = 0
+    new_bytes = 0
+
+    with store_lock(store_dir):
+        with open(snapshot_path, 'rb') as f:
+            done = 0
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                chunks.append(digest)
+                path = _chunk_path(store_dir, digest)
+                if not path.exists():
+                    path.parent.mkdir(exist_ok=True)
+                    tmp_path = path.with_name(f"{digest}.tmp")
+                    tmp_path.write_bytes(zlib.compress(data, 6))
+                    os.replace(tmp_path, path)
+                    new_chunks += 1
+                    new_bytes += path.stat().st_size
+                done += len(data)
+                if progress:
+                    progress(done, db_size)
+
+        manifest = {
+            'id': _new_snapshot_id(store_dir),
+            'created_at': datetime.now().isoformat(),
+            'page_size': page_size,
+            'db_size': db_size,
+            'chunk_size': chunk_size,
+            'chunks': chunks,
+            'new_chunks': new_chunks,
+            'new_bytes': new_bytes,
+        }
+        manifest_path = Path(store_dir) / 'manifests' / f"{manifest['id']}.json"
+        tmp_path = manifest_path.with_suffix('.json.tmp')
+        tmp_path.write_text(json.dumps(manifest))
+        os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def read_manifest(store_dir, snapshot_id):
+    """Manifest of one snapshot, or None if the id is unknown or malformed"""
+    if not snapshot_id.startswith(SNAPSHOT_PREFIX) or os.path.basename(snapshot_id) != snapshot_id:
+        return None
+    try:
+        return json.loads((Path(store_dir) / 'manifests' / f"{snapshot_id}.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def read_manifests(store_dir):
+    """All snapshot manifests, newest first"""
+    manifests = []
+    for path in (Path(store_dir) / 'manifests').glob(f'{SNAPSHOT_PREFIX}*.json'):
+        try:
+            manifests.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            logger.warning(f"Skipping unreadable snapshot manifest {path.name}")
+    manifests.sort(key=lambda m: (m['created_at'], m['id']), reverse=True)
+    return manifests
+
+
+def rebuild_snapshot(store_dir, snapshot_id, dest_path):
+    """
+    Reassemble a snapshot into a database file
+
+    Every chunk is checked against its hash while it is written.
+
+    Returns:
+        The snapshot manifest
+    """
+    manifest = read_manifest(store_dir, snapshot_id)
+    if not manifest:
+        raise FileNotFoundError(f"Snapshot not found: {snapshot_id}")
+    with open(dest_path, 'wb') as out:
+        for digest in manifest['chunks']:
+            try:
+                data = zlib.decompress(_chunk_path(store_dir, digest).read_bytes())
+            except (OSError, zlib.error) as e:
+                raise ValueError(f"Snapshot {snapshot_id} is missing chunk {digest[:12]}: {e}")
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"Snapshot {snapshot_id} has a corrupt chunk {digest[:12]}")
+            out.write(data)
+    if os.path.getsize(dest_path) != manifest['db_size']:
+        raise ValueError(f"Snapshot {snapshot_id} rebuilt to the wrong size")
+    return manifest
+
+
+def select_retained(manifests, last=DEFAULT_KEEP_LAST, hourly=DEFAULT_KEEP_HOURLY,
+                    daily=DEFAULT_KEEP_DAILY, weekly=DEFAULT_KEEP_WEEKLY):
+    """
+    Snapshot ids kept by an hourly/daily/weekly rotation
+
+    The newest snapshot in each of the last `hourly` hours, `daily` days and
+    `weekly` ISO weeks that have snapshots is kept, as are the `last` newest
+    (at least one) whatever their age.
+
+    Args:
+        manifests: Manifests, newest first
+
+    Returns:
+        Set of snapshot ids to keep
+    """
+    keep = {manifest['id'] for manifest in manifests[:max(1, last)]}
+    rules = (
+        (hourly, lambda t: t.strftime('%Y%m%d%H')),
+        (daily, lambda t: t.strftime('%Y%m%d')),
+        (weekly, lambda t: '%d-%02d' % t.isocalendar()[:2]),
+    )
+    for limit, bucket_of in rules:
+        buckets = set()
+        for manifest in manifests:
+            bucket = bucket_of(datetime.fromisoformat(manifest['created_at']))
+            if bucket in buckets:
+                continue
+            if len(buckets) >= limit:
+                break
+            buckets.add(bucket)
+            keep.add(manifest['id'])
+    return keep
+
+
+def apply_retention(store_dir, last=DEFAULT_KEEP_LAST, hourly=DEFAULT_KEEP_HOURLY,
+                    daily=DEFAULT_KEEP_DAILY, weekly=DEFAULT_KEEP_WEEKLY):
+    """
+    Delete snapshots outside the rotation, then chunks no snapshot references
+
+    Returns:
+        Dictionary with deleted_snapshots, deleted_chunks and freed_bytes
+    """
+    result = {'deleted_snapshots': [], 'deleted_chunks': 0, 'freed_bytes': 0}
+    with store_lock(store_dir):
+        manifests = read_manifests(store_dir)
+        keep = select_retained(manifests, last, hourly, daily, weekly)
+        referenced = set()
+        for manifest in manifests:
+            if manifest['id'] in keep:
+                referenced.update(manifest['chunks'])
+                continue
+            path = Path(store_dir) / 'manifests' / f"{manifest['id']}.json"
+            result['freed_bytes'] += path.stat().st_size
+            path.unlink()
+            result['deleted_snapshots'].append(manifest['id'])
+
+        for chunk in (Path(store_dir) / 'chunks').glob('*/*'):
+            if chunk.name not in referenced:
+                result['freed_bytes'] += chunk.stat().st_size
+                chunk.unlink()
+                result['deleted_chunks'] += 1
+    return result
+
+
+def store_usage(store_dir):
+    """
+    Disk use of the store against the size of the snapshots it holds
+
+    Returns:
+        Dictionary with snapshots, chunks, real_size (bytes on disk) and
+        logical_size (what the same snapshots would take as full copies)
+    """
+    manifests = read_manifests(store_dir)
+    real_size = 0
+    chunk_count = 0
+    for path in Path(store_dir).rglob('*'):
+        if path.is_file() and path.name != '.lock':
+            real_size += path.stat().st_size
+            chunk_count += path.parent.parent.name == 'chunks'
+    return {
+        'snapshots': len(manifests),
+        'chunks': chunk_count,
+        'real_size': real_size,
+        'logical_size': sum(m['db_size'] for m in manifests),
+    }
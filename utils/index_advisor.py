@@ -0,0 +1,130 @@
+"""
+Query-Plan Index Advisor
+Replays the application's hot queries through EXPLAIN QUERY PLAN (SQLite)
+or EXPLAIN (PostgreSQL) and flags full table scans and unindexed sorts
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from models import db
+
+# (label, where it runs, SQL) mirroring the ORM queries in app.py/models.py.
+# Parameters are bound from sample_parameters(); plans do not depend on values.
+REPRESENTATIVE_QUERIES = [
+    ('Visitor lookup by IP', 'track_visitor (every request)',
+     "SELECT * FROM visitor_records WHERE ip_address = :ip LIMIT 1"),
+    ('Page view lookup', 'track_visitor (every page)',
+     "SELECT * FROM page_views WHERE page_url = :url AND visitor_id = :visitor_id LIMIT 1"),
+    ('Daily user visit', 'track_visitor (signed-in users)',
+     "SELECT * FROM user_visits WHERE user_id = :user_id AND visit_date = :today LIMIT 1"),
+    ('Distinct visit days', 'top users / dashboard',
+     "SELECT count(DISTINCT visit_date) FROM user_visits WHERE user_id = :user_id"),
+    ('Limited downloads today', 'User.can_download_limited',
+     "SELECT count(*) FROM limited_access_downloads "
+     "WHERE user_id = :user_id AND download_date = :today AND download_type = :download_type"),
+    ('M-Pesa callback by reference', 'mpesa_callback',
+     "SELECT * FROM mpesa_transactions WHERE transaction_reference = :reference LIMIT 1"),
+    ('M-Pesa callback by conversation', 'mpesa_callback',
+     "SELECT * FROM mpesa_transactions WHERE conversation_id = :reference LIMIT 1"),
+    ('Expired M-Pesa transactions', 'cleanup_expired_payments',
+     "SELECT * FROM mpesa_transactions "
+     "WHERE status IN ('pending', 'submitted') AND created_at < :cutoff"),
+    ('Active materials, newest first', 'index page',
+     "SELECT * FROM materials WHERE is_active = :true ORDER BY created_at DESC LIMIT 12"),
+    ('Published news, newest first', 'news page',
+     "SELECT * FROM news WHERE is_published = :true ORDER BY created_at DESC LIMIT 10"),
+    ('Active subscription', 'User.has_active_access',
+     "SELECT * FROM subscriptions WHERE user_id = :user_id AND is_active = :true "
+     "AND payment_status = 'paid' AND end_date > :now LIMIT 1"),
+    ('Material view count', 'User.get_material_view_count',
+     "SELECT * FROM material_views WHERE user_id = :user_id AND material_id = :material_id LIMIT 1"),
+]
+
+_SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?!.*\bUSING\b)')
+_POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+_POSTGRES_SORT = re.compile(r'^\s*(?:->\s+)?Sort\b')
+
+
+def sample_parameters():
+    """Bind values for REPRESENTATIVE_QUERIES"""
+    now = datetime.now(timezone.utc)
+    return {
+        'ip': '127.0.0.1',
+        'url': 'http://localhost/',
+        'visitor_id': 1,
+        'user_id': 1,
+        'material_id': 1,
+        'today': now.date(),
+        'download_type': 'video',
+        'reference': 'ref',
+        'cutoff': now - timedelta(minutes=30),
+        'now': now,
+        'true': True,
+    }
+
+
+def explain(conn, sql, params):
+    """
+    Query plan of one statement as readable lines
+
+    Returns:
+        List of plan lines (SQLite detail strings or PostgreSQL plan rows)
+    """
+    if conn.dialect.name == 'sqlite':
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).fetchall()
+        return [row[-1] for row in rows]
+    rows = conn.execute(text(f"EXPLAIN {sql}"), params).fetchall()
+    return [row[0] for row in rows]
+
+
+def find_problems(plan, dialect_name):
+    """
+    Full table scans and sorts that an index would avoid
+
+    Returns:
+        Tuple of (list of fully scanned tables, needs_temp_sort flag)
+    """
+    scanned = []
+    temp_sort = False
+    for line in plan:
+        if dialect_name == 'sqlite':
+            match = _SQLITE_FULL_SCAN.match(line.strip())
+            if 'USE TEMP B-TREE FOR ORDER BY' in line:
+                temp_sort = True
+        else:
+            match = _POSTGRES_FULL_SCAN.search(line)
+            if _POSTGRES_SORT.search(line):
+                temp_sort = True
+        if match and match.group(1) not in scanned:
+            scanned.append(match.group(1))
+    return scanned, temp_sort
+
+
+def advise(engine=None):
+    """
+    Explain every representative query and collect the plan problems
+
+    Queries against tables that do not exist yet are reported with an error
+    instead of aborting the run.
+
+    Returns:
+        List of {'label', 'source', 'sql', 'plan', 'full_scans', 'temp_sort', 'error'}
+    """
+    engine = engine or db.engine
+    params = sample_parameters()
+    report = []
+    with engine.connect() as conn:
+        for label, source, sql in REPRESENTATIVE_QUERIES:
+            entry = {'label': label, 'source': source, 'sql': sql, 'plan': [],
+                     'full_scans': [], 'temp_sort': False, 'error': None}
+            try:
+                entry['plan'] = explain(conn, sql, params)
+                entry['full_scans'], entry['temp_sort'] = find_problems(entry['plan'], conn.dialect.name)
+            except Exception as e:
+                entry['error'] = str(e).splitlines()[0]
+                conn.rollback()
+            report.append(entry)
+    return report
@@ -0,0 +1,213 @@
+"""
+Keyset Pagination
+Cursor pagination over an ordered key ending in the primary key, e.g.
+(created_at, id): every page is one range query on an index, with no
+OFFSET and no COUNT(*), and is addressed by an opaque, signed cursor
+"""
+
+import time
+import threading
+from datetime import datetime, date
+
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadData
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.sql import operators
+
+CURSOR_SALT = 'keyset-cursor'
+DEFAULT_COUNT_TTL = 60
+MAX_CACHED_COUNTS = 512
+
+
+class KeysetPage:
+    """
+    One page of a keyset query
+
+    Attributes:
+        items: Rows of this page, in display order
+        next_cursor, prev_cursor: Tokens for the neighbouring pages, None
+            at either end
+        total: Cached total row count when requested, otherwise None
+    """
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.secret_key, salt=CURSOR_SALT)
+
+
+def _dump(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _load(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+    return value
+
+
+def encode_cursor(values, direction):
+    """Signed token for the page after (or before) values, None if a key value is NULL"""
+    if any(value is None for value in values):
+        return None
+    return _serializer().dumps({'k': [_dump(value) for value in values], 'd': direction})
+
+
+def decode_cursor(token):
+    """
+    Returns:
+        (key values, 'next' or 'prev'), or (None, 'next') for a missing,
+        tampered or malformed token, which shows the first page
+    """
+    if not token:
+        return None, 'next'
+    try:
+        payload = _serializer().loads(token)
+        values = [_load(value) for value in payload['k']]
+        direction = payload['d'] if payload['d'] in ('next', 'prev') else 'next'
+    except (BadData, KeyError, TypeError, ValueError):
+        return None, 'next'
+    if any(value is None for value in values):
+        return None, 'next'
+    return values, direction
+
+
+def _order_key(query, order_by):
+    """
+    (column, descending) pairs for the ORDER BY, ending in the primary key
+
+    The primary key makes the key unique, so no row is skipped or repeated
+    when several share the same created_at.
+    """
+    key = []
+    for expression in order_by:
+        modifier = getattr(expression, 'modifier', None)
+        if modifier in (operators.desc_op, operators.asc_op):
+            key.append((expression.element, modifier is operators.desc_op))
+        else:
+            key.append((getattr(expression, 'expression', expression), False))
+    primary_key = query.column_descriptions[0]['entity'].__mapper__.primary_key[0]
+    if not any(column.compare(primary_key) for column, _ in key):
+        key.append((primary_key, key[-1][1] if key else False))
+    return key
+
+
+def _beyond(key, values):
+    """Rows strictly after values in the order of key"""
+    directions = {descending for _, descending in key}
+    if len(directions) == 1:
+        # A row-value comparison lets the database seek straight into the index
+        columns = tuple_(*(column for column, _ in key))
+        bound = tuple_(*values)
+        return columns < bound if directions.pop() else columns > bound
+    clauses = []
+    for position, (column, descending) in enumerate(key):
+        equal = [key[index][0] == values[index] for index in range(position)]
+        clauses.append(and_(*equal, column < values[position] if descending else column > values[position]))
+    return or_(*clauses)
+
+
+def _key_values(item, key):
+    return [getattr(item, column.key) for column, _ in key]
+
+
+_count_cache = {}
+_count_lock = threading.Lock()
+
+
+def cached_count(query, ttl=None):
+    """
+    COUNT(*) of a query, reused for ttl seconds (KEYSET_COUNT_TTL)
+
+    Totals are only for display, so a count up to a minute old is fine
+    and a deep listing does not pay for a full count on every page.
+    """
+    if ttl is None:
+        ttl = current_app.config.get('KEYSET_COUNT_TTL', DEFAULT_COUNT_TTL)
+    compiled = query.statement.compile()
+    cache_key = (str(compiled), tuple(sorted((name, repr(value)) for name, value in compiled.params.items())))
+    now = time.monotonic()
+    with _count_lock:
+        cached = _count_cache.get(cache_key)
+    if cached and now - cached[1] < ttl:
+        return cached[0]
+    total = query.order_by(None).count()
+    with _count_lock:
+        if len(_count_cache) >= MAX_CACHED_COUNTS:
+            _count_cache.clear()
+        _count_cache[cache_key] = (total, now)
+    return total
+
+
+def keyset_paginate(query, order_by, cursor=None, per_page=20, with_total=False):
+    """
+    Fetch one page of a query by cursor
+
+    Args:
+        query: Model query with its filters (any ORDER BY is replaced)
+        order_by: Columns or column.desc() expressions; the model's primary
+            key is appended as the tie-breaker. Key columns must not be NULL:
+            the cursor range skips NULL rows (migration 8 backfills
+            created_at on the paginated tables).
+        cursor: Token from a previous page's next_cursor/prev_cursor
+        per_page: Rows per page
+        with_total: Also return the cached_count() total
+
+    Returns:
+        KeysetPage
+    """
+    key = _order_key(query, order_by)
+    values, direction = decode_cursor(cursor)
+    if values is not None and len(values) != len(key):
+        values, direction = None, 'next'  # Cursor from a different ordering
+    backwards = direction == 'prev'
+
+    # Going back reads the preceding rows in reverse order, then flips them
+    scan = [(column, descending != backwards) for column, descending in key]
+    page_query = query.order_by(None).order_by(
+        *(column.desc() if descending else column.asc() for column, descending in scan)
+    )
+    if values is not None:
+        page_query = page_query.filter(_beyond(scan, values))
+    rows = page_query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    has_prev = more if backwards else values is not None
+    has_next = True if backwards else more
+    return KeysetPage(
+        rows,
+        per_page,
+        next_cursor=encode_cursor(_key_values(rows[-1], key), 'next') if rows and has_next else None,
+        prev_cursor=encode_cursor(_key_values(rows[0], key), 'prev') if rows and has_prev else None,
+        total=cached_count(query) if with_total else None,
+    )
@@ -0,0 +1,185 @@
+"""
+PDF Processing Pipeline
+Linearizes uploaded PDFs for page-at-a-time web viewing, renders low
+resolution previews of the first pages and reads the real page count
+"""
+
+import os
+import shutil
+import logging
+from pathlib import Path
+
+from .image_pipeline import get_executor
+
+try:
+    import pikepdf
+    PIKEPDF_AVAILABLE = True
+except ImportError:
+    PIKEPDF_AVAILABLE = False
+
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+LINEAR_SUFFIX = '.linear.pdf'
+PREVIEWS_SUFFIX = '.previews'
+PREVIEW_PAGES = 3
+PREVIEW_WIDTH = 480  # Enough for a phone screen, small enough to paint instantly
+PREVIEW_QUALITY = 70
+
+
+def derived_paths(file_path):
+    """
+    Paths of the files derived from a PDF, named after its stem
+
+    Works for both absolute and static-relative paths. Keeping derivatives
+    beside the original means a content-store blob and its derivatives
+    share one name prefix and are cleaned up together.
+
+    Returns:
+        Tuple of (linearized PDF path, previews directory path)
+    """
+    stem = os.path.splitext(file_path)[0]
+    return f"{stem}{LINEAR_SUFFIX}", f"{stem}{PREVIEWS_SUFFIX}"
+
+
+def linearize_pdf(source_path, output_path):
+    """
+    Write a linearized ("fast web view") copy of a PDF
+
+    Returns:
+        Tuple of (output path or None when the source is already linearized, page count)
+    """
+    with pikepdf.open(source_path) as pdf:
+        page_count = len(pdf.pages)
+        if pdf.is_linearized:
+            return None, page_count
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        pdf.save(tmp_path, linearize=True)
+    os.replace(tmp_path, output_path)
+    return output_path, page_count
+
+
+def render_previews(source_path, output_dir, pages=PREVIEW_PAGES, width=PREVIEW_WIDTH):
+    """
+    Render the first pages of a PDF to WebP images
+
+    Returns:
+        Tuple of (list of {'path', 'width', 'height'}, page count)
+    """
+    output_dir = Path(output_dir)
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    output_dir.mkdir(parents=True)
+    previews = []
+    pdf = pdfium.PdfDocument(source_path)
+    try:
+        page_count = len(pdf)
+        for index in range(min(pages, page_count)):
+            page = pdf[index]
+            try:
+                page_width = page.get_size()[0] or width
+                image = page.render(scale=width / page_width).to_pil()
+            finally:
+                page.close()
+            path = output_dir / f"page-{index + 1}.webp"
+            image.convert('RGB').save(path, 'WEBP', quality=PREVIEW_QUALITY, method=4)
+            previews.append({'path': str(path), 'width': image.width, 'height': image.height})
+    finally:
+        pdf.close()
+    return previews, page_count
+
+
+def process_pdf(source_path, preview_pages=PREVIEW_PAGES, preview_width=PREVIEW_WIDTH):
+    """
+    Linearize a PDF and render its previews
+
+    Runs inside a worker process, so it only deals with plain paths and
+    returns plain data. Each step is skipped when its library is missing.
+
+    Args:
+        source_path: Absolute path to the uploaded PDF
+        preview_pages: Number of leading pages to render
+        preview_width: Preview width in pixels
+
+    Returns:
+        Dictionary with 'pages', 'linearized' (path or None) and 'previews'
+    """
+    linear_path, previews_dir = derived_paths(source_path)
+    result = {'pages': None, 'linearized': None, 'previews': []}
+
+    if PIKEPDF_AVAILABLE:
+        result['linearized'], result['pages'] = linearize_pdf(source_path, linear_path)
+
+    if PDFIUM_AVAILABLE and preview_pages > 0:
+        result['previews'], page_count = render_previews(
+            source_path, previews_dir, pages=preview_pages, width=preview_width
+        )
+        result['pages'] = result['pages'] or page_count
+
+    return result
+
+
+def get_pdf_assets(static_folder, file_path):
+    """
+    Web-facing assets for a static-relative PDF path
+
+    Returns:
+        Dictionary with 'file_path' (linearized copy when one exists) and
+        'previews' (static-relative preview paths in page order)
+    """
+    linear_path, previews_dir = derived_paths(file_path)
+    assets = {'file_path': file_path, 'previews': []}
+    if os.path.exists(os.path.join(static_folder, linear_path)):
+        assets['file_path'] = linear_path
+    try:
+        names = [entry.name for entry in os.scandir(os.path.join(static_folder, previews_dir))
+                 if entry.name.startswith('page-') and entry.name.endswith('.webp')]
+    except FileNotFoundError:
+        names = []
+    names.sort(key=lambda name: int(name[len('page-'):-len('.webp')]))
+    assets['previews'] = [f"{previews_dir}/{name}" for name in names]
+    return assets
+
+
+def enqueue_pdf_job(source_path, on_done=None, max_workers=2, preview_pages=PREVIEW_PAGES,
+                    preview_width=PREVIEW_WIDTH):
+    """
+    Queue background processing for an uploaded PDF
+
+    Args:
+        source_path: Path to the saved PDF
+        on_done: Called with the process_pdf result once the job finishes
+        max_workers: Pool size, 0 processes the PDF synchronously
+        preview_pages: Number of leading pages to render
+        preview_width: Preview width in pixels
+
+    Returns:
+        Future for the job (None when processed synchronously or nothing to do)
+    """
+    if not (PIKEPDF_AVAILABLE or PDFIUM_AVAILABLE):
+        return None
+    source_path = os.path.abspath(source_path)
+
+    if max_workers <= 0:
+        result = process_pdf(source_path, preview_pages, preview_width)
+        if on_done:
+            on_done(result)
+        return None
+
+    def _on_done(future):
+        try:
+            result = future.result()
+            if on_done:
+                on_done(result)
+            logger.info(f"Processed PDF {source_path}: {result['pages']} pages")
+        except Exception as e:
+            logger.error(f"PDF job failed for {source_path}: {e}")
+
+    future = get_executor(max_workers).submit(process_pdf, source_path, preview_pages, preview_width)
+    future.add_done_callback(_on_done)
+    return future
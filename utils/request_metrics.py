@@ -0,0 +1,225 @@
+"""
+Per-Request Performance Metrics
+Counts and times every SQL statement a request runs, reports the totals in
+a Server-Timing header (development only by default) and keeps recent
+latencies and the slowest requests of each endpoint for the admin
+performance page
+"""
+
+import math
+import heapq
+import itertools
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from time import perf_counter
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SAMPLE_SIZE = 512  # Recent requests kept per endpoint for the percentiles
+DEFAULT_SLOWEST_PER_ENDPOINT = 5
+WORST_STATEMENTS = 20
+STATEMENT_PREVIEW_CHARS = 500
+EXCLUDED_ENDPOINTS = ('static',)
+
+
+class _RequestTimer:
+    """Totals of one request, kept on flask.g"""
+
+    __slots__ = ('started', 'queries', 'db_time', 'worst_time', 'worst_statement', 'render_time',
+                 'render_depth', 'render_started')
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.worst_time = 0.0
+        self.worst_statement = None
+        self.render_time = 0.0
+        self.render_depth = 0
+        self.render_started = 0.0
+
+
+class _EndpointStats:
+    def __init__(self, sample_size):
+        self.requests = 0
+        self.samples = deque(maxlen=sample_size)  # (duration, queries, db_time)
+        self.slowest = []  # Min-heap of (duration, sequence, entry)
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class RequestMetrics:
+    """
+    SQL and render timing per request
+
+    Statements are timed with cursor execute events on every engine (the
+    primary and the read pool), so only a counter, a float addition and a
+    comparison are added per statement. Statistics live in the worker's
+    memory: each worker of a multi-process server reports its own requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._worst_statements = []  # Min-heap of (duration, sequence, entry)
+        self._sequence = itertools.count()
+        self._sample_size = DEFAULT_SAMPLE_SIZE
+        self._slowest_per_endpoint = DEFAULT_SLOWEST_PER_ENDPOINT
+        self._header = False
+
+    def init_app(self, app):
+        self._sample_size = int(app.config.get('PERF_SAMPLE_SIZE', DEFAULT_SAMPLE_SIZE))
+        self._slowest_per_endpoint = int(app.config.get('PERF_SLOWEST_PER_ENDPOINT', DEFAULT_SLOWEST_PER_ENDPOINT))
+        self._header = app.config.get('SERVER_TIMING_HEADER', False)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        before_render_template.connect(_start_render, app)
+        template_rendered.connect(_end_render, app)
+        app.before_request(_start_request)
+        app.after_request(self._finish_request)
+
+    def _finish_request(self, response):
+        timer = g.pop('request_timer', None)
+        if timer is None:
+            return response
+        duration = perf_counter() - timer.started
+        if self._header:
+            response.headers.add(
+                'Server-Timing',
+                f'db;dur={timer.db_time * 1000:.2f}, db-count;desc="{timer.queries}", '
+                f'render;dur={timer.render_time * 1000:.2f}, total;dur={duration * 1000:.2f}'
+            )
+        if request.endpoint and request.endpoint not in EXCLUDED_ENDPOINTS:
+            self.record(request.endpoint, duration, timer, response.status_code)
+        return response
+
+    def record(self, endpoint, duration, timer, status_code):
+        """Add a finished request to its endpoint's samples and slowest list"""
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = _EndpointStats(self._sample_size)
+            stats.requests += 1
+            stats.samples.append((duration, timer.queries, timer.db_time))
+            if len(stats.slowest) < self._slowest_per_endpoint or duration > stats.slowest[0][0]:
+                entry = {
+                    'at': datetime.now(timezone.utc),
+                    'method': request.method,
+                    'path': request.full_path.rstrip('?'),
+                    'status': status_code,
+                    'duration_ms': duration * 1000,
+                    'db_ms': timer.db_time * 1000,
+                    'render_ms': timer.render_time * 1000,
+                    'queries': timer.queries,
+                    'worst_statement': (timer.worst_statement or '')[:STATEMENT_PREVIEW_CHARS],
+                    'worst_statement_ms': timer.worst_time * 1000,
+                }
+                item = (duration, next(self._sequence), entry)
+                if len(stats.slowest) < self._slowest_per_endpoint:
+                    heapq.heappush(stats.slowest, item)
+                else:
+                    heapq.heapreplace(stats.slowest, item)
+            if timer.worst_statement and (len(self._worst_statements) < WORST_STATEMENTS
+                                          or timer.worst_time > self._worst_statements[0][0]):
+                item = (timer.worst_time, next(self._sequence), {
+                    'endpoint': endpoint,
+                    'statement': timer.worst_statement[:STATEMENT_PREVIEW_CHARS],
+                    'duration_ms': timer.worst_time * 1000,
+                    'at': datetime.now(timezone.utc),
+                })
+                if len(self._worst_statements) < WORST_STATEMENTS:
+                    heapq.heappush(self._worst_statements, item)
+                else:
+                    heapq.heapreplace(self._worst_statements, item)
+
+    def snapshot(self):
+        """
+        Statistics for the admin performance page
+
+        Returns:
+            Dictionary with 'endpoints' (sorted by p95, slowest first, each
+            with requests, p50_ms, p95_ms, avg_queries, max_queries, avg_db_ms
+            and its slowest requests) and 'worst_statements'
+        """
+        with self._lock:
+            endpoints = {name: (stats.requests, list(stats.samples), list(stats.slowest))
+                         for name, stats in self._endpoints.items()}
+            worst = list(self._worst_statements)
+        rows = []
+        for name, (requests, samples, slowest) in endpoints.items():
+            durations = sorted(sample[0] for sample in samples)
+            queries = [sample[1] for sample in samples]
+            rows.append({
+                'endpoint': name,
+                'requests': requests,
+                'sampled': len(samples),
+                'p50_ms': _percentile(durations, 0.50) * 1000,
+                'p95_ms': _percentile(durations, 0.95) * 1000,
+                'avg_queries': sum(queries) / len(queries) if queries else 0,
+                'max_queries': max(queries) if queries else 0,
+                'avg_db_ms': sum(sample[2] for sample in samples) / len(samples) * 1000 if samples else 0,
+                'slowest': [entry for _, _, entry in sorted(slowest, reverse=True)],
+            })
+        rows.sort(key=lambda row: row['p95_ms'], reverse=True)
+        return {
+            'endpoints': rows,
+            'worst_statements': [entry for _, _, entry in sorted(worst, reverse=True)],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._worst_statements = []
+
+
+def _start_request():
+    g.request_timer = _RequestTimer()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is None or not has_request_context():
+        return
+    timer = g.get('request_timer')
+    if timer is None:
+        return
+    elapsed = perf_counter() - started
+    timer.queries += 1
+    timer.db_time += elapsed
+    if elapsed > timer.worst_time:
+        timer.worst_time = elapsed
+        timer.worst_statement = statement
+
+
+def _start_render(sender, template, context, **extra):
+    timer = g.get('request_timer')
+    if timer is not None:
+        if timer.render_depth == 0:
+            timer.render_started = perf_counter()
+        timer.render_depth += 1
+
+
+def _end_render(sender, template, context, **extra):
+    timer = g.get('request_timer')
+    if timer is not None and timer.render_depth:
+        timer.render_depth -= 1
+        if timer.render_depth == 0:
+            timer.render_time += perf_counter() - timer.render_started
+
+
+request_metrics = RequestMetrics()
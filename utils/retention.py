@@ -0,0 +1,343 @@
+"""
+Tracking Data Retention
+Rolls old page view, user visit, visitor and admin log rows into daily or
+monthly aggregates, exports the raw rows to compressed archive files under
+instance/archive and deletes them in short, bounded batches
+"""
+
+import os
+import json
+import gzip
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+from sqlalchemy import select, delete, update, insert, exists, func
+
+from models import db, AdminLog, PageView, TrackingRollup, UserVisit, VisitorRecord
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIRNAME = 'archive'
+ARCHIVE_FORMATS = ('jsonl', 'parquet')
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_ADMIN_LOG_RETENTION_DAYS = 365
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_PAUSE = 0.05  # Seconds between batches, so queued writers get the lock
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _month(value):
+    return _day(value).replace(day=1)
+
+
+# Tables archived by archive_tracking_data, in order: page views go first
+# so the visitors they reference can be archived in the same run.
+# age_column decides when a row is old; each archived row is added to the
+# TrackingRollup row for (metric, period(row), key(row)), counting one row
+# plus the row's `total` column.
+POLICIES = [
+    {
+        'table': 'page_views', 'model': PageView, 'age_column': 'last_viewed', 'retention': 'tracking',
+        'metric': 'page_views', 'total': 'view_count',
+        'period': lambda row: _day(row['last_viewed']),
+        # One rollup per path: the raw rows are per full URL, query string included
+        'key': lambda row: urlsplit(row['page_url'] or '').path[:500],
+    },
+    {
+        'table': 'user_visits', 'model': UserVisit, 'age_column': 'visit_date', 'retention': 'tracking',
+        'metric': 'user_visits', 'total': 'visit_count',
+        'period': lambda row: _month(row['visit_date']),
+        'key': lambda row: str(row['user_id']),
+    },
+    {
+        'table': 'visitor_records', 'model': VisitorRecord, 'age_column': 'last_visit', 'retention': 'tracking',
+        'metric': 'visitors', 'total': 'visit_count',
+        'period': lambda row: _day(row['first_visit'] or row['last_visit']),
+        'key': lambda row: '',
+        'guard': lambda: ~exists().where(PageView.visitor_id == VisitorRecord.id),
+    },
+    {
+        'table': 'admin_logs', 'model': AdminLog, 'age_column': 'created_at', 'retention': 'admin',
+        'metric': 'admin_actions', 'total': None,
+        'period': lambda row: _day(row['created_at']),
+        'key': lambda row: (row['action'] or '')[:500],
+    },
+]
+POLICY_BY_TABLE = {policy['table']: policy for policy in POLICIES}
+
+
+def get_archive_directory(instance_path):
+    archive_dir = Path(instance_path) / ARCHIVE_DIRNAME
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    return archive_dir
+
+
+@contextmanager
+def archive_lock(archive_dir):
+    """One archiver at a time, so rollups are never merged twice"""
+    with open(Path(archive_dir) / '.lock', 'a') as lock_file:
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError("Tracking data is already being archived")
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class ArchiveWriter:
+    """
+    Appends archived rows to one file per table and run
+
+    JSONL files get one gzip member per batch (gzip readers see a single
+    stream), so a file is valid after every batch. Parquet files cannot be
+    appended to, so that format writes one file per batch.
+    """
+
+    def __init__(self, archive_dir, archive_format='jsonl'):
+        if archive_format == 'parquet' and not PARQUET_AVAILABLE:
+            logger.warning("pyarrow not installed, archiving as JSONL instead of Parquet")
+            archive_format = 'jsonl'
+        self.archive_dir = Path(archive_dir)
+        self.archive_format = archive_format
+        self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self._batches = {}
+        self.files = set()
+
+    def write(self, table, rows):
+        """Write rows durably (fsynced) and return the file path"""
+        records = [{key: _json_value(value) for key, value in row.items()} for row in rows]
+        table_dir = self.archive_dir / table
+        table_dir.mkdir(exist_ok=True)
+        batch = self._batches[table] = self._batches.get(table, 0) + 1
+        if self.archive_format == 'parquet':
+            path = table_dir / f"{table}_{self.run_id}_{batch:05d}.parquet"
+            pq.write_table(pa.Table.from_pylist(records), path, compression='zstd')
+            with open(path, 'rb+') as f:
+                os.fsync(f.fileno())
+        else:
+            path = table_dir / f"{table}_{self.run_id}.jsonl.gz"
+            with open(path, 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as out:
+                    for record in records:
+                        out.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+                raw.flush()
+                os.fsync(raw.fileno())
+        self.files.add(str(path))
+        return path
+
+
+def _merge_rollups(conn, policy, rows):
+    """Add a batch of rows to their TrackingRollup aggregates"""
+    table = TrackingRollup.__table__
+    totals = {}
+    for row in rows:
+        bucket = totals.setdefault((policy['period'](row), policy['key'](row)), [0, 0])
+        bucket[0] += 1
+        bucket[1] += (row[policy['total']] or 0) if policy['total'] else 1
+    for (period, key), (row_count, total) in totals.items():
+        match = (table.c.metric == policy['metric'], table.c.period == period, table.c.key == key)
+        updated = conn.execute(
+            update(table).where(*match)
+            .values(row_count=table.c.row_count + row_count, total=table.c.total + total)
+        ).rowcount
+        if not updated:
+            conn.execute(insert(table).values(metric=policy['metric'], period=period, key=key,
+                                              row_count=row_count, total=total))
+
+
+def _archive_table(policy, cutoff, writer, batch_size, pause, dry_run):
+    table = policy['model'].__table__
+    age = table.c[policy['age_column']]
+    conditions = [age.isnot(None), age < cutoff]
+    if policy.get('guard'):
+        conditions.append(policy['guard']())
+    result = {'rows': 0, 'batches': 0}
+    last_id = 0
+
+    while True:
+        batch_ids = (select(table.c.id).where(table.c.id > last_id, *conditions)
+                     .order_by(table.c.id).limit(batch_size).scalar_subquery())
+        if dry_run:
+            with db.engine.connect() as conn:
+                ids = conn.execute(select(table.c.id).where(table.c.id.in_(batch_ids))).scalars().all()
+            if not ids:
+                break
+            last_id = max(ids)
+            result['rows'] += len(ids)
+            result['batches'] += 1
+            continue
+
+        # Delete, roll up and archive in one short write transaction: the
+        # archive file is fsynced before the commit, so a crash can only
+        # archive a batch twice, never lose it
+        with db.engine.begin() as conn:
+            if conn.dialect.delete_returning:
+                rows = conn.execute(delete(table).where(table.c.id.in_(batch_ids)).returning(*table.c)).mappings().all()
+            else:
+                rows = conn.execute(select(table).where(table.c.id.in_(batch_ids))).mappings().all()
+                conn.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+            if not rows:
+                break
+            rows = sorted(rows, key=lambda row: row['id'])
+            _merge_rollups(conn, policy, rows)
+            writer.write(policy['table'], rows)
+        last_id = rows[-1]['id']
+        result['rows'] += len(rows)
+        result['batches'] += 1
+        time.sleep(pause)
+    return result
+
+
+def archive_tracking_data(instance_path, retention_days=DEFAULT_RETENTION_DAYS,
+                          admin_log_retention_days=DEFAULT_ADMIN_LOG_RETENTION_DAYS,
+                          batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_BATCH_PAUSE,
+                          archive_format='jsonl', dry_run=False):
+    """
+    Move tracking rows older than the retention window into the archive
+
+    Args:
+        instance_path: Flask instance folder; archives go to its archive/
+        retention_days: Age after which page views, user visits and
+            visitors (with no page views left) are archived
+        admin_log_retention_days: Age after which admin log rows are archived
+        batch_size: Rows deleted per write transaction
+        pause: Seconds to sleep between batches
+        archive_format: 'jsonl' (gzip-compressed) or 'parquet' (needs pyarrow)
+        dry_run: Count what would be archived without changing anything
+
+    Returns:
+        Dictionary with tables (rows and batches per table), files written
+        and the cutoff dates
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoffs = {
+        'tracking': now - timedelta(days=retention_days),
+        'admin': now - timedelta(days=admin_log_retention_days),
+    }
+    archive_dir = get_archive_directory(instance_path)
+    writer = ArchiveWriter(archive_dir, archive_format)
+    tables = {}
+    with archive_lock(archive_dir):
+        for policy in POLICIES:
+            cutoff = cutoffs[policy['retention']]
+            if isinstance(policy['model'].__table__.c[policy['age_column']].type, db.Date):
+                cutoff = cutoff.date()
+            tables[policy['table']] = _archive_table(policy, cutoff, writer, max(1, int(batch_size)), pause, dry_run)
+    return {
+        'tables': tables,
+        'files': sorted(writer.files),
+        'cutoffs': {name: cutoff.date().isoformat() for name, cutoff in cutoffs.items()},
+        'dry_run': dry_run,
+    }
+
+
+def list_archive_files(instance_path, table=None):
+    """Archive files, oldest first, optionally for one table"""
+    archive_dir = Path(instance_path) / ARCHIVE_DIRNAME
+    tables = [table] if table else [policy['table'] for policy in POLICIES]
+    files = []
+    for name in tables:
+        files += sorted((archive_dir / name).glob(f"{name}_*.jsonl.gz"))
+        files += sorted((archive_dir / name).glob(f"{name}_*.parquet"))
+    return sorted(files, key=lambda path: path.name)
+
+
+def read_archive(instance_path, table, since=None, until=None, match=None):
+    """
+    Iterate over archived rows of one table, for offline queries
+
+    Args:
+        table: One of POLICY_BY_TABLE
+        since, until: ISO date strings compared with the table's age column
+            (inclusive since, exclusive until)
+        match: Optional dictionary of column to required value (compared as
+            strings)
+
+    Yields:
+        Row dictionaries as they were archived
+    """
+    if table not in POLICY_BY_TABLE:
+        raise ValueError(f"Unknown archive table: {table}")
+    age_column = POLICY_BY_TABLE[table]['age_column']
+    match = match or {}
+    for path in list_archive_files(instance_path, table):
+        if path.suffix == '.parquet':
+            if not PARQUET_AVAILABLE:
+                logger.warning(f"Skipping {path.name}, pyarrow is not installed")
+                continue
+            records = pq.read_table(path).to_pylist()
+        else:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        for record in records:
+            age = str(_json_value(record.get(age_column)) or '')
+            if since and age < since:
+                continue
+            if until and age >= until:
+                continue
+            if any(str(record.get(column)) != str(value) for column, value in match.items()):
+                continue
+            yield record
+
+
+def archived_totals():
+    """
+    Rows and totals that have moved from the live tables into rollups
+
+    Returns:
+        Dictionary of metric to {'rows', 'total'}
+    """
+    rows = db.session.query(
+        TrackingRollup.metric, func.sum(TrackingRollup.row_count), func.sum(TrackingRollup.total)
+    ).group_by(TrackingRollup.metric).all()
+    return {metric: {'rows': int(row_count or 0), 'total': int(total or 0)} for metric, row_count, total in rows}
+
+
+def archived_visit_days(user_id=None):
+    """
+    Visit days per user that were rolled up out of user_visits
+
+    Archived days are all older than the live ones, so adding them to a
+    count of distinct live visit dates gives the all-time number.
+
+    Returns:
+        Dictionary of user id to number of archived visit days
+    """
+    query = db.session.query(TrackingRollup.key, func.sum(TrackingRollup.row_count)).filter(
+        TrackingRollup.metric == 'user_visits'
+    )
+    if user_id is not None:
+        query = query.filter(TrackingRollup.key == str(user_id))
+    return {int(key): int(days or 0) for key, days in query.group_by(TrackingRollup.key).all()}
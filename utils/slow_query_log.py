@@ -0,0 +1,317 @@
+"""
+Slow Query Log
+Groups SQL by fingerprint (the statement with its literals and IN-list
+lengths stripped), records a sample of all statements plus every statement
+over a threshold to a rotating JSON lines log, and ranks the fingerprints
+by total time, count and p99 for `flask db slow-queries`
+"""
+
+import os
+import re
+import json
+import math
+import atexit
+import glob
+import queue
+import random
+import hashlib
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from functools import wraps
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from time import perf_counter
+
+from flask import request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LOG_FILENAME = 'slow_queries.log'
+DEFAULT_THRESHOLD_MS = 100
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+MAX_STATEMENT_CHARS = 2000
+MAX_EXPLAINED = 1000  # Fingerprints explained per process before EXPLAIN stops
+EXPLAINABLE = ('select', 'with')
+
+_source = contextvars.ContextVar('slow_query_source', default=None)
+
+# Normalisation, applied in order
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NAMED_PARAM = re.compile(r"%\(\w+\)s|(?<![:\w]):\w+\b|\$\d+|%s")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_ROWS = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(statement):
+    """
+    Statement with literals and placeholders replaced by ?, IN lists and
+    multi-row VALUES collapsed, and whitespace squeezed
+
+    `IN (?, ?, ?)` and `IN (?)` both become `IN (?+)`, so an IN query has
+    one fingerprint however many ids it is given.
+    """
+    text = _STRING.sub('?', statement)
+    text = _NAMED_PARAM.sub('?', text)
+    text = _NUMBER.sub('?', text)
+    text = _IN_LIST.sub('IN (?+)', text)
+    text = _VALUES_ROWS.sub(r'\1, ...', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def fingerprint(statement):
+    """
+    Returns:
+        (16 hex character id, normalized statement)
+    """
+    normalized = normalize(statement)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16], normalized
+
+
+def query_source(name):
+    """
+    Decorator attributing the queries of a function to name in the log,
+    for code that runs under many endpoints (before_request hooks, model
+    helpers). Queries outside any tagged function are attributed to the
+    request endpoint.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            token = _source.set(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _source.reset(token)
+        return wrapper
+    return decorator
+
+
+def _current_source():
+    source = _source.get()
+    if source:
+        return source
+    if has_request_context():
+        return request.endpoint or request.path
+    return 'cli'
+
+
+class SlowQueryLog:
+    """
+    Sampled statement timing written through a background thread
+
+    Each statement is timed; it is logged when it falls in the
+    SLOW_QUERY_SAMPLE_RATE sample (an unbiased picture of all queries) or
+    runs longer than SLOW_QUERY_THRESHOLD_MS (every slow one). The file
+    write happens on a QueueListener thread, never in the request. The
+    first time a SELECT fingerprint is slow, its plan is captured on a
+    background connection and logged once.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.log_dir = None
+        self._threshold = DEFAULT_THRESHOLD_MS / 1000
+        self._sample_rate = DEFAULT_SAMPLE_RATE
+        self._explain = True
+        self._queue = None
+        self._listener = None
+        self._log = logging.getLogger('pcm.slow_queries')
+        self._explained = set()
+        self._explain_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.log_dir = os.path.join(app.instance_path, 'slow_queries')
+        if not app.config.get('SLOW_QUERY_LOG', True):
+            return
+        self._threshold = float(app.config.get('SLOW_QUERY_THRESHOLD_MS', DEFAULT_THRESHOLD_MS)) / 1000
+        self._sample_rate = min(1.0, max(0.0, float(app.config.get('SLOW_QUERY_SAMPLE_RATE', DEFAULT_SAMPLE_RATE))))
+        self._explain = app.config.get('SLOW_QUERY_EXPLAIN', True)
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            handler = RotatingFileHandler(
+                os.path.join(self.log_dir, LOG_FILENAME),
+                maxBytes=int(app.config.get('SLOW_QUERY_LOG_MAX_MB', DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024,
+                backupCount=int(app.config.get('SLOW_QUERY_LOG_BACKUPS', DEFAULT_BACKUPS)),
+                encoding='utf-8',
+            )
+        except OSError as e:
+            logger.warning(f"Slow query log disabled, cannot write to {self.log_dir}: {e}")
+            return
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self._queue = queue.SimpleQueue()
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+        atexit.register(self._listener.stop)
+        self._log.handlers = [QueueHandler(self._queue)]
+        self._log.setLevel(logging.INFO)
+        self._log.propagate = False
+        self.enabled = True
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def observe(self, conn, statement, parameters, context, executemany, elapsed):
+        sampled = random.random() < self._sample_rate
+        slow = elapsed >= self._threshold
+        if not (sampled or slow):
+            return
+        fingerprint_id, normalized = fingerprint(statement)
+        source = _current_source()
+        self._write({
+            'type': 'query',
+            'at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'fp': fingerprint_id,
+            'ms': round(elapsed * 1000, 3),
+            'sampled': sampled,
+            'rate': self._sample_rate,
+            'slow': slow,
+            'source': source,
+            'sql': normalized[:MAX_STATEMENT_CHARS],
+        })
+        if slow and self._explain and not executemany:
+            self._explain_later(conn.engine, fingerprint_id, statement, parameters, source)
+
+    def _write(self, record):
+        self._log.info(json.dumps(record, default=str))
+
+    def _explain_later(self, engine, fingerprint_id, statement, parameters, source):
+        if statement.lstrip().split(None, 1)[0].lower() not in EXPLAINABLE:
+            return
+        with self._explain_lock:
+            if fingerprint_id in self._explained or len(self._explained) >= MAX_EXPLAINED:
+                return
+            self._explained.add(fingerprint_id)
+        threading.Thread(
+            target=self._capture_plan,
+            args=(engine, fingerprint_id, statement, parameters, source),
+            name='slow-query-explain', daemon=True
+        ).start()
+
+    def _capture_plan(self, engine, fingerprint_id, statement, parameters, source):
+        prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+        try:
+            with engine.connect() as conn:
+                rows = conn.execution_options(slow_query_log=False).exec_driver_sql(
+                    prefix + statement, parameters
+                ).fetchall()
+            plan = [' '.join(str(value) for value in row[-1:]) if engine.dialect.name == 'sqlite'
+                    else str(row[0]) for row in rows]
+        except Exception as e:
+            plan = [f'EXPLAIN failed: {e}']
+        self._write({
+            'type': 'plan',
+            'at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'fp': fingerprint_id,
+            'source': source,
+            'plan': plan,
+        })
+
+    def log_files(self, log_dir=None):
+        """Current and rotated log files, oldest first"""
+        base = os.path.join(log_dir or self.log_dir, LOG_FILENAME)
+        rotated = sorted(glob.glob(base + '.*'), key=lambda path: int(path.rsplit('.', 1)[1])
+                         if path.rsplit('.', 1)[1].isdigit() else 0, reverse=True)
+        return rotated + ([base] if os.path.exists(base) else [])
+
+    def flush(self):
+        """Write out queued records, e.g. before reading the log in the same process"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener.start()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._slow_query_started = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_slow_query_started', None)
+    if started is None or not slow_query_log.enabled:
+        return
+    if context.execution_options.get('slow_query_log') is False:
+        return
+    slow_query_log.observe(conn, statement, parameters, context, executemany, perf_counter() - started)
+
+
+def _p99(values):
+    """Nearest-rank 99th percentile"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[max(1, math.ceil(0.99 * len(ordered))) - 1]
+
+
+def slow_query_report(log_dir=None, since=None, source=None, sort='total', limit=20):
+    """
+    Rank fingerprints from the log files
+
+    Count, total time and p99 are estimated from the sampled records (each
+    stands for 1/rate statements). Slow records outside the sample only add
+    to slow_count and max_ms, so they do not skew the estimates.
+
+    Args:
+        log_dir: Directory of the log, the app's instance/slow_queries by default
+        since: Only records at or after this aware datetime
+        source: Only records attributed to this source (endpoint or query_source name)
+        sort: 'total', 'count', 'p99' or 'slow'
+        limit: Number of fingerprints returned
+
+    Returns:
+        List of dictionaries with fp, sql, sources, est_count, est_total_ms,
+        p99_ms, slow_count, max_ms and plan (None until one was captured)
+    """
+    groups = {}
+    plans = {}
+    for path in slow_query_log.log_files(log_dir):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('type') == 'plan':
+                    plans[record['fp']] = record.get('plan')
+                    continue
+                if since and datetime.fromisoformat(record['at']) < since:
+                    continue
+                if source and record.get('source') != source:
+                    continue
+                group = groups.setdefault(record['fp'], {
+                    'fp': record['fp'], 'sql': record['sql'], 'sources': set(),
+                    'est_count': 0.0, 'est_total_ms': 0.0, 'samples': [], 'slow_count': 0, 'max_ms': 0.0,
+                })
+                group['sources'].add(record.get('source'))
+                group['max_ms'] = max(group['max_ms'], record['ms'])
+                if record.get('slow'):
+                    group['slow_count'] += 1
+                if record.get('sampled') and record.get('rate'):
+                    weight = 1 / record['rate']
+                    group['est_count'] += weight
+                    group['est_total_ms'] += record['ms'] * weight
+                    group['samples'].append(record['ms'])
+
+    rows = []
+    for group in groups.values():
+        group['p99_ms'] = _p99(group.pop('samples'))
+        group['sources'] = sorted(name for name in group['sources'] if name)
+        group['plan'] = plans.get(group['fp'])
+        rows.append(group)
+    sort_keys = {
+        'total': lambda row: row['est_total_ms'],
+        'count': lambda row: row['est_count'],
+        'p99': lambda row: row['p99_ms'] or 0,
+        'slow': lambda row: (row['slow_count'], row['max_ms']),
+    }
+    rows.sort(key=sort_keys.get(sort, sort_keys['total']), reverse=True)
+    return rows[:limit]
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,192 @@
+"""
+Stream Slot Manager
+Caps concurrent media responses per user, per IP and globally across every
+web worker, and optionally shapes each stream's throughput
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SLOT_SUFFIX = '.slot'
+
+
+def _scope_name(scope):
+    """Filesystem-safe directory name for a scope key such as 'ip:2001:db8::1'"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', scope)
+
+
+class StreamSlot:
+    """Slots held by one response; release() is idempotent"""
+
+    def __init__(self, manager, handles):
+        self._manager = manager
+        self._handles = handles
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._manager._release_handles(self._handles)
+
+
+class StreamSlotManager:
+    """
+    Counting semaphores shared between processes, one per scope
+
+    Each scope ('global', 'user:<id>', 'ip:<address>') is a directory of
+    numbered slot files and holding a slot means holding an exclusive flock on
+    one of them. Locks die with their process, so a crashed or killed worker
+    can never leak slots. Without fcntl the limits apply per process.
+    """
+
+    def __init__(self):
+        self._slot_dir = None
+        self._local_lock = threading.Lock()
+        self._local_counts = {}
+
+    def init_app(self, slot_dir):
+        self._slot_dir = Path(slot_dir)
+        self._slot_dir.mkdir(parents=True, exist_ok=True)
+
+    def acquire(self, limits, info=None):
+        """
+        Take one slot in every scope, or none at all
+
+        Args:
+            limits: Dictionary of scope key -> maximum concurrent streams (0 = unlimited)
+            info: Details written into the slot files for the admin page
+
+        Returns:
+            StreamSlot to release when the response closes, or None when a scope is full
+        """
+        if self._slot_dir is None:
+            return StreamSlot(self, [])
+        info = dict(info or {}, pid=os.getpid(), started_at=time.time())
+        handles = []
+        for scope, limit in limits.items():
+            if not limit or limit <= 0:
+                continue
+            handle = self._acquire_scope(scope, limit, info)
+            if handle is None:
+                self._release_handles(handles)
+                return None
+            handles.append(handle)
+        return StreamSlot(self, handles)
+
+    def _acquire_scope(self, scope, limit, info):
+        if fcntl is None:
+            with self._local_lock:
+                if self._local_counts.get(scope, 0) >= limit:
+                    return None
+                self._local_counts[scope] = self._local_counts.get(scope, 0) + 1
+            return ('local', scope)
+
+        scope_dir = self._slot_dir / _scope_name(scope)
+        scope_dir.mkdir(exist_ok=True)
+        for index in range(limit):
+            fd = os.open(scope_dir / f"{index}{SLOT_SUFFIX}", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, json.dumps(dict(info, scope=scope)).encode(), 0)
+            return ('fd', fd)
+        return None
+
+    def _release_handles(self, handles):
+        for kind, value in handles:
+            if kind == 'local':
+                with self._local_lock:
+                    self._local_counts[value] = max(0, self._local_counts.get(value, 0) - 1)
+                continue
+            try:
+                fcntl.flock(value, fcntl.LOCK_UN)
+            finally:
+                os.close(value)
+
+    def snapshot(self):
+        """
+        Live occupancy of every scope
+
+        Returns:
+            List of {'scope', 'active', 'streams'} sorted busiest first
+        """
+        if self._slot_dir is None:
+            return []
+        if fcntl is None:
+            with self._local_lock:
+                return [{'scope': scope, 'active': count, 'streams': []}
+                        for scope, count in sorted(self._local_counts.items(), key=lambda kv: -kv[1]) if count]
+
+        scopes = []
+        for scope_dir in self._slot_dir.iterdir():
+            if not scope_dir.is_dir():
+                continue
+            streams = []
+            for slot_file in scope_dir.glob(f"*{SLOT_SUFFIX}"):
+                fd = os.open(slot_file, os.O_RDONLY)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    continue  # Nobody holds this slot
+                except BlockingIOError:
+                    pass
+                finally:
+                    os.close(fd)
+                try:
+                    streams.append(json.loads(slot_file.read_text() or '{}'))
+                except (OSError, ValueError):
+                    streams.append({})
+            if streams:
+                scope = streams[0].get('scope') or scope_dir.name
+                scopes.append({'scope': scope, 'active': len(streams), 'streams': streams})
+        scopes.sort(key=lambda entry: (entry['scope'] != 'global', -entry['active']))
+        return scopes
+
+
+def throttle(iterable, rate_bytes, burst_bytes=None):
+    """
+    Token-bucket throughput cap for a response body iterable
+
+    Args:
+        iterable: Chunks of the response body
+        rate_bytes: Sustained bytes per second
+        burst_bytes: Bucket size, defaults to one second of data
+
+    Yields:
+        The original chunks, delayed so the average rate stays under the cap
+    """
+    capacity = burst_bytes or rate_bytes
+    tokens = capacity
+    last = time.monotonic()
+    try:
+        for chunk in iterable:
+            tokens -= len(chunk)
+            if tokens < 0:
+                time.sleep(-tokens / rate_bytes)
+            now = time.monotonic()
+            tokens = min(capacity, tokens + (now - last) * rate_bytes)
+            last = now
+            yield chunk
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close:
+            close()
+
+
+stream_slots = StreamSlotManager()
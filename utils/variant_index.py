@@ -0,0 +1,150 @@
+"""
+Image Variant Index
+In-memory map of uploaded images to their WebP/AVIF variants, so templates
+can pick an image source without touching the filesystem
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+IMAGES_SUBDIR = 'uploads/images'
+MANIFEST_FILENAME = 'variants.json'
+VERSION_FILENAME = 'variants.version'
+VERSION_CHECK_INTERVAL = 1.0  # Seconds between checks for other workers' writes
+
+
+def get_manifest_path(images_dir):
+    """Path of the variants manifest for an uploads image directory"""
+    return Path(images_dir) / MANIFEST_FILENAME
+
+
+def read_manifest(manifest_path):
+    """Load a manifest file, treating a missing or corrupt file as empty"""
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.error(f"Ignoring unreadable variants manifest {manifest_path}: {e}")
+        return {}
+
+
+class VariantIndex:
+    """
+    Original image path -> {'webp': sibling WebP path or None, 'formats': manifest variants}
+
+    Built once by scanning the uploads directory. Writers in this process
+    update it directly; a version stamp file tells other workers to rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._static_folder = None
+        self._entries = {}
+        self._version = None
+        self._checked_at = 0.0
+
+    @property
+    def images_dir(self):
+        return Path(self._static_folder) / IMAGES_SUBDIR
+
+    @property
+    def version_path(self):
+        return self.images_dir / VERSION_FILENAME
+
+    def build(self, static_folder):
+        """Scan the uploads image directory and the manifest into memory"""
+        self._static_folder = os.path.abspath(static_folder)
+        version = self._read_version()
+        try:
+            names = {entry.name for entry in os.scandir(self.images_dir) if entry.is_file()}
+        except FileNotFoundError:
+            names = set()
+
+        entries = {}
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in {'.png', '.jpg', '.jpeg', '.gif', '.webp'}:
+                continue
+            webp_name = f"{stem}.webp"
+            entries[f"{IMAGES_SUBDIR}/{name}"] = {
+                'webp': f"{IMAGES_SUBDIR}/{webp_name}" if webp_name in names else None,
+                'formats': {}
+            }
+        for image_path, manifest_entry in read_manifest(get_manifest_path(self.images_dir)).items():
+            entry = entries.setdefault(image_path, {'webp': None, 'formats': {}})
+            entry['formats'] = manifest_entry.get('formats', {})
+
+        with self._lock:
+            self._entries = entries
+            self._version = version
+            self._checked_at = time.monotonic()
+        return len(entries)
+
+    def lookup(self, image_path):
+        """Index entry for a static-relative image path, or None"""
+        if self._static_folder is None:
+            return None
+        self._refresh_if_stale()
+        return self._entries.get(image_path)
+
+    def add_file(self, image_path):
+        """Register a file just written under the uploads image directory"""
+        if self._static_folder is None or not image_path.startswith(f"{IMAGES_SUBDIR}/"):
+            return
+        stem, ext = os.path.splitext(image_path)
+        with self._lock:
+            self._entries.setdefault(image_path, {'webp': None, 'formats': {}})
+            if ext.lower() == '.webp':
+                for original, entry in self._entries.items():
+                    if original != image_path and os.path.splitext(original)[0] == stem:
+                        entry['webp'] = image_path
+        self._bump_version()
+
+    def set_variants(self, image_path, variants):
+        """Record the variants generated for an original image"""
+        if self._static_folder is None:
+            return
+        with self._lock:
+            entry = self._entries.setdefault(image_path, {'webp': None, 'formats': {}})
+            entry['formats'] = variants
+            original_webp = variants.get('webp', {}).get('original')
+            if original_webp:
+                entry['webp'] = original_webp['path']
+        self._bump_version()
+
+    def _read_version(self):
+        try:
+            return self.version_path.read_text().strip()
+        except OSError:
+            return None
+
+    def _bump_version(self):
+        """Publish a new version stamp so other workers rebuild their index"""
+        version = f"{time.time_ns()}-{os.getpid()}"
+        try:
+            self.images_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.version_path.with_suffix(f'.{os.getpid()}.tmp')
+            tmp_path.write_text(version)
+            os.replace(tmp_path, self.version_path)
+            self._version = version
+        except OSError as e:
+            logger.error(f"Could not write variant index version stamp: {e}")
+
+    def _refresh_if_stale(self):
+        now = time.monotonic()
+        if now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._read_version() != self._version:
+            self.build(self._static_folder)
+
+
+variant_index = VariantIndex()